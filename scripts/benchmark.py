@@ -0,0 +1,332 @@
+"""Benchmarks del pipeline de actualización ALG con datos sintéticos
+
+Uso:
+    python scripts/benchmark.py                      # motor de diferencias con 30k, 300k y 3M filas
+    python scripts/benchmark.py --tamanos 30000 300000
+    python scripts/benchmark.py --busqueda data/alg-historico.csv
+    python scripts/benchmark.py --pipeline           # todas las etapas de main() contra el baseline
+    python scripts/benchmark.py --pipeline --guardar-baseline
+"""
+import argparse
+import contextlib
+import datetime
+import glob
+import http.server
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import update_alg_data
+from update_alg_data import (aplicar_cambios, buscar_en_indice, clasificar_cambios, crear_keys_productos,
+                             generar_indice_busqueda)
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ARCHIVO_BASELINE = os.path.join(RAIZ, 'scripts', 'benchmark_baseline.json')
+TAMANOS_DEFAULT = [30_000, 300_000, 3_000_000]
+TAMANOS_PIPELINE = [30_000, 100_000]
+# Etapas más rápidas que esto en el baseline son puro ruido y no se comparan
+MINIMO_COMPARABLE = 0.05
+CONSULTAS_BUSQUEDA = ['yerba', 'havanna alfajor', 'premez', 'te', 'cafe', 'glut', 'dulce de leche', 'xyzq']
+
+def generar_historico_sintetico(n_filas, churn=0.01, proporcion_bajas=0.05, seed=0):
+    """Genera un histórico y un listado actual sintéticos con la forma del export de ANMAT
+
+    - `proporcion_bajas` de los productos del histórico ya tienen fecha de baja
+    - `churn` es la fracción del listado que cambia en la corrida (altas, bajas y reactivaciones)
+    """
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, n_filas + 1)
+    marcas = np.array([f"MARCA {i}" for i in range(2_000)])
+    tipos = np.array([f"TIPO {i}" for i in range(60)])
+
+    df_historico = pd.DataFrame({
+        'id': ids,
+        'rnpa': pd.Series(ids).map('{:08d}'.format),
+        'marca': marcas[rng.integers(0, len(marcas), n_filas)],
+        'nombreFantasia': 'NO REGISTRA',
+        'denominacionventa': 'PRODUCTO SINTETICO - LIBRE DE GLUTEN',
+        'TipoProducto': tipos[rng.integers(0, len(tipos), n_filas)],
+        'Estado': 'VIGENTE',
+        'activo': 'Sí',
+        'fecha_alta': '2025-07-26',
+        'fecha_baja': None,
+    })
+    con_baja = rng.random(n_filas) < proporcion_bajas
+    df_historico.loc[con_baja, 'fecha_baja'] = '2025-08-04'
+
+    # Listado actual: activos del histórico, menos bajas, más reactivados y nuevos
+    n_cambios = max(1, int(n_filas * churn))
+    activos = df_historico[~con_baja]
+    bajas = rng.choice(activos.index, size=min(n_cambios, len(activos)), replace=False)
+    reactivados = df_historico[con_baja].index[:n_cambios // 4]
+    nuevos = df_historico.sample(n=n_cambios, random_state=seed, replace=True).copy()
+    nuevos['id'] = np.arange(n_filas + 1, n_filas + 1 + n_cambios)
+
+    df_actual = pd.concat([
+        activos.drop(index=bajas),
+        df_historico.loc[reactivados],
+        nuevos,
+    ], ignore_index=True).drop(columns=['fecha_alta', 'fecha_baja'])
+    df_actual['fecha_alta'] = None
+    df_actual['fecha_baja'] = None
+
+    df_historico['_key'] = crear_keys_productos(df_historico)
+    df_actual['_key'] = crear_keys_productos(df_actual)
+    return df_actual, df_historico
+
+def medir(func, *args):
+    """Ejecuta func(*args) sin sus mensajes de progreso y devuelve (segundos, resultado)"""
+    inicio = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        resultado = func(*args)
+    return time.perf_counter() - inicio, resultado
+
+def benchmark_diff(tamanos):
+    """Mide el motor de diferencias sobre históricos sintéticos de distintos tamaños"""
+    print(f"{'filas':>10} | {'clasificar (s)':>14} | {'aplicar (s)':>11} | {'filas/s':>12}")
+    print(f"{'-' * 10}-+-{'-' * 14}-+-{'-' * 11}-+-{'-' * 12}")
+    for n in tamanos:
+        df_actual, df_historico = generar_historico_sintetico(n)
+        t_clasificar, _ = medir(clasificar_cambios, df_actual, df_historico)
+        t_aplicar, _ = medir(aplicar_cambios, df_actual, df_historico, '2025-08-11')
+        print(f"{n:>10,} | {t_clasificar:>14.3f} | {t_aplicar:>11.3f} | {n / t_aplicar:>12,.0f}")
+
+def cargar_distribuciones(archivo=os.path.join(RAIZ, 'data', 'estadisticas.json')):
+    """Frecuencias reales de marcas, tipos de producto y palabras clave (de estadisticas.json)"""
+    with open(archivo, encoding='utf-8') as f:
+        stats = json.load(f)
+    return {clave: pd.Series(stats[clave], dtype=float)
+            for clave in ['por_marca', 'por_tipo_producto', 'top_palabras_clave']}
+
+def _muestrear(rng, frecuencias, n):
+    return rng.choice(frecuencias.index.to_numpy(), size=n, p=(frecuencias / frecuencias.sum()).to_numpy())
+
+def generar_listado_sintetico(n_filas, distribuciones, rng, primer_id=1):
+    """Listado con las columnas y el formato del export de ANMAT
+
+    Marca y tipo de producto siguen la distribución del padrón real; la
+    denominación combina palabras clave reales con el sufijo habitual.
+    """
+    palabras = [pd.Series(_muestrear(rng, distribuciones['top_palabras_clave'], n_filas)).str.upper() for _ in range(3)]
+    denominacion = palabras[0] + ' ' + palabras[1] + ' SABOR ' + palabras[2] + ' - LIBRE DE GLUTEN'
+    return pd.DataFrame({
+        'id': np.arange(primer_id, primer_id + n_filas),
+        'rnpa': pd.Series(rng.integers(0, 10**8, n_filas)).map('{:08d}'.format),
+        'marca': _muestrear(rng, distribuciones['por_marca'], n_filas),
+        'nombreFantasia': np.where(rng.random(n_filas) < 0.4, 'NO REGISTRA', palabras[1] + ' ' + palabras[0]),
+        'denominacionventa': denominacion,
+        'TipoProducto': _muestrear(rng, distribuciones['por_tipo_producto'], n_filas),
+        'Estado': 'VIGENTE',
+        'activo': 'Sí',
+    })
+
+def evolucionar_listado(df_listado, df_bajas, churn, distribuciones, rng):
+    """Listado de la semana siguiente: bajas, altas, reactivaciones y modificaciones
+
+    `churn` es la fracción del listado dada de baja (y la misma cantidad de altas);
+    un cuarto de esa cantidad son reactivaciones y la mitad, modificaciones.
+    Devuelve (listado nuevo, productos dados de baja acumulados).
+    """
+    n = max(1, int(len(df_listado) * churn))
+    bajas = rng.choice(len(df_listado), size=n, replace=False)
+    df_bajas = pd.concat([df_bajas, df_listado.iloc[bajas]], ignore_index=True)
+    df_listado = df_listado.drop(index=df_listado.index[bajas])
+
+    reactivados = df_bajas.sample(n=min(n // 4, len(df_bajas)), random_state=rng.integers(2**31))
+    df_bajas = df_bajas.drop(index=reactivados.index)
+    nuevos = generar_listado_sintetico(n, distribuciones, rng, primer_id=int(max(df_listado['id'].max(), df_bajas['id'].max())) + 1)
+
+    df_listado = pd.concat([df_listado, reactivados, nuevos], ignore_index=True)
+    modificados = rng.choice(len(df_listado), size=n // 2, replace=False)
+    df_listado.loc[modificados, 'denominacionventa'] = df_listado.loc[modificados, 'denominacionventa'].str.replace(' - LIBRE', ' EN POLVO - LIBRE')
+    return df_listado, df_bajas
+
+def _excel_en_memoria(df):
+    """El listado como .xlsx (lo que devuelve ANMAT al exportar)"""
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+@contextlib.contextmanager
+def servidor_anmat_local():
+    """Servidor HTTP local que imita el formulario ASP.NET de ANMAT y su exportación a Excel
+
+    Devuelve un dict: asignar 'excel' cambia el archivo que se descarga.
+    """
+    estado = {'excel': b''}
+
+    class Manejador(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _responder(self, cuerpo):
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def do_GET(self):
+            campos = ''.join(f'<input type="hidden" name="{nombre}" value="x" />'
+                             for nombre in ['__VIEWSTATE', '__VIEWSTATEGENERATOR', '__EVENTVALIDATION'])
+            self._responder(f'<html><form>{campos}</form></html>'.encode())
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            self._responder(estado['excel'])
+
+    servidor = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Manejador)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    estado['url'] = f'http://127.0.0.1:{servidor.server_port}'
+    try:
+        yield estado
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+
+@contextlib.contextmanager
+def pipeline_offline(directorio, servidor):
+    """Corre main() en `directorio` descargando del servidor local, con la fecha que indique `fecha['hoy']`"""
+    fecha = {'hoy': datetime.datetime(2025, 7, 28)}
+
+    class FechaSimulada(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return fecha['hoy']
+
+    originales = (update_alg_data.datetime, update_alg_data.URL_HOME, update_alg_data.URL_EXPORTAR)
+    update_alg_data.datetime = FechaSimulada
+    update_alg_data.URL_HOME = servidor['url'] + '/Home'
+    update_alg_data.URL_EXPORTAR = servidor['url'] + '/Home/ExportarExcel'
+    cwd = os.getcwd()
+    os.makedirs(os.path.join(directorio, 'data'), exist_ok=True)
+    shutil.copy(os.path.join(RAIZ, 'README.md'), directorio)
+    os.chdir(directorio)
+    try:
+        yield fecha
+    finally:
+        os.chdir(cwd)
+        update_alg_data.datetime, update_alg_data.URL_HOME, update_alg_data.URL_EXPORTAR = originales
+
+def medir_pipeline(n_filas, semanas=3, churn=0.01, seed=0):
+    """Corre el pipeline completo sobre un padrón sintético durante varias semanas
+
+    La primera corrida es la carga inicial y no se mide; de las siguientes se
+    devuelve la mediana de segundos de cada etapa según data/run_report.json,
+    más el tiempo real de la corrida ('total').
+    """
+    rng = np.random.default_rng(seed)
+    distribuciones = cargar_distribuciones()
+    df_listado = generar_listado_sintetico(n_filas, distribuciones, rng)
+    df_bajas = df_listado.iloc[:0]
+    tiempos = []
+    with tempfile.TemporaryDirectory() as directorio, servidor_anmat_local() as servidor, \
+            pipeline_offline(directorio, servidor) as fecha:
+        for semana in range(semanas + 1):
+            if semana:
+                df_listado, df_bajas = evolucionar_listado(df_listado, df_bajas, churn, distribuciones, rng)
+                fecha['hoy'] += datetime.timedelta(days=7)
+            servidor['excel'] = _excel_en_memoria(df_listado)
+            with contextlib.redirect_stdout(io.StringIO()):
+                update_alg_data.main()
+            with open(update_alg_data.ARCHIVO_REPORTE, encoding='utf-8') as f:
+                reporte = json.load(f)
+            if semana:
+                # Las etapas se solapan: 'total' es el tiempo real de la corrida completa
+                tiempos.append({**{nombre: etapa['segundos'] for nombre, etapa in reporte['etapas'].items()},
+                                'total': reporte['segundos_total']})
+    return pd.DataFrame(tiempos).median().round(4).to_dict()
+
+def benchmark_pipeline(tamanos, semanas, churn, archivo_baseline=ARCHIVO_BASELINE, guardar=False, tolerancia=0.25):
+    """Mide cada etapa de main() sin conectarse a ANMAT y la compara con el baseline guardado
+
+    Devuelve True si alguna etapa tardó más que el baseline por encima de la tolerancia.
+    """
+    baseline = {}
+    if os.path.exists(archivo_baseline):
+        with open(archivo_baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    resultados = {}
+    regresiones = False
+    for n in tamanos:
+        resultados[str(n)] = etapas = medir_pipeline(n, semanas, churn)
+        referencia = baseline.get('tamanos', {}).get(str(n), {})
+        print(f"\n{n:,} productos, {semanas} semanas con churn {churn:.1%} (mediana por corrida semanal)")
+        print(f"{'etapa':>22} | {'baseline (s)':>12} | {'actual (s)':>10} | {'relación':>8}")
+        print(f"{'-' * 22}-+-{'-' * 12}-+-{'-' * 10}-+-{'-' * 8}")
+        for nombre, segundos in etapas.items():
+            previo = referencia.get(nombre)
+            if previo is None:
+                print(f"{nombre:>22} | {'-':>12} | {segundos:>10.3f} | {'-':>8}")
+                continue
+            relacion = segundos / previo if previo else float('inf')
+            regresion = previo >= MINIMO_COMPARABLE and relacion > 1 + tolerancia
+            regresiones |= regresion
+            print(f"{nombre:>22} | {previo:>12.3f} | {segundos:>10.3f} | {relacion:>7.2f}x{' ⚠️' if regresion else ''}")
+
+    if guardar:
+        with open(archivo_baseline, 'w', encoding='utf-8') as f:
+            json.dump({'semanas': semanas, 'churn': churn, 'tamanos': {**baseline.get('tamanos', {}), **resultados}},
+                      f, ensure_ascii=False, indent=2)
+        print(f"\n✅ Baseline guardado: {archivo_baseline}")
+    elif regresiones:
+        print(f"\n❌ Hay etapas más de un {tolerancia:.0%} más lentas que el baseline")
+    return regresiones
+
+def _tamano(patron):
+    """(bytes sin comprimir, bytes .gz) de los fragmentos que coinciden con el patrón"""
+    archivos = glob.glob(patron)
+    return sum(os.path.getsize(a) for a in archivos), sum(os.path.getsize(a + '.gz') for a in archivos)
+
+def benchmark_busqueda(archivo_historico):
+    """Mide el tamaño del índice de búsqueda y la latencia de consultas sobre un histórico real"""
+    df_historico = pd.read_csv(archivo_historico)
+    with tempfile.TemporaryDirectory() as directorio:
+        t_generar, _ = medir(generar_indice_busqueda, df_historico, directorio)
+        print(f"Índice generado en {t_generar:.2f} s para {len(df_historico):,} productos\n")
+
+        print(f"{'fragmentos':>12} | {'archivos':>8} | {'KB':>8} | {'KB .gz':>8}")
+        print(f"{'-' * 12}-+-{'-' * 8}-+-{'-' * 8}-+-{'-' * 8}")
+        for nombre, patron in [('vocabulario', 'vocabulario.json'), ('prefijos', 'prefijos/*.json'),
+                               ('trigramas', 'trigramas/*.json'), ('productos', 'productos/*.json')]:
+            patron = os.path.join(directorio, patron)
+            crudo, comprimido = _tamano(patron)
+            print(f"{nombre:>12} | {len(glob.glob(patron)):>8} | {crudo / 1024:>8.1f} | {comprimido / 1024:>8.1f}")
+
+        # En frío cada consulta lee sus fragmentos; en caliente ya están en memoria, como en el navegador
+        print(f"\n{'consulta':>16} | {'resultados':>10} | {'frío (ms)':>9} | {'caliente (ms)':>13} | {'KB leídos':>9}")
+        print(f"{'-' * 16}-+-{'-' * 10}-+-{'-' * 9}-+-{'-' * 13}-+-{'-' * 9}")
+        for consulta in CONSULTAS_BUSQUEDA:
+            cache = {}
+            t_frio, (total, _) = medir(buscar_en_indice, consulta, directorio, 50, cache)
+            t_caliente, _ = medir(buscar_en_indice, consulta, directorio, 50, cache)
+            leidos = sum(os.path.getsize(path) for path in cache) / 1024
+            print(f"{consulta:>16} | {total:>10,} | {t_frio * 1000:>9.2f} | {t_caliente * 1000:>13.2f} | {leidos:>9.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tamanos', type=int, nargs='+')
+    parser.add_argument('--busqueda', metavar='HISTORICO', help='Medir el índice de búsqueda sobre este CSV histórico')
+    parser.add_argument('--pipeline', action='store_true', help='Medir todas las etapas de main() con datos sintéticos')
+    parser.add_argument('--semanas', type=int, default=3, help='Corridas semanales medidas después de la carga inicial')
+    parser.add_argument('--churn', type=float, default=0.01, help='Fracción del listado que cambia cada semana')
+    parser.add_argument('--baseline', default=ARCHIVO_BASELINE)
+    parser.add_argument('--guardar-baseline', action='store_true', help='Guardar los tiempos medidos como nuevo baseline')
+    parser.add_argument('--tolerancia', type=float, default=0.25, help='Aumento admitido respecto del baseline')
+    args = parser.parse_args()
+    if args.busqueda:
+        benchmark_busqueda(args.busqueda)
+    elif args.pipeline:
+        regresiones = benchmark_pipeline(args.tamanos or TAMANOS_PIPELINE, args.semanas, args.churn,
+                                         args.baseline, args.guardar_baseline, args.tolerancia)
+        sys.exit(1 if regresiones else 0)
+    else:
+        benchmark_diff(args.tamanos or TAMANOS_DEFAULT)
@@ -1,12 +1,44 @@
 import requests
 import re
+import numpy as np
 import pandas as pd
 from datetime import datetime
+from html.parser import HTMLParser
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import contextlib
+import glob
+import gzip
+import hashlib
+import json
 import os
+import queue
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
 
-def descargar_excel_alg():
-    """Descarga el archivo Excel más reciente de ALG ANMAT"""
-    
+URL_HOME = "https://listadoalg.anmat.gob.ar/Home"
+URL_EXPORTAR = "https://listadoalg.anmat.gob.ar/Home/ExportarExcel"
+TIMEOUT = (10, 120)  # (conexión, lectura) en segundos
+
+class _CamposOcultos(HTMLParser):
+    """Junta los <input type="hidden"> del formulario ASP.NET (__VIEWSTATE, etc.)"""
+
+    def __init__(self):
+        super().__init__()
+        self.campos = {}
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'input':
+            attrs = dict(attrs)
+            if attrs.get('type', '').lower() == 'hidden' and attrs.get('name'):
+                self.campos[attrs['name']] = attrs.get('value') or ''
+
+def crear_sesion(reintentos=5, backoff=1.0):
+    """Sesión HTTP con conexiones reutilizables y reintentos con backoff exponencial"""
     session = requests.Session()
     
     # Headers para simular navegador
@@ -14,22 +46,71 @@ def descargar_excel_alg():
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
     })
     
+    retry = Retry(
+        total=reintentos,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        # La exportación es idempotente, así que también se reintenta el POST
+        allowed_methods=frozenset({'GET', 'POST'}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=2)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def _guardar_descarga(response, filename):
+    """Escribe una respuesta HTTP por bloques en un temporal y lo renombra al final
+
+    Así una descarga cortada nunca deja un Excel a medias.
+    """
+    response.raise_for_status()
+    inicio = time.perf_counter()
+    
+    # Crear directorio si no existe
+    directorio = os.path.dirname(filename) or '.'
+    os.makedirs(directorio, exist_ok=True)
+    
+    fd, temporal = tempfile.mkstemp(dir=directorio, suffix='.xlsx.part')
+    try:
+        total_bytes = 0
+        with os.fdopen(fd, 'wb') as f:
+            for bloque in response.iter_content(chunk_size=1 << 20):
+                f.write(bloque)
+                total_bytes += len(bloque)
+        os.replace(temporal, filename)
+    except BaseException:
+        os.remove(temporal)
+        raise
+    
+    segundos = time.perf_counter() - inicio
+    print(f"✅ Archivo descargado: {filename} "
+          f"({total_bytes / 1e6:.1f} MB en {segundos:.1f}s, {total_bytes / 1e6 / max(segundos, 1e-9):.2f} MB/s)")
+    return filename
+
+def descargar_excel_alg(url_home=URL_HOME, url_exportar=URL_EXPORTAR, filename='data/alg-listado.xlsx',
+                        session=None, timeout=TIMEOUT):
+    """Descarga el archivo Excel más reciente de ALG ANMAT (formulario ASP.NET)"""
+    
+    session = session or crear_sesion()
+    
     try:
         print("Obteniendo página inicial...")
-        response = session.get("https://listadoalg.anmat.gob.ar/Home")
+        response = session.get(url_home, timeout=timeout)
         response.raise_for_status()
-        html = response.text
         
         # Extraer valores del formulario
-        viewstate = re.search(r'name="__VIEWSTATE".*?value="([^"]*)"', html, re.DOTALL).group(1)
-        viewstate_gen = re.search(r'name="__VIEWSTATEGENERATOR".*?value="([^"]*)"', html).group(1)
-        event_validation = re.search(r'name="__EVENTVALIDATION".*?value="([^"]*)"', html, re.DOTALL).group(1)
+        parser = _CamposOcultos()
+        parser.feed(response.text)
+        faltantes = {'__VIEWSTATE', '__VIEWSTATEGENERATOR', '__EVENTVALIDATION'} - parser.campos.keys()
+        if faltantes:
+            raise ValueError(f"Faltan campos del formulario: {', '.join(sorted(faltantes))}")
         
         # Datos del formulario
         data = {
-            '__VIEWSTATE': viewstate,
-            '__VIEWSTATEGENERATOR': viewstate_gen,
-            '__EVENTVALIDATION': event_validation,
+            '__VIEWSTATE': parser.campos['__VIEWSTATE'],
+            '__VIEWSTATEGENERATOR': parser.campos['__VIEWSTATEGENERATOR'],
+            '__EVENTVALIDATION': parser.campos['__EVENTVALIDATION'],
             'ctl00$ContentPlaceHolder1$txtRNPA': '',
             'ctl00$ContentPlaceHolder1$txtMarcaFantasia': '',
             'ctl00$ContentPlaceHolder1$ddEstado': '-1',
@@ -38,153 +119,525 @@ def descargar_excel_alg():
         }
         
         print("Descargando archivo Excel...")
-        excel_response = session.post("https://listadoalg.anmat.gob.ar/Home/ExportarExcel", data=data)
-        excel_response.raise_for_status()
-        
-        # Crear directorio si no existe
-        os.makedirs('data', exist_ok=True)
-        
-        # Guardar archivo sin fecha
-        filename = 'data/alg-listado.xlsx'
-        
-        with open(filename, 'wb') as f:
-            f.write(excel_response.content)
-        
-        print(f"✅ Archivo descargado: {filename}")
-        return filename
+        with session.post(url_exportar, data=data, timeout=timeout, stream=True) as excel_response:
+            return _guardar_descarga(excel_response, filename)
         
     except Exception as e:
         print(f"❌ Error: {e}")
         raise
 
+def descargar_excel_directo(url, filename, session=None, timeout=TIMEOUT):
+    """Descarga un Excel publicado en una URL fija (listados sin formulario)"""
+    session = session or crear_sesion()
+    
+    try:
+        print(f"Descargando archivo Excel de {url}...")
+        with session.get(url, timeout=timeout, stream=True) as response:
+            return _guardar_descarga(response, filename)
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        raise
+
 def crear_key_producto(row):
     """Usa solo la columna 'id' como clave única de producto"""
     return str(row['id'])
 
-def actualizar_historico(df_actual):
-    """Actualiza el archivo histórico con fechas de alta/baja"""
+def crear_keys_productos(df):
+    """Versión vectorizada de crear_key_producto para todo el DataFrame"""
+    return df['id'].astype(str)
+
+def clasificar_cambios(df_actual, df_historico):
+    """Clasifica productos en nuevos, reactivados, existentes y eliminados en una sola pasada
+
+    Usa joins por hash (isin sobre '_key') en lugar de filtrar el histórico por
+    cada clave. Devuelve máscaras booleanas alineadas con cada DataFrame.
+    """
+    en_historico = df_actual['_key'].isin(df_historico['_key'])
+    en_actual = df_historico['_key'].isin(df_actual['_key'])
+
+    # Un producto presente en ambos que tenía fecha de baja vuelve al listado
+    keys_con_baja = df_historico.loc[en_actual & df_historico['fecha_baja'].notna(), '_key']
+    reactivado = df_actual['_key'].isin(keys_con_baja)
+
+    return {
+        'nuevo': ~en_historico,
+        'reactivado': reactivado,
+        'existente': en_historico,
+        'eliminado': ~en_actual & df_historico['fecha_baja'].isna(),
+        'sin_cambios': en_historico & ~reactivado,
+    }
+
+def _texto(df):
+    """Valores como texto, con los nulos vacíos (sin fillna: una categórica no admite '')"""
+    return df.astype(str).mask(df.isna().to_numpy(), '')
+
+def detectar_modificaciones(df_existentes, df_historico, fecha_hoy, candidatos=None):
+    """Compara campo a campo los productos existentes contra su versión en el histórico
+
+    La comparación es vectorizada sobre ambos DataFrames alineados por '_key'.
+    `candidatos` limita la comparación a esas claves (ej. filas cuya huella cambió).
+    Devuelve los eventos 'modificacion' (con los datos nuevos, los campos que
+    cambiaron y sus valores anteriores) o None si no hubo cambios.
+    """
+    if candidatos is not None:
+        df_existentes = df_existentes[df_existentes['_key'].isin(candidatos)]
+    columnas = [c for c in df_existentes.columns
+                if c in df_historico.columns and c not in ('id', '_key', 'fecha_alta', 'fecha_baja')]
+    previos = df_historico.drop_duplicates('_key', keep='last').set_index('_key').reindex(df_existentes['_key'])[columnas]
+    actuales = df_existentes[columnas]
+
+    # Se compara como texto para que None/NaN y tipos distintos (ej. rnpa numérico) no den falsos positivos
+    distinto = pd.DataFrame(
+        _texto(previos).to_numpy() != _texto(actuales).to_numpy(),
+        index=df_existentes.index, columns=columnas,
+    )
+    modificado = distinto.any(axis=1)
+    if not modificado.any():
+        return None
+
+    distinto = distinto[modificado]
+    previos = previos[modificado.to_numpy()]
+    modificaciones_df = df_existentes[modificado].copy()
+    modificaciones_df['tipo_cambio'] = 'modificacion'
+    modificaciones_df['fecha_cambio'] = fecha_hoy
+    modificaciones_df['campos_modificados'] = distinto.dot(pd.Index(columnas) + '|').str.rstrip('|')
+    modificaciones_df['valores_anteriores'] = [
+        json.dumps({c: v for c, v, d in zip(columnas, valores, cambios) if d}, ensure_ascii=False, default=str)
+        for valores, cambios in zip(previos.astype(object).where(previos.notna(), None).to_numpy(), distinto.to_numpy())
+    ]
+    return modificaciones_df
+
+def aplicar_cambios(df_actual, df_historico, fecha_hoy, candidatos_modificacion=None):
+    """Aplica la clasificación al histórico y devuelve (histórico, cambios de la corrida)"""
+    masks = clasificar_cambios(df_actual, df_historico)
+
+    print(f"Productos nuevos: {int(masks['nuevo'].sum())}")
+    print(f"Productos reactivados: {int(masks['reactivado'].sum())}")
+    print(f"Productos eliminados: {int(masks['eliminado'].sum())}")
+
+    # Un histórico armado a mano (o de versiones anteriores) puede traer columnas de eventos
+    df_historico = df_historico.drop(columns=COLUMNAS_EVENTO, errors='ignore')
+    altas_corrida = []
+    modificaciones_corrida = []
+    bajas_corrida = []
+
+    # Marcar productos eliminados con fecha de baja y registrar bajas
+    if masks['eliminado'].any():
+        # Sin bajas previas la columna se lee como float (todo NaN)
+        df_historico['fecha_baja'] = df_historico['fecha_baja'].astype(object)
+        df_historico.loc[masks['eliminado'], 'fecha_baja'] = fecha_hoy
+        bajas_df = df_historico[masks['eliminado']].copy()
+        bajas_df['tipo_cambio'] = 'baja'
+        bajas_df['fecha_cambio'] = fecha_hoy
+        bajas_corrida.append(bajas_df)
+
+    # Productos nuevos: alta con fecha de hoy
+    productos_nuevos_df = df_actual[masks['nuevo']].copy()
+    productos_nuevos_df['fecha_alta'] = fecha_hoy
+    productos_nuevos_df['fecha_baja'] = None
+    if not productos_nuevos_df.empty:
+        productos_nuevos_df['tipo_cambio'] = 'alta_nuevo'
+        productos_nuevos_df['fecha_cambio'] = fecha_hoy
+        # Un alta casi igual a un producto dado de baja suele ser una reinscripción con otro id
+        fuera_del_listado = df_historico['fecha_baja'].notna() & ~df_historico['_key'].isin(df_actual['_key'])
+        reinscripcion_de = vincular_reinscripciones(productos_nuevos_df, df_historico[fuera_del_listado])
+        if reinscripcion_de.notna().any():
+            print(f"Posibles reinscripciones: {int(reinscripcion_de.notna().sum())}")
+            altas_corrida.append(productos_nuevos_df.assign(reinscripcion_de=reinscripcion_de.astype('Int64')))
+        else:
+            altas_corrida.append(productos_nuevos_df)
+
+    # Productos existentes: datos actuales manteniendo fechas originales
+    productos_existentes_df = df_actual[masks['existente']].copy()
+    if not productos_existentes_df.empty:
+        print("Actualizando información de productos existentes...")
+        fechas_mapping = df_historico.drop_duplicates('_key', keep='last').set_index('_key')
+        productos_existentes_df['fecha_alta'] = productos_existentes_df['_key'].map(fechas_mapping['fecha_alta'])
+        productos_existentes_df['fecha_baja'] = productos_existentes_df['_key'].map(fechas_mapping['fecha_baja'])
+
+        # Reactivados: vuelven a estar activos desde hoy
+        reactivados = masks['reactivado'][masks['existente']]
+        if reactivados.any():
+            productos_existentes_df.loc[reactivados, 'fecha_alta'] = fecha_hoy
+            productos_existentes_df.loc[reactivados, 'fecha_baja'] = None
+            reactivados_df = productos_existentes_df[reactivados].copy()
+            reactivados_df['tipo_cambio'] = 'alta_reactivado'
+            reactivados_df['fecha_cambio'] = fecha_hoy
+            altas_corrida.append(reactivados_df)
+
+        # Cambios en los datos de productos que siguen activos
+        modificaciones_df = detectar_modificaciones(
+            productos_existentes_df[~reactivados], df_historico, fecha_hoy, candidatos_modificacion)
+        if modificaciones_df is not None:
+            print(f"Productos modificados: {len(modificaciones_df)}")
+            modificaciones_corrida.append(modificaciones_df)
+
+    # Reconstruir histórico: registros que ya no están + nuevos + existentes.
+    # Las partes vacías se descartan antes del concat (pandas avisa que dejarán de definir los dtypes)
+    partes = [df_historico[~df_historico['_key'].isin(df_actual['_key'])], productos_nuevos_df, productos_existentes_df]
+    df_historico = pd.concat([df for df in partes if not df.empty] or partes[:1], ignore_index=True)
+
+    cambios_corrida = [df for df in altas_corrida + modificaciones_corrida + bajas_corrida if not df.empty]
+    cambios_corrida_df = pd.concat(cambios_corrida, ignore_index=True) if cambios_corrida else None
+    return df_historico, cambios_corrida_df
+
+DIR_EVENTOS = 'data/eventos'
+ARCHIVO_HISTORICO = 'data/alg-historico.csv'
+ARCHIVO_ALTAS_BAJAS = 'data/altas_bajas.csv'
+ARCHIVO_LISTADO = 'data/alg-listado.csv'
+ARCHIVO_EXCEL = 'data/alg-listado.xlsx'
+
+FUENTE_PRINCIPAL = 'anmat'
+DIR_FUENTES = 'data/fuentes'
+
+# Rutas de cada fuente, relativas a su directorio (data/ para la principal,
+# data/fuentes/<nombre>/ para las demás)
+RUTAS_FUENTE = {
+    'eventos': 'eventos',
+    'historico': 'alg-historico.csv',
+    'altas_bajas': 'altas_bajas.csv',
+    'listado': 'alg-listado.csv',
+    'excel': 'alg-listado.xlsx',
+    'huellas': 'huellas.json',
+    'presencia': 'presencia.npz',
+}
+
+def rutas_fuente(nombre=FUENTE_PRINCIPAL):
+    """Rutas del histórico de una fuente (las de siempre para la principal)
+
+    Las funciones que leen o escriben el histórico reciben estas rutas en
+    `rutas`; si no se pasan, usan las de la fuente principal.
+    """
+    directorio = 'data' if nombre == FUENTE_PRINCIPAL else os.path.join(DIR_FUENTES, nombre)
+    return {clave: os.path.join(directorio, archivo) for clave, archivo in RUTAS_FUENTE.items()}
+
+COLUMNAS_CATEGORICAS = ['marca', 'TipoProducto', 'Estado', 'activo', 'tipo_cambio']
+COLUMNAS_FECHA = ['fecha_alta', 'fecha_baja', 'fecha_cambio']
+# Columnas que solo tienen sentido en el registro de cambios
+COLUMNAS_EVENTO = ['tipo_cambio', 'fecha_cambio', 'campos_modificados', 'valores_anteriores', 'reinscripcion_de']
+
+def archivo_snapshot(archivo_csv):
+    """Ruta del snapshot columnar (Feather) que acompaña a un CSV"""
+    return os.path.splitext(archivo_csv)[0] + '.feather'
+
+def tipar_columnas(df):
+    """Convierte a tipos compactos: id entero, categóricas y fechas"""
+    df = df.copy()
+    if 'id' in df.columns and df['id'].notna().all():
+        df['id'] = df['id'].astype('int64')
+    for columna in df.columns:
+        if columna in COLUMNAS_CATEGORICAS:
+            df[columna] = df[columna].astype('category')
+        elif columna in COLUMNAS_FECHA:
+            df[columna] = pd.to_datetime(df[columna], errors='coerce')
+        elif df[columna].dtype == object:
+            # Columnas mixtas (ej. rnpa numérico y con guiones) se guardan como texto
+            df[columna] = df[columna].where(df[columna].isna(), df[columna].astype(str))
+    return df
+
+def guardar_snapshot(df, archivo_csv, hasta=None):
+    """Escribe el snapshot columnar junto al CSV (requiere pyarrow; si no está, no hace nada)
+
+    `hasta` indica la fecha del último segmento de cambios incluido en el snapshot.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.feather as feather
+    except ImportError:
+        return None
+
+    tabla = pa.Table.from_pandas(tipar_columnas(df), preserve_index=False)
+    # Fechas como date32 en lugar de timestamp
+    for i, campo in enumerate(tabla.schema):
+        if campo.name in COLUMNAS_FECHA:
+            tabla = tabla.set_column(i, pa.field(campo.name, pa.date32()), tabla.column(i).cast(pa.date32()))
+    if hasta is not None:
+        tabla = tabla.replace_schema_metadata({**(tabla.schema.metadata or {}), b'hasta': hasta.encode()})
+
+    archivo = archivo_snapshot(archivo_csv)
+    # Sin compresión para poder leerlo con memory mapping
+    feather.write_feather(tabla, archivo, compression='uncompressed')
+    print(f"✅ Snapshot columnar: {archivo}")
+    return archivo
+
+def leer_snapshot(archivo_csv):
+    """Lee el snapshot columnar de un CSV con memory mapping
+
+    Devuelve (DataFrame tipado, fecha hasta) o (None, None) si no hay snapshot o pyarrow.
+    """
+    archivo = archivo_snapshot(archivo_csv)
+    if not os.path.exists(archivo):
+        return None, None
+    try:
+        import pyarrow.feather as feather
+    except ImportError:
+        return None, None
+
+    tabla = feather.read_table(archivo, memory_map=True)
+    hasta = (tabla.schema.metadata or {}).get(b'hasta')
+    df = tabla.to_pandas(date_as_object=False)
+    return df, hasta.decode() if hasta else None
+
+def _fechas_como_texto(df):
+    """Vuelve las columnas de fecha al formato YYYY-MM-DD que usan los CSV y los segmentos"""
+    for columna in df.columns.intersection(COLUMNAS_FECHA):
+        if pd.api.types.is_datetime64_any_dtype(df[columna]):
+            df[columna] = df[columna].dt.strftime('%Y-%m-%d')
+    return df
+
+def _fecha_segmento(path):
+    """Extrae la fecha (YYYY-MM-DD) del nombre de un archivo base-*.csv o cambios-*.csv"""
+    return os.path.basename(path).split('-', 1)[1][:-len('.csv')]
+
+def archivo_base(rutas=None):
+    """Devuelve la ruta del punto de partida del histórico de eventos, o None si no existe"""
+    rutas = rutas or rutas_fuente()
+    bases = sorted(glob.glob(os.path.join(rutas['eventos'], 'base-*.csv')))
+    return bases[-1] if bases else None
+
+def segmentos_cambios(desde=None, rutas=None):
+    """Lista los segmentos de cambios en orden cronológico (opcionalmente desde la fecha `desde`, incluida)
+
+    El segmento de `desde` se incluye porque una segunda corrida ese mismo día
+    le agrega filas después de armado el snapshot o el punto de partida.
+    """
+    rutas = rutas or rutas_fuente()
+    segmentos = sorted(glob.glob(os.path.join(rutas['eventos'], 'cambios-*.csv')))
+    if desde is not None:
+        segmentos = [s for s in segmentos if _fecha_segmento(s) >= desde]
+    return segmentos
+
+def agregar_segmento(cambios_df, fecha, rutas=None):
+    """Agrega los cambios de una corrida a su segmento (solo escribe el delta)"""
+    rutas = rutas or rutas_fuente()
+    os.makedirs(rutas['eventos'], exist_ok=True)
+    segmento = os.path.join(rutas['eventos'], f'cambios-{fecha}.csv')
+    if os.path.exists(segmento):
+        # Segunda corrida en el mismo día: si trae columnas nuevas (ej. la primera solo tuvo bajas y
+        # esta tiene modificaciones) se reescribe el segmento con todas; si no, solo se agregan filas
+        columnas = pd.read_csv(segmento, nrows=0).columns
+        if cambios_df.columns.difference(columnas).empty:
+            cambios_df.reindex(columns=columnas).to_csv(segmento, mode='a', header=False, index=False)
+        else:
+            # Como texto, para reescribir las filas existentes tal cual estaban
+            previos = pd.read_csv(segmento, dtype=str, keep_default_na=False)
+            pd.concat([previos, cambios_df], ignore_index=True).to_csv(segmento, index=False)
+    else:
+        cambios_df.to_csv(segmento, index=False)
+    print(f"✅ Cambios agregados: {segmento}")
+
+def _leer_vista(archivo):
+    """Lee una vista CSV previa al histórico de eventos (None si no existe, está vacía o corrupta)"""
+    if not os.path.exists(archivo):
+        return None
+    try:
+        df = pd.read_csv(archivo)
+    except (pd.errors.EmptyDataError, pd.errors.ParserError):
+        df = None
+    if df is None or df.empty:
+        print(f"Archivo {archivo} vacío o corrupto, se ignora")
+        return None
+    return df
+
+def historico_desde_altas_bajas(df_altas_bajas, df_listado=None):
+    """Reconstruye el histórico cuando solo quedó el registro de altas y bajas
+
+    Cada producto con eventos queda como lo dejó su último evento, aunque
+    esté en el último listado procesado: si ese evento es una baja, sigue
+    dado de baja y la próxima corrida registra el alta_reactivado. Los
+    productos del listado sin eventos (estaban desde antes del registro) están
+    activos desde la primera fecha conocida.
+    """
+    ultimos = (df_altas_bajas.sort_values('fecha_cambio', kind='stable')
+                             .drop_duplicates('id', keep='last'))
+    dados_de_baja = ultimos.loc[ultimos['tipo_cambio'].astype(str).str.strip() == 'baja', 'id']
+    ultimos = ultimos.drop(columns=COLUMNAS_EVENTO + ['_key'], errors='ignore')
+    if df_listado is None:
+        return ultimos.sort_values('id', kind='stable').reset_index(drop=True)
+
+    inicio = pd.concat([df_altas_bajas['fecha_alta'], df_altas_bajas['fecha_cambio']]).dropna().min()
+    fecha_alta = ultimos.set_index('id')['fecha_alta']
+    activos = df_listado.drop(columns=['fecha_alta', 'fecha_baja', '_key'], errors='ignore')
+    activos = activos[~activos['id'].isin(dados_de_baja)]
+    activos = activos.assign(fecha_alta=activos['id'].map(fecha_alta).fillna(inicio), fecha_baja=None)
+    df_historico = pd.concat([ultimos[~ultimos['id'].isin(activos['id'])], activos], ignore_index=True)
+    return df_historico.sort_values('id', kind='stable').reset_index(drop=True)
+
+def inicializar_eventos(rutas=None):
+    """Crea el histórico de eventos a partir de alg-historico.csv y altas_bajas.csv si todavía no existe
+
+    Si solo queda altas_bajas.csv, el punto de partida se reconstruye con
+    historico_desde_altas_bajas() y el último listado procesado, así esas
+    altas y bajas pasan al histórico de eventos y no se pierden al compactar.
+    """
+    rutas = rutas or rutas_fuente()
+    if archivo_base(rutas) is not None:
+        return
+    df_historico = _leer_vista(rutas['historico'])
+    df_altas_bajas = _leer_vista(rutas['altas_bajas'])
+    if df_historico is None and df_altas_bajas is None:
+        return
+
+    if df_historico is None:
+        print(f"Reconstruyendo el histórico a partir de {rutas['altas_bajas']}...")
+        df_historico = historico_desde_altas_bajas(df_altas_bajas, _leer_vista(rutas['listado']))
+    print(f"Migrando {rutas['historico']} al histórico de eventos...")
+    os.makedirs(rutas['eventos'], exist_ok=True)
+    # Toda fecha de cambio registrada quedó reflejada en fecha_alta o fecha_baja del histórico
+    fecha_base = pd.concat([df_historico['fecha_alta'], df_historico['fecha_baja']]).dropna().max()
+    df_historico.to_csv(os.path.join(rutas['eventos'], f'base-{fecha_base}.csv'), index=False)
+
+    if df_altas_bajas is not None:
+        for fecha, cambios_df in df_altas_bajas.groupby('fecha_cambio', sort=True):
+            cambios_df.to_csv(os.path.join(rutas['eventos'], f'cambios-{fecha}.csv'), index=False)
+
+def _cargar_altas_bajas(rutas=None):
+    """cargar_altas_bajas() y la fecha hasta la que llega su snapshot (None si no hay)"""
+    rutas = rutas or rutas_fuente()
+    df_snapshot, hasta = leer_snapshot(rutas['altas_bajas'])
+    partes = []
+    if df_snapshot is not None and 'fecha_cambio' in df_snapshot.columns:
+        # Los eventos del día `hasta` se toman del segmento, que puede tener más filas que el snapshot
+        df_snapshot = _fechas_como_texto(df_snapshot)
+        partes.append(df_snapshot[df_snapshot['fecha_cambio'] != hasta])
+    partes += [pd.read_csv(s) for s in segmentos_cambios(desde=hasta, rutas=rutas)]
+    if not partes:
+        return pd.DataFrame(), hasta
+    return pd.concat(partes, ignore_index=True), hasta
+
+def cargar_altas_bajas(rutas=None):
+    """Materializa el registro de altas y bajas concatenando los segmentos de cambios
+
+    Si hay snapshot columnar, solo se leen los segmentos desde su fecha.
+    """
+    return _cargar_altas_bajas(rutas)[0]
+
+def agregar_segmento_a_altas_bajas(df_altas_bajas, hasta, fecha, rutas=None):
+    """Pone al día un registro cargado antes de la corrida con el segmento de `fecha`
+
+    actualizar_historico() solo escribe el segmento del día, así que alcanza
+    con reemplazar esas filas en lugar de volver a cargar todo. `hasta` es la
+    fecha del snapshot que devolvió _cargar_altas_bajas().
+    """
+    segmento = os.path.join((rutas or rutas_fuente())['eventos'], f'cambios-{fecha}.csv')
+    if (hasta is not None and fecha < hasta) or not os.path.exists(segmento):
+        return df_altas_bajas
+    partes = [] if df_altas_bajas.empty else [df_altas_bajas[df_altas_bajas['fecha_cambio'] != fecha]]
+    return pd.concat(partes + [pd.read_csv(segmento)], ignore_index=True)
+
+def _sin_categorias(df):
+    """Convierte las columnas categóricas (las de los snapshots) a object"""
+    return df.astype({c: object for c in df.select_dtypes('category').columns})
+
+def cargar_historico(rutas=None):
+    """Materializa el histórico: punto de partida más los cambios posteriores (el último gana)
+
+    Devuelve None si todavía no hay histórico.
+    """
+    rutas = rutas or rutas_fuente()
+    df_snapshot, hasta = leer_snapshot(rutas['historico'])
+    if df_snapshot is not None:
+        # Como object, igual que al leer los CSV: las categóricas no admiten valores nuevos
+        partes = [_fechas_como_texto(_sin_categorias(df_snapshot))]
+    else:
+        base = archivo_base(rutas)
+        if base is None:
+            return None
+        partes = [pd.read_csv(base)]
+        hasta = _fecha_segmento(base)
+    # El segmento del día `hasta` se vuelve a aplicar completo: sus primeras filas dejan a cada
+    # producto igual que en el punto de partida y las de una segunda corrida ese día se suman
+    partes += [pd.read_csv(s) for s in segmentos_cambios(desde=hasta, rutas=rutas)]
+    df_historico = pd.concat(partes, ignore_index=True)
+    df_historico = df_historico.drop_duplicates('id', keep='last')
+    # Los segmentos son eventos: sus columnas propias no son datos del producto
+    df_historico = df_historico.drop(columns=COLUMNAS_EVENTO + ['_key'], errors='ignore')
+    return df_historico.sort_values('id', kind='stable').reset_index(drop=True)
+
+def _claves_filas(df, claves):
+    """Claves de cada fila como texto, con el id normalizado a entero"""
+    df = df[claves].copy()
+    df['id'] = pd.to_numeric(df['id'], errors='coerce').astype('Int64')
+    return pd.MultiIndex.from_frame(df.astype(str))
+
+def filas_fuera_del_registro(archivo_vista, df_registro, claves):
+    """Cantidad de filas de una vista CSV cuyas claves no aparecen en `df_registro`"""
+    try:
+        df_vista = pd.read_csv(archivo_vista)
+    except (FileNotFoundError, pd.errors.EmptyDataError):
+        return 0
+    if df_registro is None or df_registro.empty or not set(claves) <= set(df_registro.columns):
+        return len(df_vista)
+    return int((~_claves_filas(df_vista, claves).isin(_claves_filas(df_registro, claves))).sum())
+
+def compactar_historico(rutas=None):
+    """Regenera alg-historico.csv y altas_bajas.csv a partir del histórico de eventos"""
+    rutas = rutas or rutas_fuente()
+    inicializar_eventos(rutas)
+    df_historico = cargar_historico(rutas)
+    if df_historico is None:
+        print("No hay histórico de eventos para compactar")
+        return None
+    # Los productos presentes en el listado actual llevan sus datos más recientes
+    if os.path.exists(rutas['listado']):
+        df_listado = pd.read_csv(rutas['listado']).drop_duplicates('id', keep='last').set_index('id')
+        df_historico = df_historico.set_index('id')
+        df_historico.update(df_listado[df_listado.columns.intersection(df_historico.columns)])
+        df_historico = df_historico.reset_index()
+
+    df_altas_bajas = cargar_altas_bajas(rutas)
+    # Las vistas se regeneran desde los eventos: si tienen filas que no están ahí, se perderían
+    for archivo, df_registro, claves in [(rutas['historico'], df_historico, ['id']),
+                                         (rutas['altas_bajas'], df_altas_bajas, ['id', 'tipo_cambio', 'fecha_cambio'])]:
+        faltantes = filas_fuera_del_registro(archivo, df_registro, claves)
+        if faltantes:
+            raise ValueError(f"{archivo} tiene {faltantes:,} filas que no están en {rutas['eventos']}; "
+                             "no se compacta para no perderlas")
+    hasta = max(_fecha_segmento(s) for s in segmentos_cambios(rutas=rutas) + [archivo_base(rutas)] if s)
+
+    df_historico.to_csv(rutas['historico'], index=False)
+    print(f"✅ Histórico compactado: {rutas['historico']}")
+    guardar_snapshot(df_historico, rutas['historico'], hasta=hasta)
+    df_altas_bajas.to_csv(rutas['altas_bajas'], index=False)
+    print(f"✅ Altas y bajas compactadas: {rutas['altas_bajas']}")
+    guardar_snapshot(df_altas_bajas, rutas['altas_bajas'], hasta=hasta)
+    return df_historico
+
+def actualizar_historico(df_actual, ids_modificados=None, df_historico=None, rutas=None):
+    """Actualiza el histórico de eventos con las altas/bajas/modificaciones de la corrida
+
+    Solo se escribe el segmento de cambios del día; alg-historico.csv y
+    altas_bajas.csv se regeneran con compactar_historico(). También se
+    registra la semana en el índice de presencia (data/presencia.npz). Si se pasan
+    `ids_modificados` (por huella de fila), solo esos productos se comparan
+    campo a campo. `df_historico` permite pasar el histórico ya cargado con
+    cargar_historico() (ej. mientras se descargaba el Excel). `rutas` son las
+    de la fuente (ver rutas_fuente).
+    """
+    rutas = rutas or rutas_fuente()
     
     fecha_hoy = datetime.now().strftime('%Y-%m-%d')
-    archivo_historico = 'data/alg-historico.csv'
-    archivo_altas_bajas = 'data/altas_bajas.csv'
     
     # Agregar columnas de fecha si no existen
     if 'fecha_alta' not in df_actual.columns:
         df_actual['fecha_alta'] = None
     if 'fecha_baja' not in df_actual.columns:
         df_actual['fecha_baja'] = None
-
-    # Listas para almacenar altas y bajas de esta corrida
-    altas_corrida = []
-    bajas_corrida = []
     
     # Crear clave única para cada producto actual
-    df_actual['_key'] = df_actual.apply(crear_key_producto, axis=1)
+    df_actual['_key'] = crear_keys_productos(df_actual)
     
-    if os.path.exists(archivo_historico):
+    if df_historico is None:
+        inicializar_eventos(rutas)
+        df_historico = cargar_historico(rutas)
+
+    if df_historico is not None:
         print("Cargando histórico existente...")
-        # Si el archivo existe pero está vacío o corrupto, tratar como primera ejecución (sin recursión)
-        try:
-            df_historico = pd.read_csv(archivo_historico)
-            if df_historico.empty:
-                raise pd.errors.EmptyDataError
-            # Asegurar que el histórico tenga la clave
-            if '_key' not in df_historico.columns:
-                df_historico['_key'] = df_historico.apply(crear_key_producto, axis=1)
-        except (pd.errors.EmptyDataError, pd.errors.ParserError):
-            print("Archivo histórico vacío o corrupto, iniciando desde cero...")
-            os.remove(archivo_historico)
-            # Crear histórico inicial sin recursión
-            df_historico = df_actual.copy()
-            df_historico['fecha_alta'] = fecha_hoy
-            df_historico['fecha_baja'] = None
-            # No registrar altas en la primera ejecución (punto de partida)
-            # Remover columna auxiliar antes de guardar
-            df_historico = df_historico.drop('_key', axis=1)
-            df_actual = df_actual.drop('_key', axis=1)
-            df_historico.to_csv(archivo_historico, index=False)
-            print(f"✅ Histórico actualizado: {archivo_historico}")
-            return df_historico
-        
-        # Encontrar productos nuevos y eliminados
-        keys_actual = set(df_actual['_key'])
-        keys_historico = set(df_historico['_key'])
-        
-        productos_nuevos = keys_actual - keys_historico
-        productos_eliminados = keys_historico - keys_actual
-        productos_reactivados = set()
-
-        # Verificar productos reactivados (dados de alta nuevamente)
-        if productos_nuevos:
-            for key in list(productos_nuevos):  # Usar list para poder modificar el set durante la iteración
-                historico_producto = df_historico[df_historico['_key'] == key]
-                if not historico_producto.empty and not historico_producto['fecha_baja'].isna().all():
-                    # Si el producto ya existía y estaba dado de baja, moverlo a reactivados
-                    productos_nuevos.remove(key)
-                    productos_reactivados.add(key)
-
-        print(f"Productos nuevos: {len(productos_nuevos)}")
-        print(f"Productos reactivados: {len(productos_reactivados)}")
-        print(f"Productos eliminados: {len(productos_eliminados)}")
-
-        # Marcar productos eliminados con fecha de baja y registrar bajas
-        if productos_eliminados:
-            mask_eliminados = df_historico['_key'].isin(productos_eliminados) & df_historico['fecha_baja'].isna()
-            df_historico.loc[mask_eliminados, 'fecha_baja'] = fecha_hoy
-            # Registrar bajas
-            bajas_df = df_historico[mask_eliminados].copy()
-            if not bajas_df.empty:
-                bajas_df['tipo_cambio'] = 'baja'
-                bajas_df['fecha_cambio'] = fecha_hoy
-                bajas_corrida.append(bajas_df)
-
-        # Agregar productos nuevos y registrar altas
-        if productos_nuevos:
-            productos_nuevos_df = df_actual[df_actual['_key'].isin(productos_nuevos)].copy()
-            productos_nuevos_df['fecha_alta'] = fecha_hoy
-            productos_nuevos_df['fecha_baja'] = None
-            # Registrar altas nuevas
-            if not productos_nuevos_df.empty:
-                productos_nuevos_df['tipo_cambio'] = 'alta_nuevo'
-                productos_nuevos_df['fecha_cambio'] = fecha_hoy
-                altas_corrida.append(productos_nuevos_df)
-            # Combinar con histórico
-            df_historico = pd.concat([df_historico, productos_nuevos_df], ignore_index=True)
-
-        # Procesar productos reactivados
-        if productos_reactivados:
-            productos_reactivados_df = df_actual[df_actual['_key'].isin(productos_reactivados)].copy()
-            productos_reactivados_df['fecha_alta'] = fecha_hoy
-            productos_reactivados_df['fecha_baja'] = None
-            # Registrar reactivaciones
-            if not productos_reactivados_df.empty:
-                productos_reactivados_df['tipo_cambio'] = 'alta_reactivado'
-                productos_reactivados_df['fecha_cambio'] = fecha_hoy
-                altas_corrida.append(productos_reactivados_df)
-            # Actualizar en histórico
-            for key in productos_reactivados:
-                df_historico.loc[df_historico['_key'] == key, 'fecha_alta'] = fecha_hoy
-                df_historico.loc[df_historico['_key'] == key, 'fecha_baja'] = None
-        
-        # Actualizar información de productos existentes (mantener fechas originales)
-        productos_existentes = list(keys_actual & keys_historico)
-        if productos_existentes:
-            print("Actualizando información de productos existentes...")
-            # Filtrar registros existentes
-            df_historico_existentes = df_historico[df_historico['_key'].isin(productos_existentes)]
-            df_actual_existentes = df_actual[df_actual['_key'].isin(productos_existentes)]
-            
-            # Crear un mapping de fechas originales
-            fechas_mapping = df_historico_existentes.set_index('_key')[['fecha_alta', 'fecha_baja']]
-            
-            # Actualizar datos manteniendo fechas originales
-            df_actual_existentes = df_actual_existentes.set_index('_key')
-            df_actual_existentes[['fecha_alta', 'fecha_baja']] = fechas_mapping
-            df_actual_existentes = df_actual_existentes.reset_index()
-            
-            # Reemplazar en histórico
-            df_historico = df_historico[~df_historico['_key'].isin(productos_existentes)]
-            df_historico = pd.concat([df_historico, df_actual_existentes], ignore_index=True)
+        df_historico['_key'] = crear_keys_productos(df_historico)
+        df_historico, cambios_corrida_df = aplicar_cambios(df_actual, df_historico, fecha_hoy, ids_modificados)
+        if cambios_corrida_df is not None:
+            agregar_segmento(cambios_corrida_df, fecha_hoy, rutas)
+        actualizar_presencia(df_actual['id'], fecha_hoy, df_historico, rutas)
         
     else:
         print("Creando histórico inicial...")
@@ -193,37 +646,184 @@ def actualizar_historico(df_actual):
         df_historico['fecha_alta'] = fecha_hoy
         df_historico['fecha_baja'] = None
         # No registrar altas en la primera ejecución (punto de partida)
+        os.makedirs(rutas['eventos'], exist_ok=True)
+        df_historico.drop('_key', axis=1).to_csv(os.path.join(rutas['eventos'], f'base-{fecha_hoy}.csv'), index=False)
+        actualizar_presencia(df_actual['id'], fecha_hoy, rutas=rutas)
     
-    # Remover columna auxiliar antes de guardar
+    # Remover columna auxiliar
     df_historico = df_historico.drop('_key', axis=1)
     df_actual = df_actual.drop('_key', axis=1)
+    print(f"✅ Histórico de eventos actualizado: {rutas['eventos']}")
 
-    # Guardar histórico actualizado
-    df_historico.to_csv(archivo_historico, index=False)
-    print(f"✅ Histórico actualizado: {archivo_historico}")
+    return df_historico
 
-    # Guardar/Acumular archivo de altas y bajas
-    if altas_corrida or bajas_corrida:
-        # Concatenar todas las altas y bajas de esta corrida
-        cambios_corrida = []
-        if altas_corrida:
-            cambios_corrida.append(pd.concat(altas_corrida, ignore_index=True))
-        if bajas_corrida:
-            cambios_corrida.append(pd.concat(bajas_corrida, ignore_index=True))
-        cambios_corrida_df = pd.concat(cambios_corrida, ignore_index=True) if cambios_corrida else None
+def _celda_como_texto(valor):
+    """Texto de una celda del Excel, como lo deja pd.read_excel(dtype=str) (None si está vacía)"""
+    if valor is None:
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        # openpyxl devuelve 123.0 para los números guardados con decimales; pandas los escribe como 123
+        valor = int(valor)
+    return str(valor)
 
-        if cambios_corrida_df is not None:
-            # Si ya existe el archivo, acumular
-            if os.path.exists(archivo_altas_bajas):
-                df_altas_bajas = pd.read_csv(archivo_altas_bajas)
-                df_altas_bajas = pd.concat([df_altas_bajas, cambios_corrida_df], ignore_index=True)
-            else:
-                df_altas_bajas = cambios_corrida_df
-            # Guardar
-            df_altas_bajas.to_csv(archivo_altas_bajas, index=False)
-            print(f"✅ Altas y bajas acumuladas: {archivo_altas_bajas}")
+def _lote_excel(filas, columnas):
+    """DataFrame de un lote de filas del Excel: todo como texto salvo el id
 
-    return df_historico
+    Los tipos no se infieren por lote: una columna con números y celdas vacías
+    se escribiría como 123 en un lote y 123.0 en otro, y eso cambia las
+    huellas de las filas y genera modificaciones falsas.
+    """
+    df = pd.DataFrame([[_celda_como_texto(valor) for valor in fila] for fila in filas], columns=columnas, dtype=object)
+    if 'id' in df.columns:
+        df['id'] = pd.to_numeric(df['id'])
+    return df
+
+def _lotes_excel(archivo_excel, tamano_lote):
+    """Lee el Excel en modo streaming (read-only) y devuelve lotes de filas sin limpiar
+
+    Un export con solo el encabezado devuelve un único lote vacío con esas
+    columnas, igual que pd.read_excel.
+    """
+    import openpyxl
+
+    libro = openpyxl.load_workbook(archivo_excel, read_only=True, data_only=True)
+    try:
+        filas = libro.active.iter_rows(values_only=True)
+        columnas = next(filas, ())
+        lote = []
+        vacio = True
+        for fila in filas:
+            if all(valor is None for valor in fila):
+                continue
+            lote.append(fila)
+            if len(lote) >= tamano_lote:
+                yield _lote_excel(lote, columnas)
+                lote = []
+                vacio = False
+        if lote or vacio:
+            yield _lote_excel(lote, columnas)
+    finally:
+        libro.close()
+
+def _en_hilo_lector(lotes):
+    """Consume el generador `lotes` en un hilo aparte, dejando a lo sumo dos lotes esperando"""
+    cola = queue.Queue(maxsize=2)
+    cancelar = threading.Event()
+    fin = object()
+
+    def poner(item):
+        # Si el consumidor dejó de pedir lotes, el lector termina en lugar de quedar bloqueado
+        while not cancelar.is_set():
+            try:
+                cola.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def leer():
+        try:
+            for lote in lotes:
+                if not poner(lote):
+                    return
+            poner(fin)
+        except BaseException as e:
+            poner(e)
+        finally:
+            lotes.close()
+
+    lector = threading.Thread(target=leer, name='lector-excel', daemon=True)
+    lector.start()
+    try:
+        while True:
+            lote = cola.get()
+            if lote is fin:
+                break
+            if isinstance(lote, BaseException):
+                raise lote
+            yield lote
+    finally:
+        cancelar.set()
+        lector.join()
+
+def leer_excel_por_lotes(archivo_excel, tamano_lote=5000, reporte=None):
+    """Lee el Excel en modo streaming (read-only) y devuelve lotes de filas ya normalizadas
+
+    Evita cargar el libro completo en memoria. La lectura corre en un hilo
+    aparte y deja a lo sumo dos lotes esperando: mientras se limpia un lote con
+    limpiar_dataframe (etapa 'ingesta.limpieza' del reporte) ya se está
+    leyendo el siguiente. Con cProfile o tracemalloc se lee en el mismo hilo:
+    cProfile no sigue al hilo lector y solo mediría la espera de la cola.
+    """
+    lotes = _lotes_excel(archivo_excel, tamano_lote)
+    if reporte is None or not (reporte['perfil'] or reporte['memoria']):
+        lotes = _en_hilo_lector(lotes)
+    for lote in lotes:
+        with medir_etapa(reporte, 'ingesta.limpieza', len(lote)) as etapa:
+            df = limpiar_dataframe(lote)
+            etapa['filas_salida'] = len(df)
+        yield df
+
+def ingerir_excel(archivo_excel, archivo_csv, tamano_lote=5000, reporte=None):
+    """Convierte el Excel a CSV por lotes y devuelve cada lote para la etapa de diferencias"""
+    inicio = time.perf_counter()
+    total_filas = 0
+    for i, lote in enumerate(leer_excel_por_lotes(archivo_excel, tamano_lote, reporte)):
+        lote.to_csv(archivo_csv, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+        total_filas += len(lote)
+        yield lote
+
+    segundos = time.perf_counter() - inicio
+    print(f"✅ CSV creado: {archivo_csv} ({total_filas / segundos:,.0f} filas/s, pico RSS {_pico_rss_mb():,.0f} MB)")
+
+ARCHIVO_HUELLAS = 'data/huellas.json'
+
+def huella_archivo(path):
+    """Hash SHA-256 del archivo completo, leído por bloques"""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+def huellas_filas(df):
+    """Hash del contenido de cada fila (sin el id), indexado por id"""
+    columnas = [c for c in df.columns if c not in ('id', '_key', 'fecha_alta', 'fecha_baja')]
+    hashes = pd.util.hash_pandas_object(df[columnas], index=False)
+    return pd.Series(hashes.map('{:016x}'.format).to_numpy(), index=df['id'].astype(str).to_numpy())
+
+def cargar_huellas(rutas=None):
+    """Lee las huellas de la última ejecución ({} si no hay)"""
+    archivo = (rutas or rutas_fuente())['huellas']
+    if not os.path.exists(archivo):
+        return {}
+    with open(archivo) as f:
+        return json.load(f)
+
+def guardar_huellas(huella, filas, rutas=None):
+    """Guarda la huella del archivo y de cada fila (una línea por id para diffs chicos)"""
+    with open((rutas or rutas_fuente())['huellas'], 'w') as f:
+        json.dump({'archivo': huella, 'filas': filas.sort_index().to_dict()}, f, indent=0, sort_keys=True)
+
+def ids_modificados(filas, filas_previas):
+    """Ids presentes en ambas ejecuciones cuyo contenido cambió"""
+    previas = pd.Series(filas_previas, dtype=object)
+    comunes = filas.index.intersection(previas.index)
+    return comunes[filas[comunes].to_numpy() != previas[comunes].to_numpy()]
+
+def normalizar_espacios(serie):
+    """Colapsa espacios y saltos de línea de una columna, manteniendo los nulos como nulos
+
+    Normaliza solo los valores distintos (pd.factorize) y los expande de vuelta,
+    así el costo depende de la cardinalidad de la columna y no de su largo.
+    """
+    codigos, unicos = pd.factorize(serie)
+    if not len(unicos):
+        # Columna sin valores (ej. un lote donde todas sus celdas están vacías)
+        return pd.Series(None, index=serie.index, dtype=object)
+    limpios = np.array([' '.join(str(valor).split()) for valor in unicos], dtype=object)
+    resultado = pd.Series(limpios.take(codigos), index=serie.index, dtype=object)
+    return resultado.where(codigos != -1, None)
 
 def limpiar_dataframe(df):
     """Limpia el DataFrame de saltos de línea innecesarios"""
@@ -232,59 +832,889 @@ def limpiar_dataframe(df):
     
     # Reemplazar saltos de línea por espacios en todas las columnas string
     for columna in df.select_dtypes(include=['object']).columns:
-        df[columna] = df[columna].astype(str).apply(lambda x: ' '.join(x.split()))
+        df[columna] = normalizar_espacios(df[columna])
     
     return df
 
-def actualizar_estadisticas_readme(df_historico):
+# Convención semanal compartida por el README y estadisticas.json:
+# semanas que terminan el lunes (día de la ejecución) y se rotulan con esa fecha
+FRECUENCIA_SEMANAL = 'W-MON'
+
+STOPWORDS = {
+    'de', 'del', 'la', 'el', 'los', 'las', 'y', 'en', 'con', 'sin', 'a', 'al',
+    'un', 'una', 'por', 'para', 'o', 'e', 'su', 'se', 'es', 'no', 'que',
+    'libre', 'gluten', 'sin', 'tacc', 'sta', 'cc', '-', 'kg', 'gr', 'ml',
+    'lt', 'g', 'x', 'n°', 'nro', 'cert', 'certificado', 'tac',
+}
+PATRON_TOKENS = r'[a-záéíóúüñ]{3,}'
+
+def tokenizar_denominaciones(serie):
+    """Tokens de cada denominación (minúsculas, sin stopwords), uno por fila"""
+    tokens = serie.dropna().astype(str).str.lower().str.findall(PATRON_TOKENS).explode().dropna()
+    return tokens[~tokens.isin(STOPWORDS)]
+
+ARCHIVO_ESTADO_ESTADISTICAS = 'data/estadisticas_estado.json'
+SEMANAS_RECIENTES = 8
+
+def _semana(fechas):
+    """Rótulo de la semana W-MON (el lunes en que termina) de cada fecha"""
+    return fechas.dt.to_period(FRECUENCIA_SEMANAL).dt.end_time.dt.strftime('%Y-%m-%d')
+
+def _sumar(contador, serie, signo=1):
+    """Suma (o resta) los valores de la serie a un contador dict, eliminando los que quedan en 0"""
+    for clave, cantidad in serie.dropna().value_counts().items():
+        total = contador.get(clave, 0) + signo * int(cantidad)
+        if total:
+            contador[clave] = total
+        else:
+            contador.pop(clave, None)
+
+def _ordenar(contador, n=None):
+    """Contador ordenado por cantidad descendente (empates por nombre)"""
+    items = sorted(contador.items(), key=lambda kv: (-kv[1], kv[0]))
+    return dict(items if n is None else items[:n])
+
+def _preparar_eventos(df_altas_bajas):
+    """Eventos con fecha_cambio tipada, descartando los que no tienen fecha válida"""
+    fechas = pd.to_datetime(df_altas_bajas['fecha_cambio'], errors='coerce')
+    return df_altas_bajas.assign(fecha_cambio=fechas)[fechas.notna()]
+
+def _sumar_semanas_y_recientes(estado, df_ab):
+    """Acumula los contadores semanales y los de altas por fecha de cambio"""
+    tipos = {'alta_nuevo': 'altas_nuevas', 'alta_reactivado': 'altas_reactivadas', 'baja': 'bajas'}
+    df_ab = df_ab[df_ab['tipo_cambio'].isin(tipos.keys())]
+    # observed: en los snapshots tipo_cambio es categórica y conserva tipos que ya se filtraron
+    conteo = df_ab.groupby([_semana(df_ab['fecha_cambio']), 'tipo_cambio'], observed=True).size()
+    for (semana, tipo), cantidad in conteo.items():
+        bucket = estado['semanas'].setdefault(semana, {'altas_nuevas': 0, 'altas_reactivadas': 0, 'bajas': 0})
+        bucket[tipos[tipo]] += int(cantidad)
+
+    altas = df_ab[df_ab['tipo_cambio'].str.startswith('alta', na=False)]
+    for fecha, grupo in altas.groupby(altas['fecha_cambio'].dt.strftime('%Y-%m-%d')):
+        bucket = estado['altas_recientes'].setdefault(fecha, {'marcas': {}, 'tipos': {}})
+        if 'marca' in grupo.columns:
+            _sumar(bucket['marcas'], grupo['marca'])
+        if 'TipoProducto' in grupo.columns:
+            _sumar(bucket['tipos'], grupo['TipoProducto'])
+
+    ultimo = df_ab['fecha_cambio'].max()
+    if pd.notna(ultimo):
+        ultimo = ultimo.strftime('%Y-%m-%d')
+        if estado['ultimo_cambio_detectado'] is None or ultimo > estado['ultimo_cambio_detectado']:
+            estado['ultimo_cambio_detectado'] = ultimo
+    # Solo hace falta conservar las fechas dentro de la ventana de altas recientes
+    if estado['ultimo_cambio_detectado']:
+        corte = (pd.Timestamp(estado['ultimo_cambio_detectado']) - pd.Timedelta(weeks=SEMANAS_RECIENTES)).strftime('%Y-%m-%d')
+        estado['altas_recientes'] = {f: b for f, b in estado['altas_recientes'].items() if f >= corte}
+
+def construir_estado_estadisticas(df_historico, df_altas_bajas):
+    """Calcula desde cero los contadores de estadísticas a partir del histórico completo"""
+    activos = df_historico['fecha_baja'].isna()
+    df_activos = df_historico[activos]
+    estado = {
+        'fecha_inicio': df_historico['fecha_alta'].min(),
+        'ultimo_cambio_detectado': None,
+        'hasta': None,
+        'total_activos': int(activos.sum()),
+        'total_bajas': int((~activos).sum()),
+        'total_historico': len(df_historico),
+        'marcas': {},
+        'tipos': {},
+        'tokens': {},
+        'semanas': {},
+        'altas_recientes': {},
+    }
+    if 'marca' in df_activos.columns:
+        _sumar(estado['marcas'], df_activos['marca'])
+    if 'TipoProducto' in df_activos.columns:
+        _sumar(estado['tipos'], df_activos['TipoProducto'])
+    if 'denominacionventa' in df_activos.columns:
+        _sumar(estado['tokens'], tokenizar_denominaciones(df_activos['denominacionventa']))
+    if not df_altas_bajas.empty:
+        _sumar_semanas_y_recientes(estado, _preparar_eventos(df_altas_bajas))
+    segmentos = segmentos_cambios()
+    estado['hasta'] = _fecha_segmento(segmentos[-1]) if segmentos else estado['ultimo_cambio_detectado']
+    estado['filas_hasta'] = len(pd.read_csv(segmentos[-1])) if segmentos else 0
+    return estado
+
+def aplicar_eventos_estadisticas(estado, df_eventos):
+    """Actualiza los contadores aplicando solo los eventos nuevos (altas, bajas y modificaciones)"""
+    df_eventos = _preparar_eventos(df_eventos)
+    tipo = df_eventos['tipo_cambio'].fillna('')
+    altas = df_eventos[tipo.str.startswith('alta')]
+    bajas = df_eventos[tipo == 'baja']
+    modificaciones = df_eventos[tipo == 'modificacion']
+
+    estado['total_activos'] += len(altas) - len(bajas)
+    estado['total_bajas'] += len(bajas) - int((tipo == 'alta_reactivado').sum())
+    estado['total_historico'] += int((tipo == 'alta_nuevo').sum())
+
+    # Valores anteriores de los campos modificados (si el campo no cambió, el anterior es el actual)
+    if not modificaciones.empty:
+        # Segmentos escritos sin la columna (o filas sin valor) se cuentan como sin valores anteriores
+        anteriores = modificaciones.get('valores_anteriores', pd.Series(index=modificaciones.index, dtype=object))
+        anteriores = anteriores.map(lambda valor: json.loads(valor) if isinstance(valor, str) else {})
+    for contador, columna, transformar in [
+        ('marcas', 'marca', None),
+        ('tipos', 'TipoProducto', None),
+        ('tokens', 'denominacionventa', tokenizar_denominaciones),
+    ]:
+        if columna not in df_eventos.columns:
+            continue
+        transformar = transformar or (lambda serie: serie)
+        _sumar(estado[contador], transformar(altas[columna]))
+        _sumar(estado[contador], transformar(bajas[columna]), -1)
+        if not modificaciones.empty:
+            cambio = anteriores.map(lambda previos: columna in previos)
+            previos = pd.Series([p[columna] for p in anteriores[cambio]], index=modificaciones.index[cambio], dtype=object)
+            _sumar(estado[contador], transformar(previos), -1)
+            _sumar(estado[contador], transformar(modificaciones.loc[cambio, columna]))
+
+    _sumar_semanas_y_recientes(estado, df_eventos)
+    return estado
+
+def cargar_estado_estadisticas():
+    """Lee los contadores persistidos (None si no existen)"""
+    if not os.path.exists(ARCHIVO_ESTADO_ESTADISTICAS):
+        return None
+    with open(ARCHIVO_ESTADO_ESTADISTICAS) as f:
+        return json.load(f)
+
+def guardar_estado_estadisticas(estado):
+    """Persiste los contadores con claves ordenadas para que los diffs sean chicos"""
+    with open(ARCHIVO_ESTADO_ESTADISTICAS, 'w') as f:
+        json.dump(estado, f, ensure_ascii=False, indent=0, sort_keys=True)
+
+def actualizar_estado_estadisticas(df_historico=None, reconstruir=False):
+    """Devuelve los contadores al día aplicando solo los eventos posteriores al estado
+
+    El estado guarda hasta qué segmento (`hasta`) y cuántas de sus filas
+    (`filas_hasta`) ya contó, así una segunda corrida en el mismo día suma
+    solo las filas que agregó. Con `reconstruir` (o si no hay estado previo)
+    se recalculan desde el histórico completo.
+    """
+    estado = None if reconstruir else cargar_estado_estadisticas()
+    if estado is None:
+        print("Calculando estadísticas desde cero...")
+        if df_historico is None:
+            df_historico = cargar_historico()
+        estado = construir_estado_estadisticas(df_historico, cargar_altas_bajas())
+    else:
+        segmentos = segmentos_cambios(desde=estado['hasta'])
+        if segmentos:
+            partes = [pd.read_csv(s) for s in segmentos]
+            filas_hasta = len(partes[-1])
+            if _fecha_segmento(segmentos[0]) == estado['hasta']:
+                # Los estados anteriores a filas_hasta ya habían contado el segmento entero
+                partes[0] = partes[0].iloc[estado.get('filas_hasta', len(partes[0])):]
+            nuevos = [df for df in partes if not df.empty]
+            if nuevos:
+                aplicar_eventos_estadisticas(estado, pd.concat(nuevos, ignore_index=True))
+            estado['hasta'] = _fecha_segmento(segmentos[-1])
+            estado['filas_hasta'] = filas_hasta
+    guardar_estado_estadisticas(estado)
+    return estado
+
+def estadisticas_desde_estado(estado):
+    """Arma el diccionario de estadísticas del README y de estadisticas.json a partir de los contadores"""
+    tendencia_semanal = [{'semana': semana, **conteos} for semana, conteos in sorted(estado['semanas'].items())]
+
+    marcas_recientes, tipos_recientes = {}, {}
+    for bucket in estado['altas_recientes'].values():
+        for marca, cantidad in bucket['marcas'].items():
+            marcas_recientes[marca] = marcas_recientes.get(marca, 0) + cantidad
+        for tipo, cantidad in bucket['tipos'].items():
+            tipos_recientes[tipo] = tipos_recientes.get(tipo, 0) + cantidad
+
+    return {
+        'fecha_inicio': estado['fecha_inicio'],
+        'ultima_actualizacion': datetime.now().strftime('%Y-%m-%d'),
+        'ultimo_cambio_detectado': estado['ultimo_cambio_detectado'],
+        'total_activos': estado['total_activos'],
+        'total_bajas': estado['total_bajas'],
+        'total_historico': estado['total_historico'],
+        'por_marca': _ordenar(estado['marcas']),
+        'por_tipo_producto': _ordenar(estado['tipos']),
+        'tendencia_semanal': tendencia_semanal,
+        'top_palabras_clave': _ordenar(estado['tokens'], 60),
+        'top_marcas_altas_recientes': _ordenar(marcas_recientes, 15),
+        'top_tipos_altas_recientes': _ordenar(tipos_recientes, 15),
+    }
+
+def calcular_estadisticas(df_historico, df_altas_bajas):
+    """Calcula desde cero todas las estadísticas del README y de estadisticas.json"""
+    return estadisticas_desde_estado(construir_estado_estadisticas(df_historico, df_altas_bajas))
+
+def reconstruir_estadisticas():
+    """Recalcula las estadísticas desde cero y las compara con las incrementales (--rebuild-stats)"""
+    incremental = cargar_estado_estadisticas()
+    estado = actualizar_estado_estadisticas(reconstruir=True)
+    if incremental is not None:
+        diferencias = sorted(k for k in estado if k not in ('hasta', 'filas_hasta') and estado[k] != incremental.get(k))
+        if diferencias:
+            print(f"⚠️ Las estadísticas incrementales difieren en: {', '.join(diferencias)}")
+        else:
+            print("✅ Las estadísticas incrementales coinciden con el recálculo completo")
+    stats = estadisticas_desde_estado(estado)
+    actualizar_estadisticas_readme(stats)
+    escribir_estadisticas_json(stats)
+    return stats
+
+def escribir_estadisticas_json(stats, archivo='data/estadisticas.json'):
+    """Escribe estadisticas.json con el subconjunto de estadísticas que usa el dashboard"""
+    claves = [
+        'total_activos', 'total_bajas', 'total_historico', 'por_marca', 'por_tipo_producto',
+        'tendencia_semanal', 'top_palabras_clave', 'top_marcas_altas_recientes', 'top_tipos_altas_recientes',
+    ]
+    with open(archivo, 'w') as f:
+        json.dump({clave: stats[clave] for clave in claves}, f, ensure_ascii=False, indent=2)
+    print(f"✅ Archivo {archivo} generado")
+
+DIR_DASHBOARD = 'data/dashboard'
+SEMANAS_TENDENCIA = 24
+
+# El sitio se publica por FTP en un hosting Apache: servir las copias precomprimidas si el navegador las acepta
+HTACCESS_DASHBOARD = """<IfModule mod_headers.c>
+<IfModule mod_rewrite.c>
+RewriteEngine On
+RewriteCond %{HTTP:Accept-Encoding} br
+RewriteCond %{REQUEST_FILENAME}.br -f
+RewriteRule ^(.+)\\.json$ $1.json.br [L]
+RewriteCond %{HTTP:Accept-Encoding} gzip
+RewriteCond %{REQUEST_FILENAME}.gz -f
+RewriteRule ^(.+)\\.json$ $1.json.gz [L]
+</IfModule>
+<FilesMatch "\\.json\\.br$">
+ForceType application/json
+Header set Content-Encoding br
+Header append Vary Accept-Encoding
+</FilesMatch>
+<FilesMatch "\\.json\\.gz$">
+ForceType application/json
+Header set Content-Encoding gzip
+Header append Vary Accept-Encoding
+</FilesMatch>
+</IfModule>
+"""
+
+def _escribir_json_comprimido(path, obj):
+    """Escribe JSON minificado y sus copias precomprimidas (.gz, y .br si está instalado brotli)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    datos = json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(datos)
+    # mtime=0 para que el .gz no cambie si el contenido no cambia
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(datos, compresslevel=9, mtime=0))
+    try:
+        import brotli
+    except ImportError:
+        return
+    with open(path + '.br', 'wb') as f:
+        f.write(brotli.compress(datos))
+
+def _etiqueta(serie, vacio):
+    """Mismo criterio que normalizeLabel() en index.html: nulos y vacíos pasan a `vacio`"""
+    serie = serie.fillna('').astype(str).str.strip()
+    return serie.where(~serie.isin(['', 'null', 'undefined']), vacio)
+
+def clave_shard(marca):
+    """Fragmento del catálogo de una marca: su inicial sin acentos (o '_' si no es letra/dígito)"""
+    inicial = unicodedata.normalize('NFD', marca[:1]).encode('ascii', 'ignore').decode().upper()
+    return inicial if inicial.isalnum() else '_'
+
+def _filas(df, columnas):
+    """Formato columnar compacto {columnas, filas} para el dashboard"""
+    df = df[columnas].astype(object).where(df[columnas].notna(), None)
+    return {'columnas': columnas, 'filas': df.to_numpy().tolist()}
+
+def generar_dashboard(df_historico, df_altas_bajas, stats):
+    """Genera los archivos livianos y fragmentados que carga index.html
+
+    - resumen.json: totales, tendencia semanal y el índice de los demás fragmentos
+    - altas/<fecha_alta>.json: conteos marca/tipo y palabras de los activos dados de alta esa fecha
+    - catalogo/<inicial>.json: productos activos por inicial de la marca (detalle del treemap)
+    - movimientos/<semana>.json: altas y bajas de cada semana (lunes) para la línea de tiempo
+    """
+    # Regenerar desde cero para no dejar fragmentos viejos
+    shutil.rmtree(DIR_DASHBOARD, ignore_errors=True)
+
+    df_activos = df_historico[df_historico['fecha_baja'].isna()].copy()
+    tokens = tokenizar_denominaciones(df_activos['denominacionventa'])
+    df_activos['marca'] = _etiqueta(df_activos['marca'], 'Sin marca')
+    df_activos['TipoProducto'] = _etiqueta(df_activos['TipoProducto'], 'Sin categoría')
+    df_activos['denominacionventa'] = _etiqueta(df_activos['denominacionventa'], 'Sin denominación')
+    df_activos['fecha_alta'] = df_activos['fecha_alta'].astype(str)
+
+    # --- Agregados por fecha de alta ---
+    conteo_marcas = df_activos.groupby(['fecha_alta', 'marca', 'TipoProducto']).size()
+    conteo_palabras = tokens.groupby([df_activos.loc[tokens.index, 'fecha_alta'], tokens]).size()
+    altas = []
+    for fecha, n in df_activos['fecha_alta'].value_counts().sort_index().items():
+        marcas = conteo_marcas.loc[fecha]
+        palabras = conteo_palabras.loc[fecha].sort_values(ascending=False, kind='stable') if fecha in conteo_palabras.index else pd.Series(dtype=int)
+        _escribir_json_comprimido(os.path.join(DIR_DASHBOARD, 'altas', f'{fecha}.json'), {
+            'marcas': [[marca, tipo, int(c)] for (marca, tipo), c in marcas.items()],
+            'palabras': [[palabra, int(c)] for palabra, c in palabras.items()],
+        })
+        altas.append([fecha, int(n)])
+
+    # --- Catálogo de activos por inicial de la marca ---
+    columnas_catalogo = ['id', 'rnpa', 'marca', 'TipoProducto', 'denominacionventa', 'fecha_alta']
+    for clave, grupo in df_activos.groupby(df_activos['marca'].map(clave_shard)):
+        _escribir_json_comprimido(os.path.join(DIR_DASHBOARD, 'catalogo', f'{clave}.json'),
+                                  _filas(grupo.sort_values(['marca', 'id']), columnas_catalogo))
+
+    # --- Movimientos por semana (lunes a domingo) ---
+    semanas = []
+    if not df_altas_bajas.empty:
+        df_mov = _preparar_eventos(df_altas_bajas)
+        tipo = df_mov['tipo_cambio'].fillna('')
+        df_mov = df_mov[tipo.str.startswith('alta') | (tipo == 'baja')].sort_values('fecha_cambio', ascending=False, kind='stable')
+        lunes = df_mov['fecha_cambio'].dt.to_period('W-SUN').dt.start_time.dt.strftime('%Y-%m-%d')
+        df_mov['fecha_cambio'] = df_mov['fecha_cambio'].dt.strftime('%Y-%m-%d')
+        columnas_mov = ['tipo_cambio', 'fecha_cambio', 'marca', 'denominacionventa', 'TipoProducto']
+        for semana, grupo in df_mov.groupby(lunes, sort=False):
+            _escribir_json_comprimido(os.path.join(DIR_DASHBOARD, 'movimientos', f'{semana}.json'), _filas(grupo, columnas_mov))
+            bajas = int((grupo['tipo_cambio'] == 'baja').sum())
+            reactivados = int((grupo['tipo_cambio'] == 'alta_reactivado').sum())
+            # Igual que la línea de tiempo: cualquier otro 'alta*' cuenta como alta nueva
+            semanas.append([semana, len(grupo), len(grupo) - bajas - reactivados, reactivados, bajas])
+        semanas.sort(reverse=True)
+
+    _escribir_json_comprimido(os.path.join(DIR_DASHBOARD, 'resumen.json'), {
+        'total_activos': stats['total_activos'],
+        'total_bajas': stats['total_bajas'],
+        'total_historico': stats['total_historico'],
+        'total_marcas': len(stats['por_marca']),
+        'total_tipos': len(stats['por_tipo_producto']),
+        'tendencia_semanal': stats['tendencia_semanal'][-SEMANAS_TENDENCIA:],
+        'altas': altas,
+        'semanas': semanas,
+    })
+    with open(os.path.join(DIR_DASHBOARD, '.htaccess'), 'w', encoding='utf-8') as f:
+        f.write(HTACCESS_DASHBOARD)
+    print(f"✅ Dashboard generado: {DIR_DASHBOARD}")
+
+DIR_BUSQUEDA = os.path.join(DIR_DASHBOARD, 'busqueda')
+CAMPOS_BUSQUEDA = ['marca', 'nombreFantasia', 'denominacionventa']
+PRODUCTOS_POR_FRAGMENTO = 250
+
+def plegar_acentos(texto):
+    """Minúsculas y sin acentos ('Café Ñandú' -> 'cafe nandu'), igual que normalizeSearchValue() en index.html"""
+    texto = unicodedata.normalize('NFD', str(texto).lower())
+    return ''.join(c for c in texto if unicodedata.category(c) != 'Mn')
+
+# Las stopwords de las estadísticas más los valores de relleno de nombreFantasia ('NO REGISTRA', ...)
+STOPWORDS_BUSQUEDA = {plegar_acentos(palabra) for palabra in STOPWORDS} | {'registra', 'consigna', 'contiene', 'corresponde'}
+
+def tokens_consulta(consulta):
+    """Términos de una consulta: plegados, de 2 letras o más y sin stopwords"""
+    return [t for t in re.findall(r'[a-z]{2,}', plegar_acentos(consulta)) if t not in STOPWORDS_BUSQUEDA]
+
+def trigramas(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+def generar_indice_busqueda(df_historico, directorio=DIR_BUSQUEDA):
+    """Genera el índice invertido que usa el buscador de productos de index.html
+
+    - productos/<n>.json: los productos en bloques de 250; primero los activos, así las
+      posiciones más bajas de cada resultado son las de productos vigentes
+    - vocabulario.json: stopwords y tokens plegados de marca, nombre de fantasía y denominación
+    - prefijos/<2 letras>.json: {token: posiciones de los productos que lo contienen}
+    - trigramas/<letra>.json: {trigrama: índices en el vocabulario}, para buscar subcadenas
+    """
+    shutil.rmtree(directorio, ignore_errors=True)
+
+    df = df_historico.assign(activo=df_historico['fecha_baja'].isna())
+    df = df.sort_values(['activo', 'id'], ascending=[False, True]).reset_index(drop=True)
+    columnas = ['id', 'rnpa', 'marca', 'nombreFantasia', 'denominacionventa', 'TipoProducto', 'fecha_alta', 'fecha_baja', 'activo']
+    for inicio in range(0, len(df), PRODUCTOS_POR_FRAGMENTO):
+        bloque = df.iloc[inicio:inicio + PRODUCTOS_POR_FRAGMENTO]
+        _escribir_json_comprimido(os.path.join(directorio, 'productos', f'{inicio // PRODUCTOS_POR_FRAGMENTO}.json'),
+                                  _filas(bloque, columnas))
+
+    # Tokens de cada producto (la posición en df es el identificador en las postings)
+    texto = df[CAMPOS_BUSQUEDA].fillna('').astype(str).agg(' '.join, axis=1)
+    codigos, valores = pd.factorize(texto)
+    plegados = pd.Series([plegar_acentos(v) for v in valores.tolist()])
+    tokens = pd.Series(plegados.to_numpy()[codigos]).str.findall(PATRON_TOKENS).explode().dropna()
+    tokens = tokens[~tokens.isin(STOPWORDS_BUSQUEDA)]
+    postings = tokens.reset_index().drop_duplicates().groupby(0)['index'].agg(list)
+
+    vocabulario = postings.index.tolist()
+    _escribir_json_comprimido(os.path.join(directorio, 'vocabulario.json'),
+                              {'stopwords': sorted(STOPWORDS_BUSQUEDA), 'tokens': vocabulario,
+                               'productos_por_fragmento': PRODUCTOS_POR_FRAGMENTO})
+
+    prefijos = {}
+    for token, posiciones in postings.items():
+        prefijos.setdefault(token[:2], {})[token] = posiciones
+    for prefijo, contenido in prefijos.items():
+        _escribir_json_comprimido(os.path.join(directorio, 'prefijos', f'{prefijo}.json'), contenido)
+
+    indice_trigramas = {}
+    for i, token in enumerate(vocabulario):
+        for trigrama in sorted(trigramas(token)):
+            indice_trigramas.setdefault(trigrama[0], {}).setdefault(trigrama, []).append(i)
+    for letra, contenido in indice_trigramas.items():
+        _escribir_json_comprimido(os.path.join(directorio, 'trigramas', f'{letra}.json'), contenido)
+
+    print(f"✅ Índice de búsqueda generado: {len(vocabulario)} tokens, {len(df)} productos")
+
+def _leer_fragmento(path, cache):
+    if path not in cache:
+        with open(path, encoding='utf-8') as f:
+            cache[path] = json.load(f)
+    return cache[path]
+
+def buscar_en_indice(consulta, directorio=DIR_BUSQUEDA, limite=50, cache=None):
+    """Busca productos cuyos textos contengan todos los términos de la consulta (como prefijo o subcadena)
+
+    Es la misma búsqueda que hace index.html; `cache` guarda los fragmentos ya leídos entre consultas.
+    Devuelve (total de coincidencias, hasta `limite` productos, primero los activos).
+    """
+    cache = {} if cache is None else cache
+    terminos = tokens_consulta(consulta)
+    if not terminos:
+        return 0, []
+
+    resultado = None
+    for termino in terminos:
+        if len(termino) < 3:
+            # Prefijo corto: todos los tokens que empiezan así están en un único fragmento
+            path = os.path.join(directorio, 'prefijos', f'{termino}.json')
+            tokens = list(_leer_fragmento(path, cache)) if os.path.exists(path) else []
+        else:
+            # Subcadena: intersección de los trigramas y verificación contra el vocabulario
+            vocabulario = _leer_fragmento(os.path.join(directorio, 'vocabulario.json'), cache)['tokens']
+            candidatos = None
+            for trigrama in trigramas(termino):
+                path = os.path.join(directorio, 'trigramas', f'{trigrama[0]}.json')
+                ids = set(_leer_fragmento(path, cache).get(trigrama, [])) if os.path.exists(path) else set()
+                candidatos = ids if candidatos is None else candidatos & ids
+            tokens = [vocabulario[i] for i in candidatos if termino in vocabulario[i]]
+
+        posiciones = set()
+        for token in tokens:
+            fragmento = _leer_fragmento(os.path.join(directorio, 'prefijos', f'{token[:2]}.json'), cache)
+            posiciones.update(fragmento[token])
+        resultado = posiciones if resultado is None else resultado & posiciones
+        if not resultado:
+            return 0, []
+
+    productos = []
+    for posicion in sorted(resultado)[:limite]:
+        bloque = _leer_fragmento(os.path.join(directorio, 'productos', f'{posicion // PRODUCTOS_POR_FRAGMENTO}.json'), cache)
+        productos.append(dict(zip(bloque['columnas'], bloque['filas'][posicion % PRODUCTOS_POR_FRAGMENTO])))
+    return len(resultado), productos
+
+ARCHIVO_DUPLICADOS = 'data/posibles_duplicados.csv'
+NUM_PERMUTACIONES = 64
+BANDAS_LSH = 16              # 4 filas por banda: los pares con similitud >~0.5 caen juntos en alguna banda
+UMBRAL_DUPLICADOS = 0.8
+MAXIMO_CUBETA = 50           # en cubetas más grandes solo se comparan vecinos, para no crecer cuadráticamente
+_PRIMO_MINHASH = (1 << 31) - 1
+# Valores de relleno de marca y nombreFantasia: no dicen nada del producto ('NO REGISTRA' es casi el 40% del listado)
+VALORES_SIN_DATO = {'no registra', 'no consigna', 'no contiene', 'no posee', 'no corresponde', 'n/c', '-', '*'}
+
+def tokens_productos(serie):
+    """Tokens de cada valor como los indexa el buscador, uno por fila
+
+    Plegados, sin STOPWORDS_BUSQUEDA y sin los valores de relleno de VALORES_SIN_DATO.
+    """
+    codigos, valores = pd.factorize(serie.fillna('').astype(str))
+    plegados = pd.Series([plegar_acentos(v) for v in valores.tolist()], dtype=object)
+    plegados = plegados.where(~plegados.str.strip().isin(VALORES_SIN_DATO), '')
+    tokens = pd.Series(plegados.to_numpy()[codigos], index=serie.index).str.findall(PATRON_TOKENS).explode().dropna()
+    return tokens[~tokens.isin(STOPWORDS_BUSQUEDA)]
+
+def _claves_tokens(serie):
+    """Los tokens distintos de cada valor, ordenados y unidos en un texto ('' si no tiene)
+
+    Se calcula una vez por valor distinto (pd.factorize) y se expande a las filas.
+    """
+    codigos, valores = pd.factorize(serie.fillna('').astype(str))
+    tokens = tokens_productos(pd.Series(valores, dtype=object))
+    conjuntos = [set() for _ in range(len(valores))]
+    for posicion, token in zip(tokens.index, tokens):
+        conjuntos[posicion].add(token)
+    claves = np.array([' '.join(sorted(conjunto)) for conjunto in conjuntos], dtype=object)
+    return claves[codigos]
+
+def firmas_minhash(df, num_permutaciones=NUM_PERMUTACIONES, seed=0):
+    """Firmas MinHash de los tokens de marca + nombre de fantasía + denominación
+
+    Usa la tokenización de tokens_productos(), la misma del buscador.
+    Devuelve (posiciones de los productos con tokens, matriz de firmas n x k).
+    """
+    tokens = pd.concat([tokens_productos(df[columna].reset_index(drop=True)) for columna in CAMPOS_BUSQUEDA])
+    tokens = tokens.reset_index().drop_duplicates().sort_values('index', kind='stable')
+    posiciones, inicios = np.unique(tokens['index'].to_numpy(), return_index=True)
+    hashes = pd.util.hash_array(tokens.iloc[:, 1].to_numpy(dtype=object)) % _PRIMO_MINHASH
+
+    # h_i(x) = (a_i * x + b_i) mod p, calculado por bloques de permutaciones para acotar la memoria
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _PRIMO_MINHASH, num_permutaciones, dtype=np.uint64)
+    b = rng.integers(0, _PRIMO_MINHASH, num_permutaciones, dtype=np.uint64)
+    firmas = np.empty((len(posiciones), num_permutaciones), dtype=np.uint32)
+    for j in range(0, num_permutaciones, 8):
+        valores = (hashes[:, None] * a[j:j + 8] + b[j:j + 8]) % _PRIMO_MINHASH
+        firmas[:, j:j + 8] = np.minimum.reduceat(valores, inicios, axis=0)
+    return posiciones, firmas
+
+def pares_similares(df, umbral=UMBRAL_DUPLICADOS, bandas=BANDAS_LSH):
+    """Pares de productos de `df` con tokens casi iguales, sin compararlos todos contra todos
+
+    Las firmas MinHash se cortan en bandas; solo se comparan los productos que
+    coinciden en alguna banda (LSH) y se quedan los que superan el umbral de
+    similitud de Jaccard estimada. De esos, solo cuentan los de la misma marca
+    y la misma denominación (salvo acentos, puntuación, orden y stopwords):
+    las variedades de sabor de una marca superan el umbral pero no son el
+    mismo producto. Devuelve un DataFrame con las posiciones en `df`
+    (pos_a < pos_b) y la similitud.
+    """
+    posiciones, firmas = firmas_minhash(df)
+    filas = firmas.shape[1] // bandas
+    candidatos = []
+    for banda in range(bandas):
+        clave = pd.util.hash_pandas_object(pd.DataFrame(firmas[:, banda * filas:(banda + 1) * filas]), index=False)
+        cubetas = pd.DataFrame({'clave': clave.to_numpy(), 'fila': np.arange(len(firmas))})
+        tamano = cubetas.groupby('clave')['fila'].transform('size')
+        chicas = cubetas[(tamano > 1) & (tamano <= MAXIMO_CUBETA)]
+        pares = chicas.merge(chicas, on='clave')
+        candidatos.append(pares.loc[pares['fila_x'] < pares['fila_y'], ['fila_x', 'fila_y']].to_numpy())
+        grandes = cubetas[tamano > MAXIMO_CUBETA].sort_values(['clave', 'fila'])
+        mismo = grandes['clave'].to_numpy()[1:] == grandes['clave'].to_numpy()[:-1]
+        candidatos.append(np.column_stack([grandes['fila'].to_numpy()[:-1][mismo], grandes['fila'].to_numpy()[1:][mismo]]))
+
+    # Un mismo par puede coincidir en varias bandas: se deduplica como a * n + b
+    candidatos = np.concatenate(candidatos).astype(np.int64).reshape(-1, 2)
+    codigos = np.unique(candidatos[:, 0] * len(firmas) + candidatos[:, 1])
+    candidatos = np.column_stack([codigos // len(firmas), codigos % len(firmas)])
+    similitud = (firmas[candidatos[:, 0]] == firmas[candidatos[:, 1]]).mean(axis=1)
+    similares = similitud >= umbral
+    pos_a, pos_b = posiciones[candidatos[similares, 0]], posiciones[candidatos[similares, 1]]
+
+    # Sin marca (o con un valor de relleno) no hay cómo confirmar que sean el mismo producto
+    marca, denominacion = _claves_tokens(df['marca']), _claves_tokens(df['denominacionventa'])
+    mismo_producto = (marca[pos_a] != '') & (marca[pos_a] == marca[pos_b]) & (denominacion[pos_a] == denominacion[pos_b])
+    return pd.DataFrame({
+        'pos_a': pos_a[mismo_producto],
+        'pos_b': pos_b[mismo_producto],
+        'similitud': similitud[similares][mismo_producto].round(3),
+    })
+
+def detectar_duplicados(df_historico, archivo=ARCHIVO_DUPLICADOS):
+    """Escribe posibles_duplicados.csv: pares de productos con distinto id y datos casi iguales
+
+    Suelen ser reinscripciones o reactivaciones con un id nuevo, que el
+    histórico cuenta como una baja y un alta separadas.
+    """
+    df = df_historico.reset_index(drop=True)
+    pares = pares_similares(df)
+    # El de menor id primero
+    ids = df['id'].to_numpy()
+    invertir = ids[pares['pos_a']] > ids[pares['pos_b']]
+    a = df.iloc[np.where(invertir, pares['pos_b'], pares['pos_a'])].reset_index(drop=True)
+    b = df.iloc[np.where(invertir, pares['pos_a'], pares['pos_b'])].reset_index(drop=True)
+
+    df_duplicados = pd.DataFrame({
+        'id_a': a['id'],
+        'id_b': b['id'],
+        'similitud': pares['similitud'].to_numpy(),
+        'mismo_rnpa': a['rnpa'].astype(str).str.strip() == b['rnpa'].astype(str).str.strip(),
+    })
+    for columna in ['rnpa', 'marca', 'nombreFantasia', 'denominacionventa', 'fecha_alta', 'fecha_baja']:
+        df_duplicados[f'{columna}_a'] = a[columna]
+        df_duplicados[f'{columna}_b'] = b[columna]
+    df_duplicados = df_duplicados.sort_values(['similitud', 'id_a', 'id_b'], ascending=[False, True, True])
+    df_duplicados.to_csv(archivo, index=False)
+    print(f"✅ Posibles duplicados: {archivo} ({len(df_duplicados):,} pares)")
+    return df_duplicados
+
+def vincular_reinscripciones(df_altas, df_bajas, umbral=UMBRAL_DUPLICADOS):
+    """Para cada alta, el id del producto dado de baja más parecido (NaN si no hay ninguno)"""
+    if df_altas.empty or df_bajas.empty:
+        return pd.Series(np.nan, index=df_altas.index)
+    df = pd.concat([df_altas, df_bajas], ignore_index=True)
+    pares = pares_similares(df, umbral)
+    # pos_a < pos_b: las altas van primero en df
+    pares = pares[(pares['pos_a'] < len(df_altas)) & (pares['pos_b'] >= len(df_altas))]
+    pares = pares.assign(id_baja=df['id'].to_numpy()[pares['pos_b']])
+    mejor = pares.sort_values(['similitud', 'id_baja'], ascending=False).drop_duplicates('pos_a')
+    return pd.Series(mejor['id_baja'].to_numpy(), index=df_altas.index[mejor['pos_a']]).reindex(df_altas.index)
+
+ARCHIVO_SQLITE = 'data/alg.sqlite'
+
+# Las consultas habituales son por id, rnpa, marca y rangos de fechas
+INDICES_SQLITE = [
+    'CREATE INDEX ix_listado_id ON listado (id)',
+    'CREATE INDEX ix_listado_rnpa ON listado (rnpa)',
+    'CREATE INDEX ix_listado_marca ON listado (marca COLLATE NOCASE)',
+    'CREATE UNIQUE INDEX ix_historico_id ON historico (id)',
+    'CREATE INDEX ix_historico_rnpa ON historico (rnpa)',
+    'CREATE INDEX ix_historico_marca ON historico (marca COLLATE NOCASE, fecha_baja)',
+    'CREATE INDEX ix_historico_fecha_alta ON historico (fecha_alta)',
+    'CREATE INDEX ix_historico_fecha_baja ON historico (fecha_baja)',
+    'CREATE INDEX ix_eventos_id ON eventos (id)',
+    'CREATE INDEX ix_eventos_rnpa ON eventos (rnpa)',
+    'CREATE INDEX ix_eventos_fecha ON eventos (fecha_cambio, tipo_cambio)',
+]
+
+def _tabla_sqlite(df):
+    """Todo como texto salvo el id; las fechas quedan en YYYY-MM-DD, que se ordena y compara bien"""
+    df = _fechas_como_texto(df.drop(columns='_key', errors='ignore'))
+    for columna in df.columns.drop('id', errors='ignore'):
+        df[columna] = df[columna].astype(object).map(str, na_action='ignore')
+    return df
+
+def escribir_base_sqlite(df_listado, df_historico, df_altas_bajas, archivo=ARCHIVO_SQLITE):
+    """Escribe la base SQLite con el listado actual, el histórico y los eventos (tablas listado, historico y eventos)
+
+    Se arma en un archivo temporal y se renombra al final, así quien la esté
+    consultando nunca ve una base a medio escribir.
+    """
+    if df_altas_bajas.columns.empty:
+        # Todavía no hay eventos (ej. después de la carga inicial): la tabla y sus índices se crean igual
+        df_altas_bajas = pd.DataFrame(columns=[*df_historico.columns.drop('_key', errors='ignore'), *COLUMNAS_EVENTO])
+    directorio = os.path.dirname(archivo) or '.'
+    os.makedirs(directorio, exist_ok=True)
+    fd, temporal = tempfile.mkstemp(dir=directorio, suffix='.sqlite.part')
+    os.close(fd)
+    try:
+        with contextlib.closing(sqlite3.connect(temporal)) as conexion:
+            for tabla, df in [('listado', df_listado), ('historico', df_historico), ('eventos', df_altas_bajas)]:
+                _tabla_sqlite(df).to_sql(tabla, conexion, index=False, if_exists='replace')
+            for sentencia in INDICES_SQLITE:
+                conexion.execute(sentencia)
+            conexion.execute('ANALYZE')
+            conexion.commit()
+        os.chmod(temporal, 0o644)
+        os.replace(temporal, archivo)
+    except BaseException:
+        os.remove(temporal)
+        raise
+    print(f"✅ Base SQLite generada: {archivo}")
+    return archivo
+
+def exportar_sqlite(archivo=ARCHIVO_SQLITE):
+    """Genera la base SQLite a partir de los datos ya procesados, sin descargar nada"""
+    df_listado, _ = leer_snapshot(ARCHIVO_LISTADO)
+    if df_listado is None:
+        df_listado = pd.read_csv(ARCHIVO_LISTADO)
+    return escribir_base_sqlite(df_listado, cargar_historico(), cargar_altas_bajas(), archivo)
+
+def conectar_base(archivo=ARCHIVO_SQLITE):
+    """Abre la base SQLite en modo solo lectura"""
+    if not os.path.exists(archivo):
+        raise FileNotFoundError(f"No existe {archivo}; generarla con: python scripts/update_alg_data.py --sqlite")
+    return sqlite3.connect(f"file:{os.path.abspath(archivo)}?mode=ro", uri=True)
+
+def _consultar(sql, parametros, conexion, archivo):
+    """Ejecuta una consulta sobre `conexion` (o abre y cierra una conexión a `archivo`)"""
+    if conexion is not None:
+        return pd.read_sql_query(sql, conexion, params=parametros)
+    with contextlib.closing(conectar_base(archivo)) as conexion:
+        return pd.read_sql_query(sql, conexion, params=parametros)
+
+def buscar_por_rnpa(rnpa, conexion=None, archivo=ARCHIVO_SQLITE):
+    """Productos del histórico (activos o dados de baja) con ese RNPA"""
+    return _consultar('SELECT * FROM historico WHERE rnpa = ? ORDER BY id', (str(rnpa),), conexion, archivo)
+
+def cambios_entre(fecha_a, fecha_b, conexion=None, archivo=ARCHIVO_SQLITE):
+    """Eventos (altas, bajas y modificaciones) detectados entre dos fechas YYYY-MM-DD, ambas incluidas"""
+    return _consultar('SELECT * FROM eventos WHERE fecha_cambio BETWEEN ? AND ? ORDER BY fecha_cambio, id',
+                      (str(fecha_a), str(fecha_b)), conexion, archivo)
+
+def activos_por_marca(marca, conexion=None, archivo=ARCHIVO_SQLITE):
+    """Productos activos de una marca (sin distinguir mayúsculas)"""
+    return _consultar('SELECT * FROM historico WHERE marca = ? COLLATE NOCASE AND fecha_baja IS NULL ORDER BY id',
+                      (marca,), conexion, archivo)
+
+DIAS_CHECKPOINT = 28
+# Extremos de los intervalos abiertos (representables exactos como float)
+_SIN_INICIO, _SIN_FIN = -2**62, 2**62
+
+def _dias(fechas):
+    """Fechas ('AAAA-MM-DD') como días desde 1970 en int64; las vacías quedan en NaN"""
+    fechas = pd.to_datetime(pd.Series(fechas), errors='coerce', format='mixed')
+    return (fechas - pd.Timestamp('1970-01-01')).dt.days
+
+def _dia(fecha):
+    """Una fecha ('AAAA-MM-DD', date o Timestamp) como días desde 1970"""
+    return int(np.datetime64(pd.Timestamp(fecha).date(), 'D').astype(np.int64))
+
+def _fecha_dia(dia):
+    return None if dia in (_SIN_INICIO, _SIN_FIN) else str(np.datetime64(int(dia), 'D'))
+
+def construir_indice_temporal(df_historico=None, df_altas_bajas=None, cada_dias=DIAS_CHECKPOINT):
+    """Índice para reconstruir el listado a cualquier fecha sin reproducir todo el registro de cambios
+
+    Cada período en que un producto estuvo en el listado es un intervalo
+    [desde, hasta): empieza con un alta y termina con la baja siguiente. Si el
+    primer evento de un producto es una baja, el intervalo arranca en su
+    fecha_alta del histórico (o sin inicio conocido); los productos sin eventos
+    usan fecha_alta/fecha_baja del histórico. Cuando no se sabe desde cuándo
+    estaba un producto se toma la primera fecha del histórico. Los intervalos se ordenan por
+    inicio y por fin, y cada `cada_dias` días se guarda un checkpoint con los
+    intervalos abiertos: una consulta parte del checkpoint anterior y solo
+    aplica los intervalos que empiezan o terminan después.
+    """
+    if df_historico is None:
+        inicializar_eventos()
+        df_historico = cargar_historico()
+        df_altas_bajas = cargar_altas_bajas()
+    if df_historico is None:
+        raise ValueError("No hay histórico para consultar")
+    if df_altas_bajas is None or df_altas_bajas.empty:
+        df_altas_bajas = pd.DataFrame(columns=['id', 'tipo_cambio', 'fecha_cambio'])
+
+    # Altas y bajas ordenadas por producto y fecha; las repetidas (alta tras alta) no cambian nada
+    tipo = df_altas_bajas['tipo_cambio'].astype(str).str.strip()
+    eventos = pd.DataFrame({
+        'id': df_altas_bajas['id'],
+        'dia': _dias(df_altas_bajas['fecha_cambio']).to_numpy(),
+        'abre': tipo.str.startswith('alta').to_numpy(),
+    })[(tipo.str.startswith('alta') | (tipo == 'baja')).to_numpy()].dropna(subset=['dia'])
+    eventos = eventos.sort_values(['id', 'dia'], kind='stable')
+    previo = eventos.groupby('id')['abre'].shift()
+    eventos = eventos[previo.isna() | (eventos['abre'] != previo)]
+    siguiente = eventos.groupby('id')['dia'].shift(-1)
+
+    # Alta -> hasta la baja siguiente (o abierto)
+    altas = eventos['abre']
+    intervalos = [pd.DataFrame({'id': eventos.loc[altas, 'id'], 'desde': eventos.loc[altas, 'dia'],
+                                'hasta': siguiente[altas].fillna(_SIN_FIN)})]
+
+    # Primera baja sin alta registrada -> desde la fecha_alta del histórico, si es anterior
+    primeros = eventos.drop_duplicates('id')
+    primeras_bajas = primeros[~primeros['abre']]
+    alta_historico = _dias(df_historico['fecha_alta']).set_axis(df_historico['id'].to_numpy())
+    primer_dia = alta_historico.min() if alta_historico.notna().any() else _SIN_INICIO
+    inicio = primeras_bajas['id'].map(alta_historico)
+    inicio = inicio.where(inicio < primeras_bajas['dia'], min(primer_dia, primeras_bajas['dia'].min()))
+    intervalos.append(pd.DataFrame({'id': primeras_bajas['id'], 'desde': inicio, 'hasta': primeras_bajas['dia']}))
+
+    # Productos sin altas ni bajas registradas
+    sin_eventos = df_historico[~df_historico['id'].isin(eventos['id'])]
+    intervalos.append(pd.DataFrame({
+        'id': sin_eventos['id'].to_numpy(),
+        'desde': _dias(sin_eventos['fecha_alta']).fillna(primer_dia).to_numpy(),
+        'hasta': _dias(sin_eventos['fecha_baja']).fillna(_SIN_FIN).to_numpy(),
+    }))
+
+    intervalos = pd.concat(intervalos, ignore_index=True).astype({'desde': np.int64, 'hasta': np.int64})
+    intervalos = intervalos[intervalos['desde'] < intervalos['hasta']].sort_values(['desde', 'id'], kind='stable')
+    desde, hasta = intervalos['desde'].to_numpy(), intervalos['hasta'].to_numpy()
+
+    # Checkpoints entre la primera y la última fecha conocidas
+    dias = np.concatenate([desde[desde != _SIN_INICIO], hasta[hasta != _SIN_FIN]])
+    checkpoints = np.arange(dias.min(), dias.max() + 1, cada_dias, dtype=np.int64) if len(dias) else np.array([], dtype=np.int64)
+    return {
+        'ids': intervalos['id'].to_numpy(),
+        'desde': desde,
+        'hasta': hasta,
+        'por_desde': np.arange(len(desde)),          # ya ordenados por inicio
+        'por_hasta': np.argsort(hasta, kind='stable'),
+        'hasta_ordenado': np.sort(hasta, kind='stable'),
+        'checkpoints': checkpoints,
+        'abiertos': [np.flatnonzero((desde <= dia) & (dia < hasta)) for dia in checkpoints],
+    }
+
+def _intervalos_entre(indice, dia_a, dia_b):
+    """Intervalos que empiezan o terminan en (dia_a, dia_b]"""
+    empiezan = indice['por_desde'][np.searchsorted(indice['desde'], dia_a, 'right'):
+                                   np.searchsorted(indice['desde'], dia_b, 'right')]
+    terminan = indice['por_hasta'][np.searchsorted(indice['hasta_ordenado'], dia_a, 'right'):
+                                   np.searchsorted(indice['hasta_ordenado'], dia_b, 'right')]
+    return empiezan, terminan
+
+def _intervalos_abiertos(indice, fecha):
+    """Posiciones de los intervalos abiertos en `fecha`, a partir del checkpoint anterior"""
+    dia = _dia(fecha)
+    k = np.searchsorted(indice['checkpoints'], dia, 'right') - 1
+    if k < 0:
+        return np.flatnonzero((indice['desde'] <= dia) & (dia < indice['hasta']))
+    empiezan, terminan = _intervalos_entre(indice, indice['checkpoints'][k], dia)
+    return np.setdiff1d(np.union1d(indice['abiertos'][k], empiezan), terminan)
+
+def activos_al(fecha, indice=None):
+    """Ids de los productos que estaban en el listado en `fecha` ('AAAA-MM-DD')
+
+    Para muchas consultas seguidas conviene construir el índice una vez con
+    construir_indice_temporal() y pasarlo.
+    """
+    indice = construir_indice_temporal() if indice is None else indice
+    return np.unique(indice['ids'][_intervalos_abiertos(indice, fecha)])
+
+def listado_al(fecha, indice=None, df_historico=None):
+    """Listado reconstruido a `fecha`, con la fecha de alta vigente en ese momento
+
+    Los datos de cada producto son los más recientes del histórico (las
+    modificaciones posteriores no se deshacen).
+    """
+    if df_historico is None:
+        inicializar_eventos()
+        df_historico = cargar_historico()
+    indice = construir_indice_temporal(df_historico, cargar_altas_bajas()) if indice is None else indice
+    abiertos = _intervalos_abiertos(indice, fecha)
+    fecha_alta = pd.Series([_fecha_dia(d) for d in indice['desde'][abiertos]], index=indice['ids'][abiertos])
+    df = df_historico[df_historico['id'].isin(fecha_alta.index)].drop(
+        columns=COLUMNAS_EVENTO, errors='ignore')
+    return df.assign(fecha_alta=df['id'].map(fecha_alta), fecha_baja=None).reset_index(drop=True)
+
+def diferencias_entre(fecha_a, fecha_b, indice=None):
+    """Altas y bajas netas entre dos fechas: {'altas': ids, 'bajas': ids}
+
+    Solo se miran los intervalos que empiezan o terminan entre ambas fechas.
+    Un producto que se dio de baja y volvió en el medio no cuenta.
+    """
+    indice = construir_indice_temporal() if indice is None else indice
+    dia_a, dia_b = _dia(fecha_a), _dia(fecha_b)
+    candidatos = np.union1d(*_intervalos_entre(indice, min(dia_a, dia_b), max(dia_a, dia_b)))
+    ids = indice['ids'][candidatos]
+    desde, hasta = indice['desde'][candidatos], indice['hasta'][candidatos]
+
+    # Estado de cada candidato en ambas fechas, agregado por producto
+    estado = pd.DataFrame({'id': ids, 'en_a': (desde <= dia_a) & (dia_a < hasta),
+                           'en_b': (desde <= dia_b) & (dia_b < hasta)}).groupby('id').any()
+    return {
+        'altas': estado.index[estado['en_b'] & ~estado['en_a']].to_numpy(),
+        'bajas': estado.index[estado['en_a'] & ~estado['en_b']].to_numpy(),
+    }
+
+def consultar_al(fecha, archivo=None):
+    """CLI --as-of: cuántos productos había en el listado en `fecha` y, si se pide, el listado en CSV"""
+    df = listado_al(fecha)
+    print(f"📅 Productos en el listado al {fecha}: {len(df):,}")
+    if archivo:
+        df.to_csv(archivo, index=False)
+        print(f"✅ Listado al {fecha}: {archivo}")
+    return df
+
+def consultar_diferencias(fecha_a, fecha_b, archivo=None):
+    """CLI --diff: altas y bajas netas entre dos fechas y, si se pide, el detalle en CSV"""
+    inicializar_eventos()
+    df_historico = cargar_historico()
+    cambios = diferencias_entre(fecha_a, fecha_b, construir_indice_temporal(df_historico, cargar_altas_bajas()))
+    df = pd.concat([df_historico[df_historico['id'].isin(cambios[tipo])].drop(columns=COLUMNAS_EVENTO, errors='ignore')
+                    .assign(cambio=tipo[:-1])
+                    for tipo in ('altas', 'bajas')], ignore_index=True)
+    print(f"📅 Entre {fecha_a} y {fecha_b}: {len(cambios['altas']):,} altas, {len(cambios['bajas']):,} bajas")
+    for _, fila in df.head(20).iterrows():
+        print(f"   - {fila['cambio']}: {fila['marca']} - {fila['denominacionventa']} (id {fila['id']})")
+    if archivo:
+        df[['cambio'] + [c for c in df.columns if c != 'cambio']].to_csv(archivo, index=False)
+        print(f"✅ Cambios entre {fecha_a} y {fecha_b}: {archivo}")
+    return df
+
+def actualizar_estadisticas_readme(stats):
     """Actualiza la sección de estadísticas en el README"""
-    # Calcular estadísticas
-    stats = {}
-    fecha_hoy = datetime.now().strftime('%Y-%m-%d')
-    
-    # Fecha de primera ejecución (primer alta registrada)
-    stats['fecha_inicio'] = df_historico['fecha_alta'].min()
-    stats['ultima_actualizacion'] = fecha_hoy
-    
-    # Productos activos y dados de baja
-    stats['productos_activos'] = len(df_historico[df_historico['fecha_baja'].isna()])
-    stats['productos_dados_baja'] = len(df_historico[df_historico['fecha_baja'].notna()])
-    stats['total_historico'] = len(df_historico)
-    stats['ultimo_cambio_detectado'] = None
-    
-    # Estadísticas semanales
-    stats['stats_semanales'] = []
-    
-    # Si existe el archivo de altas y bajas, procesar estadísticas semanales
-    if os.path.exists('data/altas_bajas.csv'):
-        df_ab = pd.read_csv('data/altas_bajas.csv')
-        if not df_ab.empty:
-            df_ab['fecha_cambio'] = pd.to_datetime(df_ab['fecha_cambio'])
-            df_ab = df_ab.sort_values('fecha_cambio')
-            ultimo_cambio = df_ab['fecha_cambio'].max()
-            if pd.notna(ultimo_cambio):
-                stats['ultimo_cambio_detectado'] = ultimo_cambio.strftime('%Y-%m-%d')
-            
-            # Agrupar por semana
-            weekly_stats = df_ab.groupby([pd.Grouper(key='fecha_cambio', freq='W'), 'tipo_cambio']).size().unstack(fill_value=0)
-            for idx, row in weekly_stats.iterrows():
-                # Sumar las altas nuevas y reactivaciones
-                altas_total = int(row.get('alta_nuevo', 0)) + int(row.get('alta_reactivado', 0))
-                stats['stats_semanales'].append({
-                    'semana': idx.strftime('%Y-%m-%d'),
-                    'altas': altas_total,
-                    'bajas': int(row.get('baja', 0)),
-                    'altas_nuevas': int(row.get('alta_nuevo', 0)),
-                    'altas_reactivadas': int(row.get('alta_reactivado', 0))
-                })
-    
+    semanas = stats['tendencia_semanal']
     # Si no hay estadísticas semanales, agregar la fecha actual con 0,0
-    if not stats['stats_semanales']:
-        stats['stats_semanales'].append({
-            'semana': datetime.now().strftime('%Y-%m-%d'),
-            'altas': 0,
-            'bajas': 0
-        })
+    if not semanas:
+        semanas = [{'semana': stats['ultima_actualizacion'], 'altas_nuevas': 0, 'altas_reactivadas': 0, 'bajas': 0}]
     
     # Actualizar README
     with open('README.md', 'r') as f:
@@ -312,12 +1742,12 @@ _Esta sección se actualiza automáticamente en cada ejecución_
 
 """.format(
         stats['fecha_inicio'],
-    stats['ultima_actualizacion'],
-    stats['ultimo_cambio_detectado'] or 'Sin cambios registrados',
-        stats['productos_activos'],
-        stats['productos_dados_baja'],
+        stats['ultima_actualizacion'],
+        stats['ultimo_cambio_detectado'] or 'Sin cambios registrados',
+        stats['total_activos'],
+        stats['total_bajas'],
         stats['total_historico'],
-        '\n'.join([f"| {s['semana']} | {s['altas']} ({s.get('altas_nuevas', 0)}/{s.get('altas_reactivadas', 0)}) | {s['bajas']} |" for s in reversed(stats['stats_semanales'][-4:])])  # Mostrar solo las últimas 4 semanas
+        '\n'.join([f"| {s['semana']} | {s['altas_nuevas'] + s['altas_reactivadas']} ({s['altas_nuevas']}/{s['altas_reactivadas']}) | {s['bajas']} |" for s in reversed(semanas[-4:])])  # Mostrar solo las últimas 4 semanas
     )
     
     pattern = r"## (?:Estado actual|Estadísticas).*?(?=## Consultas útiles|$)"
@@ -330,218 +1760,806 @@ _Esta sección se actualiza automáticamente en cada ejecución_
     with open('README.md', 'w') as f:
         f.write(content)
 
+TIPOS_ALTA = ['alta_nuevo', 'alta_reactivado']
+
+def reclasificar_altas(df_altas_bajas):
+    """Recategoriza las altas sin tipo de altas_bajas en alta_nuevo / alta_reactivado
+
+    Un alta es reactivación si el registro tiene una baja anterior del mismo
+    producto (de una fecha anterior o, el mismo día, de una fila anterior). No
+    se mira la fecha_baja del histórico: una reactivación la borra. Las altas
+    que ya tienen tipo se dejan como están, así migrar de nuevo no cambia nada.
+    Las bajas se normalizan a 'baja' y el resto de los tipos se mantiene.
+    Devuelve el registro ordenado por fecha_cambio.
+    """
+    fecha_cambio = pd.to_datetime(df_altas_bajas['fecha_cambio'], errors='coerce', format='mixed')
+    df = df_altas_bajas.iloc[np.argsort(fecha_cambio.to_numpy(), kind='stable')]
+
+    tipo = df['tipo_cambio'].astype(object).where(df['tipo_cambio'].notna(), '').astype(str).str.strip()
+    es_alta = tipo.str.startswith('alta')
+    sin_tipo = es_alta & ~tipo.isin(TIPOS_ALTA)
+    es_baja = tipo == 'baja'
+    # Bajas del mismo producto en las filas anteriores del registro (ya ordenado por fecha)
+    bajas_previas = es_baja.astype(int).groupby(df['id']).cumsum() - es_baja
+
+    df = df.assign(tipo_cambio=df['tipo_cambio'].astype(object))
+    df.loc[es_alta, 'tipo_cambio'] = tipo[es_alta]
+    df.loc[sin_tipo, 'tipo_cambio'] = np.where(bajas_previas[sin_tipo] > 0, 'alta_reactivado', 'alta_nuevo')
+    df.loc[es_baja, 'tipo_cambio'] = 'baja'
+    return df
+
 def migrar_datos_historicos():
-    """Migra los datos históricos para recategorizar las altas"""
+    """Migra los datos históricos para recategorizar las altas
+
+    La migración se aplica a los segmentos de data/eventos, que son los que
+    usa --compactar para regenerar las vistas, y a altas_bajas.csv. Al final
+    se vuelven a compactar las vistas desde los eventos ya migrados.
+    """
     print("Iniciando migración de datos históricos...")
+    # Si todavía no hay histórico de eventos, se arma con las vistas antes de migrarlas
+    inicializar_eventos()
     
-    archivo_historico = 'data/alg-historico.csv'
-    archivo_altas_bajas = 'data/altas_bajas.csv'
-    archivo_historico_backup = 'data/alg-historico.csv.bak'
-    archivo_altas_bajas_backup = 'data/altas_bajas.csv.bak'
+    archivo_historico_backup = ARCHIVO_HISTORICO + '.bak'
+    archivo_altas_bajas_backup = ARCHIVO_ALTAS_BAJAS + '.bak'
     
     # Crear backups
-    if os.path.exists(archivo_historico):
-        import shutil
-        shutil.copy2(archivo_historico, archivo_historico_backup)
+    if os.path.exists(ARCHIVO_HISTORICO):
+        shutil.copy2(ARCHIVO_HISTORICO, archivo_historico_backup)
         print(f"Backup creado: {archivo_historico_backup}")
-    
-    if os.path.exists(archivo_altas_bajas):
-        import shutil
-        shutil.copy2(archivo_altas_bajas, archivo_altas_bajas_backup)
+
+    # Las reactivaciones dependen de las bajas de segmentos anteriores: se reclasifica el registro
+    # completo y se reescriben solo los segmentos que cambiaron. Se leen como texto para
+    # reescribir el resto de las columnas tal cual (ej. rnpa con ceros adelante)
+    segmentos = segmentos_cambios()
+    if segmentos:
+        columnas = {segmento: pd.read_csv(segmento, dtype=str, nrows=0).columns for segmento in segmentos}
+        df_eventos = pd.concat([pd.read_csv(segmento, dtype=str).assign(_segmento=segmento) for segmento in segmentos],
+                               ignore_index=True)
+        # sort_index: dentro de cada segmento se conserva el orden de las filas (la última gana al materializar)
+        df_migrado = reclasificar_altas(df_eventos).sort_index()
+        cambiados = df_migrado.loc[df_migrado['tipo_cambio'].fillna('').ne(df_eventos['tipo_cambio'].fillna('')), '_segmento'].unique()
+        for segmento in cambiados:
+            df_migrado.loc[df_migrado['_segmento'] == segmento, columnas[segmento]].to_csv(segmento, index=False)
+        if len(cambiados):
+            print(f"✅ Segmentos de cambios migrados: {len(cambiados)}")
+
+    if os.path.exists(ARCHIVO_ALTAS_BAJAS):
+        shutil.copy2(ARCHIVO_ALTAS_BAJAS, archivo_altas_bajas_backup)
         print(f"Backup creado: {archivo_altas_bajas_backup}")
         
-        # Leer archivo histórico y altas_bajas existente
-        df_historico = pd.read_csv(archivo_historico)
-        df_altas_bajas = pd.read_csv(archivo_altas_bajas)
-        
-        # Ordenar por fecha para procesar cronológicamente
-        df_altas_bajas = df_altas_bajas.sort_values('fecha_cambio')
+        df_altas_bajas = pd.read_csv(ARCHIVO_ALTAS_BAJAS)
+        df_nuevas_altas_bajas = reclasificar_altas(df_altas_bajas)
+        df_nuevas_altas_bajas.to_csv(ARCHIVO_ALTAS_BAJAS, index=False)
+        print(f"✅ Archivo de altas y bajas migrado: {ARCHIVO_ALTAS_BAJAS}")
 
-        # Preparar lookup desde histórico para detectar reactivaciones
-        df_historico_lookup = None
-        if os.path.exists(archivo_historico):
-            try:
-                df_historico_lookup = pd.read_csv(archivo_historico)
-                if 'id' in df_historico_lookup.columns:
-                    df_historico_lookup['fecha_baja'] = pd.to_datetime(df_historico_lookup['fecha_baja'], errors='coerce')
-                    df_historico_lookup = df_historico_lookup.set_index('id')
-                else:
-                    df_historico_lookup = None
-            except Exception:
-                df_historico_lookup = None
-
-        filas_nuevas = []
-
-        for _, row in df_altas_bajas.iterrows():
-            pid = row.get('id')
-            tipo = str(row.get('tipo_cambio', '')).strip() if pd.notna(row.get('tipo_cambio', '')) else ''
-            fecha_cambio = row.get('fecha_cambio')
-            # normalizar fecha_cambio a datetime
-            try:
-                fecha_dt = pd.to_datetime(fecha_cambio)
-            except Exception:
-                fecha_dt = None
-
-            if tipo.startswith('alta') or tipo == 'alta':
-                nuevo_tipo = 'alta_nuevo'
-                # Si el histórico indica que este producto tuvo una fecha_baja anterior a esta fecha, es reactivado
-                if df_historico_lookup is not None and pid in df_historico_lookup.index:
-                    hist_row = df_historico_lookup.loc[pid]
-                    fecha_baja_hist = hist_row.get('fecha_baja')
-                    if pd.notna(fecha_baja_hist) and fecha_dt is not None:
-                        # comparar fechas
-                        try:
-                            fecha_baja_dt = pd.to_datetime(fecha_baja_hist)
-                            if fecha_baja_dt <= fecha_dt:
-                                nuevo_tipo = 'alta_reactivado'
-                        except Exception:
-                            pass
-
-                new_row = row.copy()
-                new_row['tipo_cambio'] = nuevo_tipo
-                filas_nuevas.append(new_row)
-
-            elif tipo == 'baja':
-                new_row = row.copy()
-                new_row['tipo_cambio'] = 'baja'
-                filas_nuevas.append(new_row)
-
-            else:
-                # Mantener otros tipos
-                filas_nuevas.append(row)
-
-        df_nuevas_altas_bajas = pd.DataFrame(filas_nuevas)
-        df_nuevas_altas_bajas.to_csv(archivo_altas_bajas, index=False)
-        print(f"✅ Archivo de altas y bajas migrado: {archivo_altas_bajas}")
+    # Las vistas y sus snapshots se regeneran desde los eventos migrados
+    if archivo_base() is not None:
+        compactar_historico()
     
     print("✅ Migración completada")
     return True
 
-def main():
-    """Función principal"""
-    
+ARCHIVO_REPORTE = 'data/run_report.json'
+FUNCIONES_CALIENTES = 15
+
+def crear_reporte(perfil=False, memoria=False):
+    """Reporte de una ejecución: etapas medidas y opciones de perfilado
+
+    - perfil: cProfile por etapa; se imprimen y guardan las funciones más costosas
+    - memoria: tracemalloc por etapa; agrega el pico de memoria asignada desde Python
+    """
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'perfil': perfil,
+        'memoria': memoria,
+        'resultado': None,
+        'etapas': {},
+        '_inicio': time.perf_counter(),
+    }
+
+def _pico_rss_mb():
+    import resource
+    # ru_maxrss está en KB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _funciones_calientes(perfilador, cantidad=FUNCIONES_CALIENTES):
+    """Las funciones con más tiempo acumulado de un cProfile, en formato serializable"""
+    import pstats
+
+    estadisticas = pstats.Stats(perfilador)
+    filas = sorted(estadisticas.stats.items(), key=lambda item: item[1][3], reverse=True)[:cantidad]
+    return [{
+        'funcion': f"{os.path.basename(archivo)}:{linea}({nombre})",
+        'llamadas': llamadas,
+        'segundos_propios': round(tiempo_propio, 4),
+        'segundos_acumulados': round(tiempo_acumulado, 4),
+    } for (archivo, linea, nombre), (_, llamadas, tiempo_propio, tiempo_acumulado, _) in filas]
+
+@contextlib.contextmanager
+def medir_etapa(reporte, nombre, filas_entrada=None):
+    """Mide tiempo real, CPU, pico de RSS y filas de una etapa y lo agrega al reporte
+
+    El bloque puede completar `filas_entrada` y `filas_salida` en el dict que devuelve. Si la etapa
+    se repite (ej. la limpieza de cada lote) se acumula en una sola entrada.
+    Con reporte=None solo ejecuta el bloque.
+    """
+    medicion = {'filas_entrada': filas_entrada, 'filas_salida': None}
+    if reporte is None:
+        yield medicion
+        return
+
+    import cProfile
+    import tracemalloc
+
+    # Solo un cProfile a la vez y un único pico de tracemalloc: las etapas anidadas
+    # quedan incluidas en las mediciones de la etapa externa
+    perfilador = cProfile.Profile() if reporte['perfil'] and not reporte.get('_perfilando') else None
+    medir_memoria = reporte['memoria'] and not reporte.get('_midiendo_memoria')
+    if medir_memoria:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        reporte['_midiendo_memoria'] = True
+    pico_rss_inicial = _pico_rss_mb()
+    inicio, inicio_cpu = time.perf_counter(), time.process_time()
+    if perfilador:
+        reporte['_perfilando'] = True
+        perfilador.enable()
     try:
-        # 1. Descargar archivo Excel actual
-        archivo_excel = descargar_excel_alg()
-        
-        # 2. Leer archivo Excel
+        yield medicion
+    finally:
+        if perfilador:
+            perfilador.disable()
+            reporte['_perfilando'] = False
+        segundos, cpu = time.perf_counter() - inicio, time.process_time() - inicio_cpu
+        pico_rss = _pico_rss_mb()
+
+        etapa = reporte['etapas'].setdefault(nombre, {
+            'llamadas': 0, 'segundos': 0.0, 'cpu_segundos': 0.0,
+            'pico_rss_mb': 0.0, 'incremento_pico_rss_mb': 0.0,
+            'filas_entrada': None, 'filas_salida': None,
+        })
+        etapa['llamadas'] += 1
+        etapa['segundos'] = round(etapa['segundos'] + segundos, 4)
+        etapa['cpu_segundos'] = round(etapa['cpu_segundos'] + cpu, 4)
+        etapa['pico_rss_mb'] = round(pico_rss, 1)
+        etapa['incremento_pico_rss_mb'] = round(etapa['incremento_pico_rss_mb'] + pico_rss - pico_rss_inicial, 1)
+        for clave, valor in [('filas_entrada', medicion['filas_entrada']), ('filas_salida', medicion['filas_salida'])]:
+            if valor is not None:
+                etapa[clave] = (etapa[clave] or 0) + int(valor)
+        if medir_memoria:
+            reporte['_midiendo_memoria'] = False
+            pico = tracemalloc.get_traced_memory()[1] / 2**20
+            etapa['pico_tracemalloc_mb'] = round(max(etapa.get('pico_tracemalloc_mb', 0), pico), 1)
+        if perfilador:
+            etapa['funciones_calientes'] = _funciones_calientes(perfilador)
+
+def escribir_reporte(reporte, archivo=ARCHIVO_REPORTE):
+    """Guarda el reporte de la ejecución y muestra el resumen por etapa"""
+    # Tiempo real de la ejecución: varias etapas corren a la vez, así que no es la suma de las etapas
+    reporte['segundos_total'] = round(time.perf_counter() - reporte['_inicio'], 4)
+    reporte = {clave: valor for clave, valor in reporte.items() if not clave.startswith('_')}
+    os.makedirs(os.path.dirname(archivo) or '.', exist_ok=True)
+    with open(archivo, 'w', encoding='utf-8') as f:
+        json.dump(reporte, f, ensure_ascii=False, indent=2)
+
+    print(f"⏱️ Etapas ({reporte['segundos_total']:.2f}s en total):")
+    for nombre, etapa in reporte['etapas'].items():
+        filas = f", {etapa['filas_salida']:,} filas" if etapa['filas_salida'] is not None else ''
+        print(f"   - {nombre}: {etapa['segundos']:.2f}s (CPU {etapa['cpu_segundos']:.2f}s, "
+              f"pico RSS {etapa['pico_rss_mb']:,.0f} MB){filas}")
+        for funcion in etapa.get('funciones_calientes', [])[:5]:
+            print(f"       {funcion['segundos_acumulados']:>8.3f}s {funcion['llamadas']:>8} {funcion['funcion']}")
+    for nombre, fuente in reporte.get('fuentes', {}).items():
+        print(f"   - fuente {nombre}: {fuente.get('segundos_total', 0):.2f}s ({fuente['resultado']})")
+    print(f"✅ Reporte de la ejecución: {archivo}")
+
+class DetenerEtapas(Exception):
+    """La lanza una etapa para terminar la ejecución sin error (ej. el archivo no cambió)"""
+
+    def __init__(self, resultado):
+        super().__init__(resultado)
+        self.resultado = resultado
+
+def ejecutar_etapas(etapas, reporte=None, max_workers=4):
+    """Ejecuta un grafo de etapas en un pool de hilos y devuelve sus resultados
+
+    `etapas` es {nombre: (funcion, dependencias)}. Cada etapa arranca apenas
+    terminan sus dependencias, así las independientes (ej. esperar la descarga
+    y leer el histórico, o escribir el README y estadisticas.json) corren a la
+    vez. La función recibe el dict de resultados y el de medir_etapa, donde
+    puede completar las filas de entrada y salida. Si una etapa falla o lanza
+    DetenerEtapas no se arrancan más etapas y, cuando terminan las que están
+    corriendo, se propaga la excepción.
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    def correr(nombre, funcion):
+        with medir_etapa(reporte, nombre) as etapa:
+            return funcion(resultados, etapa)
+
+    resultados = {}
+    pendientes = dict(etapas)
+    en_curso = {}
+    excepcion = None
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='etapa') as pool:
+        while True:
+            if excepcion is None:
+                for nombre, (funcion, dependencias) in list(pendientes.items()):
+                    if all(dependencia in resultados for dependencia in dependencias):
+                        del pendientes[nombre]
+                        en_curso[pool.submit(correr, nombre, funcion)] = nombre
+            if not en_curso:
+                break
+            terminadas, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+            for futuro in terminadas:
+                nombre = en_curso.pop(futuro)
+                try:
+                    resultados[nombre] = futuro.result()
+                except Exception as e:
+                    excepcion = excepcion or e
+
+    if excepcion is not None:
+        raise excepcion
+    if pendientes:
+        raise ValueError(f"Etapas con dependencias que no existen: {', '.join(pendientes)}")
+    return resultados
+
+ARCHIVO_PRESENCIA = 'data/presencia.npz'
+# Bits en 1 de cada valor posible de un byte (np.bitwise_count recién existe en numpy 2)
+_BITS_POR_BYTE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def _dia_semana(fecha):
+    """Día (desde 1970) del lunes que cierra la semana W-MON de `fecha`"""
+    return _dia(_semana(pd.Series(pd.to_datetime([fecha])))[0])
+
+def _contar_bits(bits):
+    """Cantidad de bits en 1 de cada fila de un bitmap empaquetado"""
+    return _BITS_POR_BYTE[bits].sum(axis=-1, dtype=np.int64)
+
+def _bitmap(presencia, ids):
+    """Bitmap empaquetado (como una fila del índice) con los productos de `ids`"""
+    posiciones = pd.Index(presencia['ids']).get_indexer(pd.unique(np.asarray(ids)))
+    marcas = np.zeros(presencia['bits'].shape[1] * 8, dtype=bool)
+    marcas[posiciones[posiciones >= 0]] = True
+    return np.packbits(marcas, bitorder='little')
+
+def _ids_bitmap(presencia, fila):
+    """Ids de los productos con el bit en 1"""
+    marcas = np.unpackbits(fila, bitorder='little')[:len(presencia['ids'])]
+    return np.sort(presencia['ids'][marcas.astype(bool)])
+
+def presencia_vacia():
+    return {'ids': np.array([], dtype=np.int64), 'primera_semana': None,
+            'bits': np.zeros((0, 0), dtype=np.uint8)}
+
+def cargar_presencia(archivo=ARCHIVO_PRESENCIA):
+    """Índice de presencia guardado, o None si todavía no hay"""
+    if not os.path.exists(archivo):
+        return None
+    with np.load(archivo) as datos:
+        return {'ids': datos['ids'], 'primera_semana': int(datos['primera_semana']), 'bits': datos['bits']}
+
+def guardar_presencia(presencia, archivo=ARCHIVO_PRESENCIA):
+    os.makedirs(os.path.dirname(archivo), exist_ok=True)
+    # Escritura atómica: una corrida cortada no deja el índice a medias
+    temporal = archivo + '.tmp.npz'
+    np.savez_compressed(temporal, ids=presencia['ids'], primera_semana=np.int64(presencia['primera_semana']),
+                        bits=presencia['bits'])
+    os.replace(temporal, archivo)
+
+def registrar_semana(presencia, ids, fecha):
+    """Marca los productos de `ids` como presentes en la semana de `fecha`
+
+    Cada producto tiene una columna fija (los ids nuevos se agregan al final) y
+    cada semana una fila de bits empaquetados. Las semanas sin corrida desde la
+    última registrada (ej. porque el listado no cambió) repiten la anterior. Si
+    ya había una corrida esa misma semana, la última la reemplaza.
+    """
+    dia = _dia_semana(fecha)
+    ids = pd.unique(np.asarray(ids, dtype=np.int64))
+    nuevos = ids[~np.isin(ids, presencia['ids'])]
+    todos = np.concatenate([presencia['ids'], nuevos])
+    bits = presencia['bits']
+    ancho = (len(todos) + 7) // 8
+    if ancho > bits.shape[1]:
+        bits = np.pad(bits, ((0, 0), (0, ancho - bits.shape[1])))
+
+    primera = dia if presencia['primera_semana'] is None else presencia['primera_semana']
+    fila = (dia - primera) // 7
+    if fila < 0:
+        raise ValueError(f"La semana de {fecha} es anterior a la primera del índice de presencia")
+    if fila >= len(bits):
+        ultima = bits[-1:] if len(bits) else np.zeros((1, ancho), dtype=np.uint8)
+        bits = np.concatenate([bits, np.repeat(ultima, fila + 1 - len(bits), axis=0)])
+    else:
+        bits = bits.copy()
+
+    presencia = {'ids': todos, 'primera_semana': primera, 'bits': bits}
+    bits[fila] = _bitmap(presencia, ids)
+    return presencia
+
+def reconstruir_presencia(indice=None, hasta=None):
+    """Índice de presencia semanal a partir de las altas y bajas registradas
+
+    Sirve para arrancar el índice en un histórico que ya existía: cada semana
+    toma los productos activos el lunes en que termina (ver activos_al).
+    """
+    indice = construir_indice_temporal() if indice is None else indice
+    presencia = presencia_vacia()
+    dias = np.concatenate([indice['desde'][indice['desde'] != _SIN_INICIO], indice['hasta'][indice['hasta'] != _SIN_FIN]])
+    if not len(dias):
+        return presencia
+    dia = _dia_semana(_fecha_dia(dias.min()))
+    ultimo = _dia_semana(_fecha_dia(dias.max()) if hasta is None else hasta)
+    while dia <= ultimo:
+        presencia = registrar_semana(presencia, activos_al(_fecha_dia(dia), indice), _fecha_dia(dia))
+        dia += 7
+    return presencia
+
+def actualizar_presencia(ids, fecha, df_historico=None, rutas=None):
+    """Registra la corrida de `fecha` en el índice de presencia y lo guarda
+
+    Si todavía no hay índice pero sí un histórico (`df_historico`), las semanas
+    anteriores se reconstruyen primero a partir de las altas y bajas.
+    """
+    rutas = rutas or rutas_fuente()
+    presencia = cargar_presencia(rutas['presencia'])
+    if presencia is None:
+        presencia = presencia_vacia()
+        if df_historico is not None:
+            print("Reconstruyendo el índice de presencia semanal...")
+            indice = construir_indice_temporal(df_historico, cargar_altas_bajas(rutas))
+            presencia = reconstruir_presencia(indice, hasta=fecha)
+    presencia = registrar_semana(presencia, ids, fecha)
+    guardar_presencia(presencia, rutas['presencia'])
+    return presencia
+
+def _fila_presencia(presencia, fecha):
+    """Fila de bits de la semana de `fecha`; después de la última semana vale la última"""
+    fila = (_dia_semana(fecha) - presencia['primera_semana']) // 7
+    if fila < 0:
+        return np.zeros(presencia['bits'].shape[1], dtype=np.uint8)
+    return presencia['bits'][min(fila, len(presencia['bits']) - 1)]
+
+def presentes_en_semana(fecha, presencia=None):
+    """Ids de los productos que estaban en el listado la semana de `fecha`"""
+    presencia = cargar_presencia() if presencia is None else presencia
+    return _ids_bitmap(presencia, _fila_presencia(presencia, fecha))
+
+def activos_por_semana(presencia=None):
+    """Cantidad de productos en el listado cada semana (Series indexada por el lunes que la cierra)"""
+    presencia = cargar_presencia() if presencia is None else presencia
+    semanas = [_fecha_dia(presencia['primera_semana'] + 7 * i) for i in range(len(presencia['bits']))]
+    return pd.Series(_contar_bits(presencia['bits']), index=pd.Index(semanas, name='semana'), name='activos')
+
+def semanas_en_listado(ids=None, presencia=None):
+    """Cantidad de semanas que estuvo en el listado cada producto (Series indexada por id)"""
+    presencia = cargar_presencia() if presencia is None else presencia
+    total = np.zeros(presencia['bits'].shape[1] * 8, dtype=np.int64)
+    # De a bloques de semanas para no desempaquetar todo el índice junto
+    for inicio in range(0, len(presencia['bits']), 52):
+        total += np.unpackbits(presencia['bits'][inicio:inicio + 52], axis=1, bitorder='little').sum(axis=0, dtype=np.int64)
+    semanas = pd.Series(total[:len(presencia['ids'])], index=pd.Index(presencia['ids'], name='id'), name='semanas')
+    return semanas.sort_index() if ids is None else semanas.reindex(ids, fill_value=0)
+
+def churn_entre(fecha_a, fecha_b, presencia=None):
+    """Altas y bajas netas entre las semanas de dos fechas: {'altas': ids, 'bajas': ids}"""
+    presencia = cargar_presencia() if presencia is None else presencia
+    a, b = _fila_presencia(presencia, fecha_a), _fila_presencia(presencia, fecha_b)
+    return {'altas': _ids_bitmap(presencia, b & ~a), 'bajas': _ids_bitmap(presencia, a & ~b)}
+
+def retencion_cohorte(fecha, presencia=None):
+    """Fracción de los productos que entraron al listado la semana de `fecha` que sigue en cada semana posterior
+
+    La cohorte son los productos presentes esa semana y ausentes la anterior.
+    """
+    presencia = cargar_presencia() if presencia is None else presencia
+    fila = (_dia_semana(fecha) - presencia['primera_semana']) // 7
+    if not 0 < fila < len(presencia['bits']):
+        raise ValueError(f"No hay semana anterior a la de {fecha} en el índice de presencia")
+    bits = presencia['bits']
+    cohorte = bits[fila] & ~bits[fila - 1]
+    tamano = int(_contar_bits(cohorte))
+    siguen = _contar_bits(bits[fila:] & cohorte)
+    semanas = [_fecha_dia(presencia['primera_semana'] + 7 * i) for i in range(fila, len(bits))]
+    return pd.Series(siguen / tamano if tamano else np.zeros(len(siguen)),
+                     index=pd.Index(semanas, name='semana'), name='retencion')
+
+def consultar_presencia(semanas=12):
+    """CLI --presencia: tamaño del índice y productos en el listado las últimas semanas"""
+    presencia = cargar_presencia()
+    if presencia is None:
+        print(f"No hay índice de presencia: se crea en la próxima actualización ({ARCHIVO_PRESENCIA})")
+        return None
+    activos = activos_por_semana(presencia)
+    print(f"📅 Índice de presencia: {len(presencia['ids']):,} productos, {len(activos)} semanas "
+          f"({os.path.getsize(ARCHIVO_PRESENCIA) / 1024:.0f} KB)")
+    anteriores = activos.shift()
+    for semana, cantidad in activos.tail(semanas).items():
+        cambio = '' if pd.isna(anteriores[semana]) else f" ({cantidad - anteriores[semana]:+,.0f})"
+        print(f"   - {semana}: {cantidad:,}{cambio}")
+    return activos
+
+ARCHIVO_FUENTES = 'fuentes.json'
+ARCHIVO_COMBINADO = 'data/combinado.csv'
+
+def cargar_fuentes(archivo=ARCHIVO_FUENTES):
+    """Fuentes a procesar: ANMAT primero y luego las declaradas en fuentes.json
+
+    Cada fuente extra es un dict con 'nombre' y, o bien 'url' (Excel publicado
+    en una URL fija), o bien 'url_home' y 'url_exportar' (formulario como el de
+    ANMAT). Todas tienen que usar el mismo esquema de columnas que ANMAT.
+    """
+    fuentes = [{'nombre': FUENTE_PRINCIPAL, 'url_home': URL_HOME, 'url_exportar': URL_EXPORTAR}]
+    if not os.path.exists(archivo):
+        return fuentes
+    with open(archivo, encoding='utf-8') as f:
+        extras = json.load(f)
+
+    for fuente in extras:
+        nombre = fuente.get('nombre', '')
+        if not re.fullmatch(r'[a-z0-9_-]+', nombre):
+            raise ValueError(f"Nombre de fuente inválido en {archivo}: {nombre!r}")
+        if nombre in {f['nombre'] for f in fuentes}:
+            raise ValueError(f"Fuente repetida en {archivo}: {nombre}")
+        if 'url' not in fuente and not {'url_home', 'url_exportar'} <= fuente.keys():
+            raise ValueError(f"La fuente {nombre} necesita 'url' o 'url_home' y 'url_exportar'")
+        fuentes.append(fuente)
+    return fuentes
+
+def descargar_fuente(fuente, filename):
+    """Descarga el Excel de una fuente según cómo se publica"""
+    if 'url' in fuente:
+        return descargar_excel_directo(fuente['url'], filename)
+    return descargar_excel_alg(fuente['url_home'], fuente['url_exportar'], filename)
+
+def _precargar_modulos():
+    """Importa openpyxl y pyarrow mientras se descarga el Excel (la primera importación tarda)"""
+    import openpyxl  # noqa: F401
+    with contextlib.suppress(ImportError):
+        import pyarrow.feather  # noqa: F401
+
+def procesar_fuente(fuente, perfil=False, memoria=False):
+    """Descarga, lectura, limpieza y diferencias de una fuente, con su propio histórico
+
+    Las etapas corren como un grafo (ejecutar_etapas): el histórico, el
+    registro de altas y bajas y las huellas previas se cargan mientras se
+    descarga el Excel, y el CSV, el snapshot y las huellas de filas del listado
+    se escriben a la vez. Corre en un proceso aparte cuando hay varias fuentes.
+    Devuelve el resultado, las etapas medidas y lo que necesitan las etapas
+    siguientes. Las huellas de una fuente actualizada se devuelven sin guardar:
+    se guardan al final de la corrida para no saltear una fuente si algo falla
+    a mitad de camino.
+    """
+    reporte = crear_reporte(perfil=perfil, memoria=memoria)
+    rutas = rutas_fuente(fuente['nombre'])
+    resultado = {'nombre': fuente['nombre'], 'etapas': reporte['etapas'], 'df_actual': None,
+                 'df_historico': None, 'df_altas_bajas': None}
+
+    def terminar(estado, **datos):
+        return {**resultado, **datos, 'resultado': estado,
+                'segundos_total': round(time.perf_counter() - reporte['_inicio'], 4)}
+
+    # 1. Descargar archivo Excel actual (mientras tanto se carga lo de la corrida anterior)
+    def descarga(r, etapa):
+        return descargar_fuente(fuente, rutas['excel'])
+
+    def historico_previo(r, etapa):
+        inicializar_eventos(rutas)
+        df_historico = cargar_historico(rutas)
+        etapa['filas_salida'] = None if df_historico is None else len(df_historico)
+        return df_historico
+
+    def altas_bajas_previas(r, etapa):
+        return _cargar_altas_bajas(rutas)
+
+    def precarga(r, etapa):
+        _precargar_modulos()
+        return cargar_huellas(rutas)
+
+    # Si el archivo es idéntico al de la última ejecución no hay nada que hacer
+    def huella(r, etapa):
+        huella = huella_archivo(r['descarga'])
+        if huella == r['precarga'].get('archivo'):
+            print(f"✅ El archivo de {fuente['nombre']} no cambió desde la última ejecución")
+            raise DetenerEtapas('sin_cambios_archivo')
+        return huella
+
+    # 2. Leer archivo Excel
+    # 3. Limpiar datos y crear/actualizar CSV equivalente (streaming por lotes, limpiando mientras se lee)
+    def ingesta(r, etapa):
         print("Procesando archivo Excel...")
-        df_actual = pd.read_excel(archivo_excel)
-        print(f"Productos en archivo actual: {len(df_actual)}")
-        
-        # 3. Limpiar datos y crear/actualizar CSV equivalente
-        archivo_csv = 'data/alg-listado.csv'
-        df_actual_limpio = limpiar_dataframe(df_actual)
-        df_actual_limpio.to_csv(archivo_csv, index=False)
-        print(f"✅ CSV creado: {archivo_csv}")
-        
-        # 4. Actualizar histórico con fechas de alta/baja usando datos limpios
-        df_historico = actualizar_historico(df_actual_limpio)
-        
-        # 5. Actualizar estadísticas en README
-        actualizar_estadisticas_readme(df_historico)
+        df_actual_limpio = pd.concat(ingerir_excel(r['descarga'], rutas['listado'], reporte=reporte), ignore_index=True)
+        etapa['filas_salida'] = len(df_actual_limpio)
+        print(f"Productos en archivo actual: {len(df_actual_limpio)}")
+        return df_actual_limpio
+
+    def snapshot_listado(r, etapa):
+        etapa['filas_entrada'] = len(r['ingesta'])
+        return guardar_snapshot(r['ingesta'], rutas['listado'])
+
+    # Mismo contenido en otro archivo (ej. solo cambió la fecha de exportación)
+    def huellas(r, etapa):
+        etapa['filas_entrada'] = len(r['ingesta'])
+        filas = huellas_filas(r['ingesta'])
+        if filas.to_dict() == r['precarga'].get('filas'):
+            guardar_huellas(r['huella_archivo'], filas, rutas)
+            print(f"✅ El contenido del listado de {fuente['nombre']} no cambió desde la última ejecución")
+            raise DetenerEtapas('sin_cambios_contenido')
+        return filas
+
+    # 4. Actualizar histórico con fechas de alta/baja usando datos limpios
+    def historico(r, etapa):
+        etapa['filas_entrada'] = len(r['ingesta'])
+        filas_previas = r['precarga'].get('filas')
+        # Solo los productos cuya huella cambió se comparan campo a campo
+        modificados = ids_modificados(r['huellas_filas'], filas_previas) if filas_previas else None
+        df_historico = actualizar_historico(r['ingesta'], modificados, r['historico_previo'], rutas)
+        etapa['filas_salida'] = len(df_historico)
+        return df_historico
+
+    def altas_bajas(r, etapa):
+        df_altas_bajas, hasta = r['altas_bajas_previas']
+        return agregar_segmento_a_altas_bajas(df_altas_bajas, hasta, datetime.now().strftime('%Y-%m-%d'), rutas)
+
+    etapas = {
+        'descarga': (descarga, []),
+        'historico_previo': (historico_previo, []),
+        'altas_bajas_previas': (altas_bajas_previas, ['historico_previo']),
+        'precarga': (precarga, []),
+        'huella_archivo': (huella, ['descarga', 'precarga']),
+        # inicializar_eventos() puede necesitar el listado anterior: la ingesta lo pisa
+        'ingesta': (ingesta, ['huella_archivo', 'historico_previo']),
+        'snapshot_listado': (snapshot_listado, ['ingesta']),
+        'huellas_filas': (huellas, ['ingesta', 'precarga']),
+        # actualizar_historico agrega columnas al listado: espera a que se escriba el snapshot
+        'actualizar_historico': (historico, ['huellas_filas', 'historico_previo', 'snapshot_listado']),
+        'altas_bajas': (altas_bajas, ['actualizar_historico', 'altas_bajas_previas']),
+    }
+    # Con cProfile o tracemalloc las etapas corren de a una para no mezclar las mediciones
+    try:
+        r = ejecutar_etapas(etapas, reporte, max_workers=1 if perfil or memoria else 4)
+    except DetenerEtapas as e:
+        return terminar(e.resultado)
+
+    return terminar('actualizado', df_actual=r['ingesta'], df_historico=r['actualizar_historico'],
+                    df_altas_bajas=r['altas_bajas'], huella=r['huella_archivo'], filas=r['huellas_filas'])
+
+def procesar_fuentes(fuentes, perfil=False, memoria=False):
+    """Procesa todas las fuentes en paralelo, un proceso por fuente
+
+    Con una sola fuente se procesa en este mismo proceso. Si falla la fuente
+    principal se propaga el error; si falla otra, queda registrada como
+    'error' y el resto sigue.
+    """
+    if len(fuentes) == 1:
+        return {fuentes[0]['nombre']: procesar_fuente(fuentes[0], perfil, memoria)}
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    resultados = {}
+    with ProcessPoolExecutor(max_workers=len(fuentes)) as pool:
+        futuros = {f['nombre']: pool.submit(procesar_fuente, f, perfil, memoria) for f in fuentes}
+        for nombre, futuro in futuros.items():
+            try:
+                resultados[nombre] = futuro.result()
+            except Exception as e:
+                if nombre == FUENTE_PRINCIPAL:
+                    raise
+                print(f"❌ Error en la fuente {nombre}: {e}")
+                resultados[nombre] = {'nombre': nombre, 'resultado': 'error', 'error': str(e), 'etapas': {}}
+    return resultados
+
+def combinar_fuentes(historicos):
+    """Vista combinada de todas las fuentes, un producto por rnpa
+
+    `historicos` es {nombre: df_historico} en orden de prioridad (la principal
+    primero): los datos del producto salen de la primera fuente que lo tiene,
+    prefiriendo un registro activo. Se agregan las fuentes donde aparece, en
+    cuáles sigue activo, la primera fecha de alta y, si ya no está activo en
+    ninguna, la última fecha de baja. Los productos sin rnpa (vacío o '-')
+    quedan afuera.
+    """
+    partes = [df.drop(columns=COLUMNAS_EVENTO, errors='ignore')
+                .assign(fuente=nombre, _prioridad=i)
+              for i, (nombre, df) in enumerate(historicos.items()) if df is not None]
+    df = pd.concat(partes, ignore_index=True)
+    df['rnpa'] = df['rnpa'].astype('string').str.strip()
+    df = df[df['rnpa'].str.contains(r'\d', na=False)]
+    df['_activo'] = df['fecha_baja'].isna()
+
+    por_rnpa = df.groupby('rnpa', sort=False)
+    fuentes = por_rnpa['fuente'].agg(lambda s: '|'.join(dict.fromkeys(s)))
+    activo_en = df[df['_activo']].groupby('rnpa', sort=False)['fuente'].agg(lambda s: '|'.join(dict.fromkeys(s)))
+    primera_alta = pd.to_datetime(df['fecha_alta'], errors='coerce', format='mixed').groupby(df['rnpa']).min()
+    ultima_baja = pd.to_datetime(df['fecha_baja'], errors='coerce', format='mixed').groupby(df['rnpa']).max()
+
+    vista = (df.sort_values(['_prioridad', '_activo'], ascending=[True, False], kind='stable')
+               .drop_duplicates('rnpa')
+               .set_index('rnpa'))
+    vista['fuentes'] = fuentes
+    vista['activo_en'] = activo_en
+    vista['fecha_alta'] = primera_alta.dt.strftime('%Y-%m-%d')
+    vista['fecha_baja'] = ultima_baja.dt.strftime('%Y-%m-%d').where(vista['activo_en'].isna())
+    return (vista.drop(columns=['fuente', '_prioridad', '_activo'])
+                 .sort_index()
+                 .reset_index())
+
+def escribir_vista_combinada(resultados, archivo=ARCHIVO_COMBINADO):
+    """Escribe la vista combinada a partir del histórico de cada fuente"""
+    historicos = {}
+    for nombre, resultado in resultados.items():
+        # Las fuentes sin cambios (o que fallaron) aportan su último histórico
+        historicos[nombre] = resultado.get('df_historico')
+        if historicos[nombre] is None:
+            historicos[nombre] = cargar_historico(rutas_fuente(nombre))
+
+    df_combinado = combinar_fuentes(historicos)
+    df_combinado.to_csv(archivo, index=False)
+    print(f"✅ Vista combinada: {archivo} ({len(df_combinado):,} productos de {len(historicos)} fuentes)")
+    return df_combinado
+
+def crear_pool_procesos(max_workers=2):
+    """Pool de procesos para las salidas que usan mucha CPU (None si no se puede hacer fork)
+
+    Los hilos comparten el GIL, así que el dashboard, el índice de búsqueda y
+    los duplicados solo corren de verdad en paralelo en procesos aparte. Los
+    procesos se crean acá, antes de arrancar los hilos de las etapas, porque
+    hacer fork con otros hilos corriendo puede dejar locks tomados en el hijo.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('fork'))
+    # Con fork se lanzan todos los procesos en el primer submit
+    pool.submit(int).result()
+    return pool
+
+def _en_proceso(procesos, funcion, *args):
+    """Corre `funcion` en el pool de procesos si hay uno, si no en el hilo actual"""
+    return funcion(*args) if procesos is None else procesos.submit(funcion, *args).result()
+
+def etapas_salidas(principal, sqlite=False, procesos=None):
+    """Etapas que escriben las salidas de ANMAT a partir del histórico actualizado
+
+    README, estadisticas.json, el dashboard, el índice de búsqueda, los
+    posibles duplicados y la base SQLite no dependen entre sí (salvo de las
+    estadísticas), así que se escriben a la vez. Con `procesos` (ver
+    crear_pool_procesos) las más pesadas corren en otro proceso.
+    """
+    df_actual_limpio, df_historico = principal['df_actual'], principal['df_historico']
+    df_altas_bajas = principal['df_altas_bajas']
+
+    # 5. Calcular estadísticas una sola vez para el README y el JSON (solo aplicando los cambios nuevos)
+    def estadisticas(r, etapa):
+        etapa['filas_entrada'] = len(df_historico)
+        return estadisticas_desde_estado(actualizar_estado_estadisticas(df_historico))
+
+    def readme(r, etapa):
+        actualizar_estadisticas_readme(r['estadisticas'])
         print("✅ README actualizado con estadísticas")
 
-        # 6. Generar estadisticas.json con estadísticas completas
-        import json
-        df_activos = df_historico[df_historico['fecha_baja'].isna()]
-        df_bajas = df_historico[df_historico['fecha_baja'].notna()]
-
-        # --- Totales generales ---
-        total_activos = len(df_activos)
-        total_bajas = len(df_bajas)
-        total_historico = len(df_historico)
-
-        # --- Por marca (activos) ---
-        por_marca = df_activos['marca'].value_counts().to_dict() if 'marca' in df_activos.columns else {}
-
-        # --- Por tipo de producto (activos) ---
-        por_tipo = df_activos['TipoProducto'].value_counts().to_dict() if 'TipoProducto' in df_activos.columns else {}
-
-        # --- Tendencia semanal de altas y bajas ---
-        tendencia_semanal = []
-        if os.path.exists('data/altas_bajas.csv'):
-            df_ab = pd.read_csv('data/altas_bajas.csv')
-            if not df_ab.empty:
-                df_ab['fecha_cambio'] = pd.to_datetime(df_ab['fecha_cambio'], errors='coerce')
-                df_ab = df_ab.dropna(subset=['fecha_cambio'])
-                weekly = df_ab.groupby([pd.Grouper(key='fecha_cambio', freq='W-MON'), 'tipo_cambio']).size().unstack(fill_value=0)
-                for idx_w, row_w in weekly.iterrows():
-                    tendencia_semanal.append({
-                        'semana': idx_w.strftime('%Y-%m-%d'),
-                        'altas_nuevas': int(row_w.get('alta_nuevo', 0)),
-                        'altas_reactivadas': int(row_w.get('alta_reactivado', 0)),
-                        'bajas': int(row_w.get('baja', 0))
-                    })
-
-        # --- Palabras clave en denominaciones (activos) ---
-        STOPWORDS = {
-            'de', 'del', 'la', 'el', 'los', 'las', 'y', 'en', 'con', 'sin', 'a', 'al',
-            'un', 'una', 'por', 'para', 'o', 'e', 'su', 'se', 'es', 'no', 'que',
-            'libre', 'gluten', 'sin', 'tacc', 'sta', 'cc', '-', 'kg', 'gr', 'ml',
-            'lt', 'g', 'x', 'n°', 'nro', 'cert', 'certificado', 'tac',
-        }
-        from collections import Counter
-        import re as _re
-        palabras_counter = Counter()
-        if 'denominacionventa' in df_activos.columns:
-            for denom in df_activos['denominacionventa'].dropna():
-                tokens = _re.findall(r'[a-záéíóúüñ]{3,}', str(denom).lower())
-                for tok in tokens:
-                    if tok not in STOPWORDS:
-                        palabras_counter[tok] += 1
-        top_palabras = dict(palabras_counter.most_common(60))
-
-        # --- Top marcas con más altas recientes (últimas 8 semanas) ---
-        top_marcas_altas_recientes = {}
-        top_tipos_altas_recientes = {}
-        if os.path.exists('data/altas_bajas.csv'):
-            df_ab2 = pd.read_csv('data/altas_bajas.csv')
-            if not df_ab2.empty:
-                df_ab2['fecha_cambio'] = pd.to_datetime(df_ab2['fecha_cambio'], errors='coerce')
-                df_ab2 = df_ab2.dropna(subset=['fecha_cambio'])
-                fecha_corte = df_ab2['fecha_cambio'].max() - pd.Timedelta(weeks=8)
-                df_recientes = df_ab2[
-                    (df_ab2['fecha_cambio'] >= fecha_corte) &
-                    (df_ab2['tipo_cambio'].str.startswith('alta', na=False))
-                ]
-                if 'marca' in df_recientes.columns:
-                    top_marcas_altas_recientes = df_recientes['marca'].value_counts().head(15).to_dict()
-                if 'TipoProducto' in df_recientes.columns:
-                    top_tipos_altas_recientes = df_recientes['TipoProducto'].value_counts().head(15).to_dict()
-
-        estadisticas = {
-            "total_activos": total_activos,
-            "total_bajas": total_bajas,
-            "total_historico": total_historico,
-            "por_marca": por_marca,
-            "por_tipo_producto": por_tipo,
-            "tendencia_semanal": tendencia_semanal,
-            "top_palabras_clave": top_palabras,
-            "top_marcas_altas_recientes": top_marcas_altas_recientes,
-            "top_tipos_altas_recientes": top_tipos_altas_recientes,
-        }
-        with open('data/estadisticas.json', 'w') as f:
-            json.dump(estadisticas, f, ensure_ascii=False, indent=2)
-        print("✅ Archivo data/estadisticas.json generado")
+    # 6. Generar estadisticas.json con estadísticas completas
+    def estadisticas_json(r, etapa):
+        escribir_estadisticas_json(r['estadisticas'])
 
-        print("✅ Proceso completado exitosamente")
-        
-        # Mostrar estadísticas
-        productos_activos = len(df_historico[df_historico['fecha_baja'].isna()])
-        productos_dados_baja = len(df_historico[df_historico['fecha_baja'].notna()])
-        print(f"📊 Estadísticas:")
-        print(f"   - Productos activos: {productos_activos}")
-        print(f"   - Productos dados de baja: {productos_dados_baja}")
-        print(f"   - Total histórico: {len(df_historico)}")
+    # 7. Generar los fragmentos livianos que carga el dashboard
+    def dashboard(r, etapa):
+        etapa['filas_entrada'] = len(df_historico)
+        _en_proceso(procesos, generar_dashboard, df_historico, df_altas_bajas, r['estadisticas'])
+
+    def indice_busqueda(r, etapa):
+        etapa['filas_entrada'] = len(df_historico)
+        _en_proceso(procesos, generar_indice_busqueda, df_historico)
+
+    def duplicados(r, etapa):
+        etapa['filas_entrada'] = len(df_historico)
+        etapa['filas_salida'] = len(_en_proceso(procesos, detectar_duplicados, df_historico))
+
+    # 8. Base SQLite opcional para consultas puntuales
+    def base_sqlite(r, etapa):
+        etapa['filas_entrada'] = len(df_historico)
+        escribir_base_sqlite(df_actual_limpio, df_historico, df_altas_bajas)
+
+    etapas = {
+        'estadisticas': (estadisticas, []),
+        'readme': (readme, ['estadisticas']),
+        'estadisticas_json': (estadisticas_json, ['estadisticas']),
+        'dashboard': (dashboard, ['estadisticas']),
+        # generar_dashboard rehace data/dashboard/, donde también va el índice
+        'indice_busqueda': (indice_busqueda, ['dashboard']),
+        'duplicados': (duplicados, []),
+    }
+    if sqlite:
+        etapas['sqlite'] = (base_sqlite, [])
+    return etapas
+
+def main(sqlite=False, perfil=False, memoria=False):
+    """Función principal
+
+    Procesa en paralelo ANMAT y las fuentes declaradas en fuentes.json, cada una
+    con su propio histórico, y con más de una fuente escribe la vista combinada
+    por rnpa (data/combinado.csv). Estadísticas, README y dashboard salen de ANMAT.
+    Con `sqlite=True` también se escribe la base SQLite consultable (data/alg.sqlite).
+    Cada ejecución deja en data/run_report.json el tiempo, CPU, memoria y filas
+    de cada etapa; `perfil` y `memoria` agregan cProfile y tracemalloc por etapa.
+    """
+    reporte = crear_reporte(perfil=perfil, memoria=memoria)
+    
+    try:
+        # 1-4. Descargar, leer, limpiar y actualizar el histórico de cada fuente
+        fuentes = cargar_fuentes()
+        if len(fuentes) == 1:
+            resultados = procesar_fuentes(fuentes, perfil=perfil, memoria=memoria)
+            reporte['etapas'].update(resultados[FUENTE_PRINCIPAL]['etapas'])
+        else:
+            # Las etapas de cada fuente corren en paralelo: se reportan aparte y
+            # 'fuentes' mide el tiempo real de todas juntas
+            with medir_etapa(reporte, 'fuentes'):
+                resultados = procesar_fuentes(fuentes, perfil=perfil, memoria=memoria)
+            reporte['fuentes'] = {nombre: {clave: r[clave] for clave in ('resultado', 'error', 'segundos_total', 'etapas') if clave in r}
+                                  for nombre, r in resultados.items()}
+        principal = resultados[FUENTE_PRINCIPAL]
+        reporte['resultado'] = principal['resultado']
+        actualizadas = [nombre for nombre, r in resultados.items() if r['resultado'] == 'actualizado']
+
+        etapas, procesos = {}, None
+        if principal['resultado'] == 'actualizado':
+            # Con cProfile o tracemalloc todo corre en este proceso, de a una etapa
+            procesos = None if perfil or memoria else crear_pool_procesos()
+            etapas = etapas_salidas(principal, sqlite, procesos)
+        elif sqlite and not os.path.exists(ARCHIVO_SQLITE):
+            etapas['sqlite'] = (lambda r, etapa: exportar_sqlite(), [])
+
+        # Vista combinada de todas las fuentes, deduplicada por rnpa
+        if len(fuentes) > 1 and actualizadas:
+            etapas['vista_combinada'] = (lambda r, etapa: escribir_vista_combinada(resultados), [])
+
+        try:
+            stats = ejecutar_etapas(etapas, reporte, max_workers=1 if perfil or memoria else 4).get('estadisticas')
+        finally:
+            if procesos is not None:
+                procesos.shutdown()
+
+        # Las huellas se guardan al final para no saltear una corrida que falló a mitad de camino
+        for nombre in actualizadas:
+            guardar_huellas(resultados[nombre]['huella'], resultados[nombre]['filas'], rutas_fuente(nombre))
+
+        if principal['resultado'] == 'actualizado':
+            print("✅ Proceso completado exitosamente")
+            
+            # Mostrar estadísticas
+            print(f"📊 Estadísticas:")
+            print(f"   - Productos activos: {stats['total_activos']}")
+            print(f"   - Productos dados de baja: {stats['total_bajas']}")
+            print(f"   - Total histórico: {stats['total_historico']}")
         
     except Exception as e:
         print(f"❌ Error en el proceso: {e}")
+        reporte['resultado'] = 'error'
+        reporte['error'] = str(e)
         raise
+    finally:
+        escribir_reporte(reporte)
 
 if __name__ == "__main__":
     import sys
     if len(sys.argv) > 1 and sys.argv[1] == '--migrar':
         migrar_datos_historicos()
+    elif len(sys.argv) > 1 and sys.argv[1] == '--compactar':
+        for fuente in cargar_fuentes():
+            compactar_historico(rutas_fuente(fuente['nombre']))
+    elif len(sys.argv) > 1 and sys.argv[1] == '--rebuild-stats':
+        reconstruir_estadisticas()
+    elif len(sys.argv) > 2 and sys.argv[1] == '--as-of':
+        consultar_al(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    elif len(sys.argv) > 1 and sys.argv[1] == '--presencia':
+        consultar_presencia()
+    elif len(sys.argv) > 3 and sys.argv[1] == '--diff':
+        consultar_diferencias(sys.argv[2], sys.argv[3], sys.argv[4] if len(sys.argv) > 4 else None)
     else:
-        main()
\ No newline at end of file
+        opciones = sys.argv[1:]
+        main(sqlite='--sqlite' in opciones, perfil='--profile' in opciones, memoria='--tracemalloc' in opciones)
@@ -0,0 +1,67 @@
+"""Fixtures compartidas: cada test corre en un directorio temporal con su propio data/"""
+import datetime
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(RAIZ, 'scripts'))
+
+import update_alg_data  # noqa: E402
+
+@pytest.fixture
+def directorio(tmp_path, monkeypatch):
+    """Directorio de trabajo temporal con data/ vacío"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    return tmp_path
+
+@pytest.fixture
+def fecha(monkeypatch):
+    """Fecha que ve el script en datetime.now(); se cambia con fecha['hoy'] = 'AAAA-MM-DD'"""
+    fecha = {'hoy': '2025-08-04'}
+
+    class FechaSimulada(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.datetime.fromisoformat(fecha['hoy'])
+
+    monkeypatch.setattr(update_alg_data, 'datetime', FechaSimulada)
+    return fecha
+
+PALABRAS = ['ALFAJOR', 'GALLETITA', 'HARINA', 'YERBA', 'FIDEOS', 'ARROZ', 'CHOCOLATE', 'MERMELADA', 'QUESO', 'LECHE',
+            'MANZANA', 'FRUTILLA', 'VAINILLA', 'LIMON', 'NARANJA', 'CACAO', 'COCO', 'MIEL', 'DURAZNO', 'BANANA']
+
+def crear_listado(ids, cambios=None):
+    """Listado con las columnas del export de ANMAT; `cambios` es {id: {columna: valor}}
+
+    Cada id tiene una denominación distinta (hasta el id 99), así no se parecen entre sí.
+    """
+    df = pd.DataFrame({
+        'id': ids,
+        'rnpa': [f'{i % 100:03d}-00-{i:06d}' for i in ids],
+        'marca': [f'MARCA {i % 3}' for i in ids],
+        'nombreFantasia': 'NO REGISTRA',
+        'denominacionventa': [f'{PALABRAS[i % 10]} {PALABRAS[10 + i // 10 % 10]} - LIBRE DE GLUTEN' for i in ids],
+        'TipoProducto': [f'TIPO {i % 2}' for i in ids],
+        'Estado': 'VIGENTE',
+        'activo': 'Sí',
+    })
+    for id_producto, valores in (cambios or {}).items():
+        for columna, valor in valores.items():
+            df.loc[df['id'] == id_producto, columna] = valor
+    return df
+
+@pytest.fixture
+def listado():
+    return crear_listado
+
+@pytest.fixture
+def correr(fecha):
+    """Corre actualizar_historico() con el listado dado en la fecha dada"""
+    def correr(df_listado, dia):
+        fecha['hoy'] = dia
+        return update_alg_data.actualizar_historico(df_listado.copy())
+    return correr
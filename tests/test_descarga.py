@@ -0,0 +1,104 @@
+"""Descarga del Excel de ANMAT contra un servidor local (sin red)"""
+import contextlib
+import http.server
+import os
+import threading
+
+import pytest
+import requests
+import urllib3.util.retry
+
+import update_alg_data as u
+
+FORMULARIO = ''.join(f'<input type="hidden" name="{nombre}" value="x" />'
+                     for nombre in ['__VIEWSTATE', '__VIEWSTATEGENERATOR', '__EVENTVALIDATION']).encode()
+EXCEL = b'PK\x03\x04 excel de prueba'
+
+@contextlib.contextmanager
+def servidor_anmat(fallas):
+    """Formulario y exportación de ANMAT que fallan según `fallas`: {'GET'|'POST': ['503', 'timeout', ...]}
+
+    Cada pedido consume la próxima falla de su método; sin fallas pendientes responde bien.
+    Devuelve un dict con la URL y los pedidos recibidos por método.
+    """
+    estado = {'pedidos': {'GET': 0, 'POST': 0}}
+    fallas = {metodo: list(lista) for metodo, lista in fallas.items()}
+    liberar = threading.Event()
+
+    class Manejador(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _responder(self, metodo, cuerpo):
+            estado['pedidos'][metodo] += 1
+            falla = fallas.get(metodo) and fallas[metodo].pop(0)
+            if falla == 'timeout':
+                # Más que el timeout de lectura del cliente (sin time.sleep, que el test reemplaza)
+                liberar.wait(2)
+                return
+            codigo = 503 if falla == '503' else 200
+            if falla == '503':
+                cuerpo = b'Service Unavailable'
+            self.send_response(codigo)
+            self.send_header('Content-Length', str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def do_GET(self):
+            self._responder('GET', b'<html><form>' + FORMULARIO + b'</form></html>')
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            self._responder('POST', EXCEL)
+
+    servidor = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    estado['url'] = f'http://127.0.0.1:{servidor.server_port}'
+    try:
+        yield estado
+    finally:
+        liberar.set()
+        servidor.shutdown()
+        servidor.server_close()
+
+@pytest.fixture
+def esperas(monkeypatch):
+    """Esperas de backoff que pide urllib3 entre reintentos (sin esperar de verdad)"""
+    esperas = []
+    monkeypatch.setattr(urllib3.util.retry.time, 'sleep', esperas.append)
+    return esperas
+
+def _descargar(servidor, archivo, reintentos=3):
+    return u.descargar_excel_alg(url_home=servidor['url'] + '/Home', url_exportar=servidor['url'] + '/Home/ExportarExcel',
+                                 filename=archivo, session=u.crear_sesion(reintentos=reintentos, backoff=0.5),
+                                 timeout=(1, 0.3))
+
+def test_reintenta_los_503_con_backoff_exponencial(tmp_path, esperas):
+    archivo = str(tmp_path / 'alg-listado.xlsx')
+    with servidor_anmat({'GET': ['503', '503', '503'], 'POST': ['503']}) as servidor:
+        _descargar(servidor, archivo)
+
+    assert servidor['pedidos'] == {'GET': 4, 'POST': 2}
+    # urllib3 no espera antes del primer reintento y después duplica: backoff * 2 ** (fallas - 1)
+    assert esperas == [1.0, 2.0]
+    assert open(archivo, 'rb').read() == EXCEL
+
+def test_reintenta_los_timeouts(tmp_path, esperas):
+    archivo = str(tmp_path / 'alg-listado.xlsx')
+    with servidor_anmat({'GET': ['timeout'], 'POST': ['timeout', 'timeout']}) as servidor:
+        _descargar(servidor, archivo)
+
+    assert servidor['pedidos'] == {'GET': 2, 'POST': 3}
+    assert esperas == [1.0]
+    assert open(archivo, 'rb').read() == EXCEL
+
+def test_agotados_los_reintentos_no_deja_archivo(tmp_path, esperas):
+    archivo = str(tmp_path / 'alg-listado.xlsx')
+    with servidor_anmat({'POST': ['503'] * 10}) as servidor:
+        with pytest.raises(requests.HTTPError, match='503'):
+            _descargar(servidor, archivo, reintentos=2)
+
+    assert servidor['pedidos'] == {'GET': 1, 'POST': 3}
+    assert esperas == [1.0]
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,54 @@
+"""Motor de diferencias: altas, bajas, reactivaciones y modificaciones"""
+import json
+
+import pandas as pd
+import pytest
+
+import update_alg_data as u
+
+def test_modificaciones_contra_historico_del_snapshot(directorio, listado, correr):
+    correr(listado([1, 2, 3]), '2025-07-28')
+    u.compactar_historico()
+    # El histórico sale del snapshot Feather, con columnas categóricas
+    assert (directorio / 'data' / 'alg-historico.feather').exists()
+
+    correr(listado([1, 2, 3], {2: {'marca': 'MARCA NUEVA', 'Estado': None}}), '2025-08-04')
+
+    df_altas_bajas = u.cargar_altas_bajas()
+    modificacion = df_altas_bajas[df_altas_bajas['tipo_cambio'] == 'modificacion']
+    assert modificacion['id'].tolist() == [2]
+    assert modificacion['campos_modificados'].iloc[0] == 'marca|Estado'
+    assert json.loads(modificacion['valores_anteriores'].iloc[0]) == {'marca': 'MARCA 2', 'Estado': 'VIGENTE'}
+    assert u.cargar_historico().set_index('id').loc[2, 'marca'] == 'MARCA NUEVA'
+
+def test_las_columnas_de_eventos_no_pasan_al_historico(directorio, listado, correr):
+    correr(listado([1, 2, 3]), '2025-07-28')
+    # 2 se modifica; 4 reemplaza a 3 con los mismos datos (reinscripción)
+    reinscripcion = listado([3]).iloc[0].drop('id').to_dict()
+    correr(listado([1, 2, 4], {2: {'marca': 'MARCA NUEVA'}, 4: reinscripcion}), '2025-08-04')
+    correr(listado([1]), '2025-08-11')
+    u.compactar_historico()
+
+    columnas_evento = ['tipo_cambio', 'fecha_cambio', 'campos_modificados', 'valores_anteriores', 'reinscripcion_de']
+    assert not set(columnas_evento) & set(pd.read_csv(u.ARCHIVO_HISTORICO).columns)
+    assert not set(columnas_evento) & set(u.cargar_historico().columns)
+
+    df_altas_bajas = u.cargar_altas_bajas()
+    assert df_altas_bajas.loc[df_altas_bajas['id'] == 4, 'reinscripcion_de'].tolist()[0] == 3
+    bajas = df_altas_bajas[df_altas_bajas['fecha_cambio'] == '2025-08-11']
+    assert sorted(bajas['id']) == [2, 4]
+    assert bajas[['campos_modificados', 'valores_anteriores', 'reinscripcion_de']].isna().all().all()
+
+@pytest.mark.filterwarnings('error::FutureWarning')
+def test_corridas_sin_futurewarnings_de_pandas(directorio, listado, correr):
+    def con_rnpa_numerico(ids, cambios=None):
+        df = listado(ids, cambios)
+        df['rnpa'] = df['id'] * 1000
+        return df
+
+    # rnpa numérico (como lo lee pandas del export) y corridas sin altas o sin bajas
+    correr(con_rnpa_numerico([1, 2, 3]), '2025-07-28')
+    correr(con_rnpa_numerico([1, 2]), '2025-08-04')
+    correr(con_rnpa_numerico([1, 2, 3], cambios={1: {'marca': 'OTRA'}}), '2025-08-11')
+    u.compactar_historico()
+    correr(con_rnpa_numerico([2, 3, 4], cambios={2: {'TipoProducto': None}}), '2025-08-18')
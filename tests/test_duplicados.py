@@ -0,0 +1,51 @@
+"""Posibles duplicados y reinscripciones (pares_similares / vincular_reinscripciones)"""
+import pandas as pd
+
+import update_alg_data as u
+
+# (marca, nombreFantasia, denominacionventa, grupo): los productos del mismo grupo son el mismo producto
+PRODUCTOS = [
+    ('LA SERENISIMA', 'NO REGISTRA', 'LECHE ENTERA UAT - LIBRE DE GLUTEN', 'leche'),
+    ('LA SERENÍSIMA', 'NO REGISTRA', 'LECHE ENTERA UAT. LIBRE DE GLUTEN. SIN TACC', 'leche'),
+    ('SWIFT', 'NO REGISTRA', 'HAMBURGUESAS DE CARNE VACUNA SUPERCONGELADAS - LIBRE DE GLUTEN', 'hamburguesas'),
+    ('SWIFT', '-', 'HAMBURGUESAS DE CARNE VACUNA SUPERCONGELADAS LIBRE DE GLUTEN', 'hamburguesas'),
+    ('AGUILA', 'FRAMBUESA', 'CHOCOLATE AMARGO CON FRAMBUESA', 'chocolate'),
+    ('ÁGUILA', 'FRAMBUESA.', 'CHOCOLATE AMARGO CON FRAMBUESA - LIBRE DE GLUTEN', 'chocolate'),
+    # Variedades de sabor de una misma marca
+    ('CLIGHT', 'NO REGISTRA', 'POLVO PARA PREPARAR BEBIDA ANALCOHOLICA DIETETICA SABOR NARANJA DURAZNO - LIBRE DE GLUTEN', None),
+    ('CLIGHT', 'NO REGISTRA', 'POLVO PARA PREPARAR BEBIDA ANALCOHOLICA DIETETICA SABOR NARANJA - LIBRE DE GLUTEN', None),
+    ('ARCOR', 'NO REGISTRA', 'MERMELADA DE FRUTILLA - LIBRE DE GLUTEN', None),
+    ('ARCOR', 'NO REGISTRA', 'MERMELADA DE DURAZNO - LIBRE DE GLUTEN', None),
+    # Otra marca con la misma denominación
+    ('PATY', 'NO REGISTRA', 'HAMBURGUESAS DE CARNE VACUNA SUPERCONGELADAS - LIBRE DE GLUTEN', None),
+    # Sin marca no hay cómo confirmar que sean el mismo producto
+    ('NO REGISTRA', 'NO REGISTRA', 'JAMON COCIDO - LIBRE DE GLUTEN', None),
+    ('NO REGISTRA', 'NO REGISTRA', 'JAMÓN COCIDO LIBRE DE GLUTEN', None),
+]
+
+def _productos():
+    df = pd.DataFrame(PRODUCTOS, columns=['marca', 'nombreFantasia', 'denominacionventa', 'grupo'])
+    return df.assign(id=range(1, len(df) + 1))
+
+def _pares(df):
+    return set(zip(df['pos_a'], df['pos_b']))
+
+def test_pares_similares_en_productos_etiquetados():
+    df = _productos()
+    encontrados = _pares(u.pares_similares(df))
+
+    grupos = df.dropna(subset=['grupo']).reset_index()
+    esperados = _pares(grupos.merge(grupos, on='grupo').query('index_x < index_y')
+                             .rename(columns={'index_x': 'pos_a', 'index_y': 'pos_b'}))
+    assert esperados == {(0, 1), (2, 3), (4, 5)}
+    # Precisión y cobertura: ni variedades de sabor, ni otras marcas, ni productos sin marca
+    assert encontrados == esperados
+
+def test_reinscripcion_solo_del_mismo_producto():
+    df = _productos()
+    altas, bajas = df.iloc[[1, 7, 10]], df.iloc[[0, 6, 2]]
+
+    reinscripcion_de = u.vincular_reinscripciones(altas, bajas)
+
+    assert reinscripcion_de.tolist()[0] == 1
+    assert reinscripcion_de.iloc[1:].isna().all()
@@ -0,0 +1,84 @@
+"""Estadísticas incrementales (data/estadisticas_estado.json)"""
+import os
+import shutil
+
+import pandas as pd
+
+import update_alg_data as u
+from conftest import RAIZ
+
+def _comparables(estado):
+    return {clave: valor for clave, valor in estado.items() if clave not in ('hasta', 'filas_hasta')}
+
+def test_incrementales_despues_de_una_carga_inicial_sin_cambios(directorio, listado, correr):
+    correr(listado([1, 2, 3]), '2025-07-28')
+    u.actualizar_estado_estadisticas()
+
+    correr(listado([1, 3, 4]), '2025-08-04')
+    incremental = u.actualizar_estado_estadisticas()
+
+    assert _comparables(incremental) == _comparables(u.actualizar_estado_estadisticas(reconstruir=True))
+    assert incremental['total_activos'] == 3
+
+def test_estadisticas_desde_los_snapshots(directorio, listado, correr):
+    correr(listado([1, 2, 3]), '2025-07-28')
+    correr(listado([1, 2, 4], cambios={1: {'marca': 'OTRA'}}), '2025-08-04')
+    u.compactar_historico()
+    # En el snapshot tipo_cambio es categórica y conserva 'modificacion' aunque se filtre
+    df_historico, _ = u.leer_snapshot(u.ARCHIVO_HISTORICO)
+    df_altas_bajas, _ = u.leer_snapshot(u.ARCHIVO_ALTAS_BAJAS)
+    assert df_altas_bajas['tipo_cambio'].dtype == 'category'
+
+    estado = u.construir_estado_estadisticas(u._fechas_como_texto(df_historico), u._fechas_como_texto(df_altas_bajas))
+
+    esperado = u.construir_estado_estadisticas(pd.read_csv(u.ARCHIVO_HISTORICO), pd.read_csv(u.ARCHIVO_ALTAS_BAJAS))
+    assert estado == esperado
+    assert estado['semanas'] == {'2025-08-04': {'altas_nuevas': 1, 'altas_reactivadas': 0, 'bajas': 1}}
+
+def test_rebuild_stats_despues_de_compactar(directorio, listado, correr):
+    shutil.copy(os.path.join(RAIZ, 'README.md'), '.')
+    correr(listado([1, 2, 3]), '2025-07-28')
+    correr(listado([1, 2, 4], cambios={1: {'marca': 'OTRA'}}), '2025-08-04')
+    u.compactar_historico()
+    u.actualizar_estado_estadisticas()
+
+    stats = u.reconstruir_estadisticas()
+
+    assert stats['total_activos'] == 3
+    assert stats['por_marca']['OTRA'] == 1
+
+def test_segunda_corrida_del_dia_en_las_incrementales(directorio, listado, correr):
+    correr(listado([1, 2, 3]), '2025-07-28')
+    correr(listado([1, 2]), '2025-08-04')
+    u.actualizar_estado_estadisticas()
+
+    # La segunda corrida agrega filas al segmento del día que ya se había contado
+    correr(listado([1, 2, 5]), '2025-08-04')
+    incremental = u.actualizar_estado_estadisticas()
+
+    assert incremental['total_activos'] == 3
+    assert _comparables(incremental) == _comparables(u.actualizar_estado_estadisticas(reconstruir=True))
+
+def test_baja_y_modificacion_el_mismo_dia(directorio, listado, correr):
+    correr(listado([1, 2, 3]), '2025-07-28')
+    u.actualizar_estado_estadisticas()
+
+    # La primera corrida del día solo tiene una baja; la segunda, una modificación
+    correr(listado([1, 2]), '2025-08-04')
+    correr(listado([1, 2], cambios={1: {'marca': 'OTRA'}}), '2025-08-04')
+
+    segmento = pd.read_csv('data/eventos/cambios-2025-08-04.csv')
+    assert list(segmento['tipo_cambio']) == ['baja', 'modificacion']
+    assert segmento['valores_anteriores'].notna().tolist() == [False, True]
+    incremental = u.actualizar_estado_estadisticas()
+    assert incremental['marcas'] == {'MARCA 2': 1, 'OTRA': 1}
+    assert _comparables(incremental) == _comparables(u.actualizar_estado_estadisticas(reconstruir=True))
+
+def test_modificaciones_sin_valores_anteriores():
+    estado = {'total_activos': 1, 'total_bajas': 0, 'total_historico': 1, 'marcas': {'A': 1}, 'tipos': {}, 'tokens': {},
+              'semanas': {}, 'altas_recientes': {}, 'ultimo_cambio_detectado': None}
+    eventos = pd.DataFrame({'id': [1], 'marca': ['A'], 'tipo_cambio': ['modificacion'], 'fecha_cambio': ['2025-08-04']})
+
+    u.aplicar_eventos_estadisticas(estado, eventos)
+
+    assert estado['marcas'] == {'A': 1}
@@ -0,0 +1,108 @@
+"""Histórico de eventos (data/eventos) y vistas compactadas"""
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import update_alg_data as u
+from conftest import RAIZ
+
+def _altas_bajas_previas(listado):
+    """altas_bajas.csv como lo dejaban las versiones sin histórico de eventos"""
+    alta = listado([3]).assign(fecha_alta='2025-07-28', fecha_baja=None, tipo_cambio='alta_nuevo', fecha_cambio='2025-07-28')
+    baja = listado([5]).assign(fecha_alta='2025-07-21', fecha_baja='2025-07-28', tipo_cambio='baja', fecha_cambio='2025-07-28')
+    return pd.concat([alta, baja], ignore_index=True)
+
+def test_altas_bajas_sin_historico_pasan_al_registro(directorio, listado, correr):
+    # Estado del repo: altas_bajas.csv y el último listado, pero sin alg-historico.csv
+    _altas_bajas_previas(listado).to_csv(u.ARCHIVO_ALTAS_BAJAS, index=False)
+    listado([1, 2, 3]).to_csv(u.ARCHIVO_LISTADO, index=False)
+
+    correr(listado([1, 3, 4]), '2025-08-04')
+    u.compactar_historico()
+
+    df_altas_bajas = pd.read_csv(u.ARCHIVO_ALTAS_BAJAS)
+    eventos = set(zip(df_altas_bajas['id'], df_altas_bajas['tipo_cambio'], df_altas_bajas['fecha_cambio']))
+    assert eventos == {(3, 'alta_nuevo', '2025-07-28'), (5, 'baja', '2025-07-28'),
+                       (2, 'baja', '2025-08-04'), (4, 'alta_nuevo', '2025-08-04')}
+
+    df_historico = pd.read_csv(u.ARCHIVO_HISTORICO).set_index('id')
+    assert sorted(df_historico.index) == [1, 2, 3, 4, 5]
+    assert df_historico.loc[3, 'fecha_alta'] == '2025-07-28'
+    # Sin eventos propios: estaba desde antes del registro
+    assert df_historico.loc[1, 'fecha_alta'] == '2025-07-21'
+    assert df_historico['fecha_baja'].dropna().to_dict() == {2: '2025-08-04', 5: '2025-07-28'}
+
+def test_altas_bajas_sin_historico_respeta_las_bajas_del_listado(directorio, listado, correr):
+    # El último listado trae el 5, pero su último evento es una baja
+    _altas_bajas_previas(listado).to_csv(u.ARCHIVO_ALTAS_BAJAS, index=False)
+    listado([1, 3, 5]).to_csv(u.ARCHIVO_LISTADO, index=False)
+
+    u.inicializar_eventos()
+    df_base = pd.read_csv(u.archivo_base()).set_index('id')
+    assert df_base.loc[5, 'fecha_baja'] == '2025-07-28'
+
+    correr(listado([1, 3, 5]), '2025-08-04')
+    u.compactar_historico()
+    df_altas_bajas = pd.read_csv(u.ARCHIVO_ALTAS_BAJAS)
+    assert df_altas_bajas[df_altas_bajas['fecha_cambio'] == '2025-08-04'][['id', 'tipo_cambio']].values.tolist() == \
+        [[5, 'alta_reactivado']]
+    assert pd.isna(pd.read_csv(u.ARCHIVO_HISTORICO).set_index('id').loc[5, 'fecha_baja'])
+
+def test_compactar_conserva_altas_bajas_del_repo(directorio):
+    for archivo in ['altas_bajas.csv', 'alg-listado.csv']:
+        shutil.copy(os.path.join(RAIZ, 'data', archivo), 'data')
+    original = pd.read_csv(u.ARCHIVO_ALTAS_BAJAS)
+
+    u.compactar_historico()
+
+    compactado = pd.read_csv(u.ARCHIVO_ALTAS_BAJAS)
+    assert len(compactado) == len(original)
+    assert not u.filas_fuera_del_registro(u.ARCHIVO_ALTAS_BAJAS, original, ['id', 'tipo_cambio', 'fecha_cambio'])
+    assert len(pd.read_csv(u.ARCHIVO_HISTORICO)) >= len(pd.read_csv(u.ARCHIVO_LISTADO))
+
+def test_compactar_no_pisa_filas_que_no_estan_en_el_registro(directorio, listado, correr):
+    correr(listado([1, 2]), '2025-07-28')
+    correr(listado([1]), '2025-08-04')
+    u.compactar_historico()
+
+    # Una fila agregada a mano a la vista no está en data/eventos
+    extra = listado([9]).assign(tipo_cambio='alta_nuevo', fecha_cambio='2025-08-04')
+    extra.to_csv(u.ARCHIVO_ALTAS_BAJAS, mode='a', header=False, index=False)
+    antes = open(u.ARCHIVO_ALTAS_BAJAS).read()
+
+    with pytest.raises(ValueError, match='no se compacta'):
+        u.compactar_historico()
+    assert open(u.ARCHIVO_ALTAS_BAJAS).read() == antes
+
+def _eventos(df):
+    return sorted(zip(df['id'], df['tipo_cambio'], df['fecha_cambio']))
+
+@pytest.mark.parametrize('con_snapshot', [True, False])
+def test_segunda_corrida_del_dia_despues_de_compactar(directorio, listado, correr, con_snapshot):
+    correr(listado([1, 2, 3]), '2025-07-28')
+    correr(listado([1, 2, 3, 4]), '2025-08-04')
+    u.compactar_historico()
+    if not con_snapshot:
+        for archivo in directorio.glob('data/*.feather'):
+            archivo.unlink()
+    df_altas_bajas, hasta = u._cargar_altas_bajas()
+
+    # Misma fecha que el snapshot: el producto 2 sale del listado
+    correr(listado([1, 3, 4]), '2025-08-04')
+
+    df_historico = u.cargar_historico().set_index('id')
+    assert df_historico.loc[2, 'fecha_baja'] == '2025-08-04'
+    assert df_historico['fecha_baja'].notna().sum() == 1
+    esperados = [(2, 'baja', '2025-08-04'), (4, 'alta_nuevo', '2025-08-04')]
+    assert _eventos(u.cargar_altas_bajas()) == esperados
+    # Lo que se cargó antes de la corrida se pone al día con el segmento del día
+    assert _eventos(u.agregar_segmento_a_altas_bajas(df_altas_bajas, hasta, '2025-08-04')) == esperados
+
+def test_segunda_corrida_del_dia_de_la_carga_inicial(directorio, listado, correr):
+    correr(listado([1, 2, 3]), '2025-07-28')
+    correr(listado([1, 3]), '2025-07-28')
+
+    assert u.cargar_historico().set_index('id').loc[2, 'fecha_baja'] == '2025-07-28'
+    assert _eventos(u.cargar_altas_bajas()) == [(2, 'baja', '2025-07-28')]
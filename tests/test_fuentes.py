@@ -0,0 +1,43 @@
+"""Varias fuentes, cada una con su histórico (rutas_fuente)"""
+import threading
+
+import pandas as pd
+
+import update_alg_data as u
+
+def _en_hilos(*funciones):
+    errores = []
+
+    def correr(funcion):
+        try:
+            funcion()
+        except Exception as e:
+            errores.append(e)
+
+    hilos = [threading.Thread(target=correr, args=(funcion,)) for funcion in funciones]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert not errores
+
+def test_fuentes_en_hilos_con_sus_propias_rutas(directorio, listado, fecha):
+    otra = u.rutas_fuente('otra')
+    semanas = [('2025-07-28', [1, 2, 3], [51, 52]), ('2025-08-04', [1, 3, 4], [52, 53, 54])]
+    for dia, ids_principal, ids_otra in semanas:
+        fecha['hoy'] = dia
+        _en_hilos(lambda: u.actualizar_historico(listado(ids_principal)),
+                  lambda: u.actualizar_historico(listado(ids_otra), rutas=otra))
+
+    assert u.DIR_EVENTOS == 'data/eventos'
+    assert otra['eventos'] == 'data/fuentes/otra/eventos'
+    activos = {nombre: sorted(df.loc[df['fecha_baja'].isna(), 'id'])
+               for nombre, df in [('principal', u.cargar_historico()), ('otra', u.cargar_historico(otra))]}
+    assert activos == {'principal': [1, 3, 4], 'otra': [52, 53, 54]}
+    assert set(u.cargar_altas_bajas(otra)['id']) == {51, 53, 54}
+
+    u.compactar_historico(otra)
+    assert sorted(pd.read_csv(otra['historico'])['id']) == [51, 52, 53, 54]
+
+    combinado = u.escribir_vista_combinada({u.FUENTE_PRINCIPAL: {}, 'otra': {}})
+    assert sorted(combinado['id']) == [1, 2, 3, 4, 51, 52, 53, 54]
@@ -0,0 +1,86 @@
+"""Ingesta del Excel por lotes (leer_excel_por_lotes / ingerir_excel)"""
+import threading
+
+import openpyxl
+import pandas as pd
+import pytest
+
+import update_alg_data as u
+
+@pytest.fixture
+def excel(directorio, listado):
+    archivo = 'data/alg-listado.xlsx'
+    listado(list(range(1, 200))).to_excel(archivo, index=False)
+    return archivo
+
+@pytest.mark.parametrize('perfil, memoria, mismo_hilo', [
+    (False, False, False),
+    (True, False, True),
+    (False, True, True),
+])
+def test_hilo_de_lectura(excel, monkeypatch, perfil, memoria, mismo_hilo):
+    hilos = []
+    lotes_excel = u._lotes_excel
+
+    def registrar_hilo(*args):
+        hilos.append(threading.current_thread())
+        yield from lotes_excel(*args)
+
+    monkeypatch.setattr(u, '_lotes_excel', registrar_hilo)
+    lotes = list(u.leer_excel_por_lotes(excel, 50, u.crear_reporte(perfil=perfil, memoria=memoria)))
+
+    assert sum(len(lote) for lote in lotes) == 199
+    assert (hilos == [threading.current_thread()]) == mismo_hilo
+
+def test_perfil_de_la_ingesta_incluye_la_lectura(excel):
+    reporte = u.crear_reporte(perfil=True)
+    with u.medir_etapa(reporte, 'ingesta'):
+        lotes = list(u.ingerir_excel(excel, u.ARCHIVO_LISTADO, 50, reporte))
+
+    assert sum(len(lote) for lote in lotes) == 199
+    funciones = [f['funcion'] for f in reporte['etapas']['ingesta']['funciones_calientes']]
+    assert any('_lotes_excel' in funcion for funcion in funciones)
+
+def _excel_mixto(archivo):
+    """Export con columnas que mezclan números, texto y celdas vacías entre lotes"""
+    libro = openpyxl.Workbook()
+    hoja = libro.active
+    hoja.append(['id', 'rnpa', 'marca', 'codigo', 'denominacionventa'])
+    filas = [
+        [1, '053-00-027724', 'LA\nMARCA', 123, 'ALFAJOR  DE MAIZ'],
+        [2, 14025421, 'LA MARCA', 123.0, None],
+        [3, '02-123456', None, None, ' GALLETITA '],
+        [None, None, None, None, None],
+        [4, 7.5, 'OTRA MARCA', 4.25, 'HARINA'],
+        [5, '053-00-027725', 'OTRA MARCA', 'S/N', 'YERBA'],
+        [6, 14025422, 'MARCA', None, 'FIDEOS'],
+        [7, '02-123457', 'MARCA', 8, 'ARROZ'],
+    ]
+    for fila in filas:
+        hoja.append(fila)
+    libro.save(archivo)
+
+@pytest.mark.parametrize('tamano_lote', [1, 2, 3, 5000])
+def test_igual_a_leer_el_excel_completo(directorio, tamano_lote):
+    _excel_mixto('data/alg-listado.xlsx')
+    # pd.read_excel conserva la fila vacía del medio; la lectura por lotes la saltea
+    completo = pd.read_excel('data/alg-listado.xlsx', dtype=str).dropna(how='all').reset_index(drop=True)
+    completo = u.limpiar_dataframe(completo.assign(id=pd.to_numeric(completo['id'])))
+
+    lotes = pd.concat(u.ingerir_excel('data/alg-listado.xlsx', u.ARCHIVO_LISTADO, tamano_lote), ignore_index=True)
+
+    assert open(u.ARCHIVO_LISTADO).read() == completo.to_csv(index=False)
+    # pd.concat deja NaN en los lotes donde una columna está toda vacía
+    pd.testing.assert_frame_equal(lotes.where(lotes.notna(), None), completo)
+    assert u.huellas_filas(lotes).equals(u.huellas_filas(completo))
+    assert completo['codigo'].tolist()[:2] == ['123', '123']
+
+def test_export_solo_con_encabezado(directorio, listado):
+    listado([1, 2]).to_csv(u.ARCHIVO_LISTADO, index=False)
+    listado([]).to_excel('data/alg-listado.xlsx', index=False)
+
+    lotes = list(u.ingerir_excel('data/alg-listado.xlsx', u.ARCHIVO_LISTADO))
+
+    assert len(lotes) == 1 and lotes[0].empty
+    assert list(lotes[0].columns) == list(listado([]).columns)
+    assert open(u.ARCHIVO_LISTADO).read() == pd.read_excel('data/alg-listado.xlsx').to_csv(index=False)
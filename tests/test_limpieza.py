@@ -0,0 +1,39 @@
+"""Limpieza de espacios del listado (limpiar_dataframe)"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import update_alg_data as u
+from conftest import RAIZ
+
+def limpiar_dataframe_anterior(df):
+    """Implementación fila por fila anterior a normalizar_espacios (convertía los nulos en 'nan'/'None')"""
+    df = df.copy()
+    for columna in df.select_dtypes(include=['object']).columns:
+        df[columna] = df[columna].astype(str).apply(lambda x: ' '.join(x.split()))
+    return df
+
+def test_igual_a_la_implementacion_anterior_en_el_export():
+    lote = next(u._lotes_excel(os.path.join(RAIZ, 'data', 'alg-listado.xlsx'), 5000))
+    pd.testing.assert_frame_equal(u.limpiar_dataframe(lote), limpiar_dataframe_anterior(lote))
+
+def test_igual_a_la_implementacion_anterior_salvo_nulos():
+    df = pd.DataFrame({
+        'id': [1, 2, 3, 4],
+        'marca': ['  LA\nMARCA ', 'LA MARCA', None, 'OTRA\t\tMARCA'],
+        'denominacionventa': ['A\r\nB', np.nan, 'A  B', ' '],
+        'rnpa': [14025421, '053-00-027724', None, 7.5],
+    })
+    limpio, anterior = u.limpiar_dataframe(df), limpiar_dataframe_anterior(df)
+
+    nulos = df.isna()
+    assert limpio[nulos].isna().all().all()
+    pd.testing.assert_frame_equal(limpio.where(~nulos, 'nulo'), anterior.where(~nulos, 'nulo'))
+    assert limpio.loc[0, 'marca'] == 'LA MARCA'
+    assert limpio.loc[3, 'denominacionventa'] == ''
+
+def test_no_modifica_el_original():
+    df = pd.DataFrame({'marca': ['A\nB']})
+    u.limpiar_dataframe(df)
+    assert df.loc[0, 'marca'] == 'A\nB'
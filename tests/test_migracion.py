@@ -0,0 +1,98 @@
+"""Migración de los datos históricos (--migrar)"""
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import update_alg_data as u
+from conftest import RAIZ
+
+def migrar_anterior(df_altas_bajas, df_historico):
+    """Reclasificación fila por fila de antes de reclasificar_altas()"""
+    df_altas_bajas = df_altas_bajas.sort_values('fecha_cambio')
+    df_historico_lookup = df_historico.copy()
+    df_historico_lookup['fecha_baja'] = pd.to_datetime(df_historico_lookup['fecha_baja'], errors='coerce')
+    df_historico_lookup = df_historico_lookup.set_index('id')
+
+    filas_nuevas = []
+    for _, row in df_altas_bajas.iterrows():
+        pid = row.get('id')
+        tipo = str(row.get('tipo_cambio', '')).strip() if pd.notna(row.get('tipo_cambio', '')) else ''
+        try:
+            fecha_dt = pd.to_datetime(row.get('fecha_cambio'))
+        except Exception:
+            fecha_dt = None
+
+        if tipo.startswith('alta'):
+            nuevo_tipo = 'alta_nuevo'
+            if pid in df_historico_lookup.index:
+                fecha_baja_hist = df_historico_lookup.loc[pid].get('fecha_baja')
+                if pd.notna(fecha_baja_hist) and fecha_dt is not None and pd.to_datetime(fecha_baja_hist) <= fecha_dt:
+                    nuevo_tipo = 'alta_reactivado'
+            new_row = row.copy()
+            new_row['tipo_cambio'] = nuevo_tipo
+            filas_nuevas.append(new_row)
+        elif tipo == 'baja':
+            new_row = row.copy()
+            new_row['tipo_cambio'] = 'baja'
+            filas_nuevas.append(new_row)
+        else:
+            filas_nuevas.append(row)
+    return pd.DataFrame(filas_nuevas)
+
+@pytest.fixture
+def fixtures_bak(directorio):
+    """alg-historico.csv y altas_bajas.csv de data/*.bak, sin histórico de eventos"""
+    for archivo in [u.ARCHIVO_HISTORICO, u.ARCHIVO_ALTAS_BAJAS]:
+        shutil.copy(os.path.join(RAIZ, archivo + '.bak'), archivo)
+    df_altas_bajas = pd.read_csv(u.ARCHIVO_ALTAS_BAJAS)
+    df_historico = pd.read_csv(u.ARCHIVO_HISTORICO)
+    return df_altas_bajas, df_historico
+
+def _con_tipos_anteriores(df_altas_bajas):
+    """Las altas como las registraban las versiones sin alta_nuevo/alta_reactivado, más una reactivación"""
+    baja = df_altas_bajas[df_altas_bajas['tipo_cambio'] == 'baja'].iloc[[0]]
+    fecha = df_altas_bajas['fecha_cambio'].max()
+    reactivado = baja.assign(fecha_alta=fecha, fecha_baja=None, tipo_cambio='alta', fecha_cambio=fecha)
+    df = pd.concat([df_altas_bajas, reactivado], ignore_index=True)
+    altas = df['tipo_cambio'].str.startswith('alta')
+    return df.assign(tipo_cambio=df['tipo_cambio'].where(~altas, ' alta'))
+
+@pytest.mark.parametrize('tipos_anteriores', [False, True])
+def test_igual_a_la_migracion_anterior_en_los_bak(fixtures_bak, tipos_anteriores):
+    df_altas_bajas, df_historico = fixtures_bak
+    if tipos_anteriores:
+        df_altas_bajas = _con_tipos_anteriores(df_altas_bajas)
+        df_altas_bajas.to_csv(u.ARCHIVO_ALTAS_BAJAS, index=False)
+    # La vista se regenera desde los eventos, que quedan en el orden del archivo (ya ordenado por fecha)
+    esperado = migrar_anterior(df_altas_bajas, df_historico).sort_index()
+    assert (esperado['tipo_cambio'] == 'alta_reactivado').sum() == tipos_anteriores
+    esperado = esperado.to_csv(index=False)
+
+    u.migrar_datos_historicos()
+    assert open(u.ARCHIVO_ALTAS_BAJAS).read() == esperado
+
+    # La migración quedó en data/eventos: compactar de nuevo no la deshace
+    u.compactar_historico()
+    assert open(u.ARCHIVO_ALTAS_BAJAS).read() == esperado
+
+def test_migrar_despues_de_compactar_conserva_las_reactivaciones(directorio, listado, correr):
+    correr(listado([1, 2, 3]), '2025-08-04')
+    correr(listado([1, 2]), '2025-08-05')
+    correr(listado([1, 2, 3]), '2025-08-06')
+    u.compactar_historico()
+    # La reactivación borró la fecha_baja del histórico: solo el registro de eventos sabe que hubo una baja
+    assert pd.isna(pd.read_csv(u.ARCHIVO_HISTORICO).set_index('id').loc[3, 'fecha_baja'])
+
+    u.migrar_datos_historicos()
+    segmento = u.segmentos_cambios()[-1]
+    for df in [pd.read_csv(segmento), pd.read_csv(u.ARCHIVO_ALTAS_BAJAS)]:
+        assert df.loc[df['id'] == 3, 'tipo_cambio'].tolist()[-1] == 'alta_reactivado'
+
+    # Los eventos ya tipados no se tocan: migrar otra vez no cambia nada
+    segmentos = {s: open(s).read() for s in u.segmentos_cambios()}
+    vista = open(u.ARCHIVO_ALTAS_BAJAS).read()
+    u.migrar_datos_historicos()
+    assert {s: open(s).read() for s in u.segmentos_cambios()} == segmentos
+    assert open(u.ARCHIVO_ALTAS_BAJAS).read() == vista
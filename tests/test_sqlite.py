@@ -0,0 +1,19 @@
+"""Base SQLite consultable (data/alg.sqlite)"""
+import contextlib
+
+import update_alg_data as u
+
+def test_base_sin_eventos(directorio, listado, correr):
+    # Después de la carga inicial todavía no hay segmentos de cambios
+    df_listado = listado([1, 2, 3])
+    df_listado.to_csv(u.ARCHIVO_LISTADO, index=False)
+    correr(df_listado, '2025-07-28')
+    assert u.cargar_altas_bajas().empty
+
+    u.exportar_sqlite()
+
+    with contextlib.closing(u.conectar_base()) as conexion:
+        assert u.cambios_entre('2025-01-01', '2025-12-31', conexion).empty
+        assert len(u.buscar_por_rnpa(df_listado.loc[0, 'rnpa'], conexion)) == 1
+        indices = {fila[0] for fila in conexion.execute("SELECT name FROM sqlite_master WHERE tbl_name = 'eventos'")}
+    assert indices == {'eventos', 'ix_eventos_id', 'ix_eventos_rnpa', 'ix_eventos_fecha'}